@@ -12,54 +12,123 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from timeit import default_timer
+
+_STARTED_AT = default_timer()
+
 import argparse
 import logging
+import signal
 import sys
-import threading
 
+# Only light modules are imported here: the dependencies (python-ant, RxPY,
+# NumPy, lifxlan...) are imported by `main` when they are needed, so that
+# startup can be profiled (see --profile-startup).
 from powerbulb import load_configuration
-from powerbulb.net import (
-    AntNodeFactory,
-    AntChannelFactory,
-    AntDataSourceFactory
-)
-from powerbulb.bulb import LifxLightBulb
-from powerbulb.colors import ColorMap
-from powerbulb.controller import PowerBulbController
+from powerbulb.profiling import StartupProfiler
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 _LOGGER = logging.getLogger('powerbulb')
 
 
-def main(configuration):
-    device = configuration['device']
-    bulb = configuration['bulb']
+def get_device_path(configuration):
+    if 'path' in configuration:
+        return configuration['path']
+    return configuration['device']['path']
 
-    node, network = AntNodeFactory().create(device['path'])
-    channel = AntChannelFactory(node).create(network, device['type'],
-                                             device['number'])
-    source = AntDataSourceFactory().create(device['type'], channel)
 
-    bulb = LifxLightBulb(bulb['ip'], bulb['mac'])
-    color_map = ColorMap.load(configuration['color_map'])
+def create_node(configuration):
+    path = get_device_path(configuration)
+    if path == 'simulator':
+        from powerbulb.simulator import SimulatedNodeFactory
+        return SimulatedNodeFactory().create(configuration.get('simulator'))
+    from powerbulb.net import AntNodeFactory
+    return AntNodeFactory().create(path)
 
-    with PowerBulbController(source, bulb, color_map):
-        completed = threading.Event()
 
-        def on_error(e):
-            _LOGGER.exception(e)
-            completed.set()
+def create_metrics(configuration):
+    """
+    :return: The metrics registry and its reporters (or None and an empty
+    list if metrics are not configured).
+    """
+    if 'metrics' not in configuration:
+        return None, []
+    from powerbulb.metrics import MetricsLogger, MetricsRegistry, MetricsServer
+    settings = configuration['metrics']
+    registry = MetricsRegistry()
+    reporters = []
+    if 'port' in settings:
+        reporters.append(MetricsServer(registry, settings['port'],
+                                       settings.get('host', '127.0.0.1')))
+    if 'log_interval_s' in settings:
+        reporters.append(MetricsLogger(registry, settings['log_interval_s']))
+    return registry, reporters
+
 
-        source.values.subscribe(on_error=on_error,
-                                on_completed=lambda: completed.set())
+def main(configuration, filename=None, profiler=None):
+    """
+    :param profiler: The `StartupProfiler` to report once the riders have
+    started (or None).
+    """
+    report = profiler is not None
+    profiler = profiler or StartupProfiler()
+    # The dependencies are imported in stages so that each can be profiled.
+    import rx  # noqa: F401
+    profiler.mark('import rx')
+    import powerbulb.net  # noqa: F401
+    profiler.mark('import ant')
+    from powerbulb.runtime import Runtime, get_riders
+    profiler.mark('import runtime')
+    riders = get_riders(configuration)
+    engine = configuration.get('engine', 'threads')
+    if engine not in ('threads', 'asyncio'):
+        raise ValueError("'{}' is not a supported engine".format(engine))
+    node, network = create_node(configuration)
+    profiler.mark('create node')
+    metrics, reporters = create_metrics(configuration)
+    if engine == 'asyncio':
+        from powerbulb.aio import AsyncioRuntime
+        runtime = AsyncioRuntime(node, network, metrics=metrics)
+    else:
+        runtime = Runtime(node, network, metrics=metrics)
+    for reporter in reporters:
+        reporter.start()
+    profiler.mark('create runtime')
+
+    def started():
+        profiler.mark('start riders')
+        if report:
+            profiler.report()
+
+    def reload_configuration(*_):
+        _LOGGER.info('reloading configuration=%s', filename)
         try:
-            completed.wait()
-        except KeyboardInterrupt:
-            pass
+            runtime.update(get_riders(load_configuration(filename)))
+        except Exception as e:
+            _LOGGER.exception(e)
 
-    channel.close()
-    node.stop()
+    try:
+        if engine == 'asyncio':
+            if filename is not None and hasattr(signal, 'SIGHUP'):
+                runtime.loop.add_signal_handler(signal.SIGHUP,
+                                                reload_configuration)
+            runtime.run(riders, started)
+        else:
+            if filename is not None and hasattr(signal, 'SIGHUP'):
+                signal.signal(signal.SIGHUP, reload_configuration)
+            runtime.update(riders)
+            started()
+            # Wait with a timeout so that signals are handled.
+            while not runtime.wait(1):
+                pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runtime.stop()
+        node.stop()
+        for reporter in reporters:
+            reporter.close()
 
 
 if __name__ == '__main__':
@@ -67,5 +136,14 @@ if __name__ == '__main__':
         description='Power meter meets smart lightbulb!')
     parser.add_argument('--configuration', '-c', type=str, required=True,
                         help='The configuration file path.')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Log the time taken by each stage of startup.')
     args = parser.parse_args()
-    main(load_configuration(args.configuration))
+    profiler = None
+    if args.profile_startup:
+        profiler = StartupProfiler(_STARTED_AT)
+        profiler.mark('import app')
+    configuration = load_configuration(args.configuration)
+    if profiler is not None:
+        profiler.mark('load configuration')
+    main(configuration, args.configuration, profiler)
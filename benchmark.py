@@ -0,0 +1,91 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+
+from powerbulb.benchmarks import benchmark_bulbs, compare, run_benchmarks
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(number, repeat, bulbs, rate_hz, loss, reply_delay_ms,
+         output=None, baseline=None):
+    results = run_benchmarks(number, repeat)
+    ratios = {}
+    if baseline is not None:
+        with open(baseline, 'r') as f:
+            ratios = compare(results, json.load(f)['results'])
+    for name, rate in sorted(results.items()):
+        line = '{}: {:,.0f}/s'.format(name, rate)
+        if name in ratios:
+            line += ' ({:+.1%})'.format(ratios[name] - 1)
+        print(line)
+    bulb_results = []
+    for count in bulbs:
+        result = benchmark_bulbs(count, rate_hz, loss=loss,
+                                 reply_delay_ms=reply_delay_ms)
+        bulb_results.append(result)
+        print('bulbs ({}): {:.1f} updates/s per bulb, latency p50={:.2f}ms '
+              'p95={:.2f}ms max={:.2f}ms'.format(
+                  count, result['updates_per_s'],
+                  result['latency_ms']['p50'], result['latency_ms']['p95'],
+                  result['latency_ms']['max']))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({
+                'commit': get_commit(),
+                'date': datetime.datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'number': number,
+                'repeat': repeat,
+                'results': results,
+                'bulbs': bulb_results
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Runs the micro-benchmarks.")
+    parser.add_argument('--number', '-n', type=int, default=100000,
+                        help='The number of calls in each run.')
+    parser.add_argument('--repeat', '-r', type=int, default=5,
+                        help='The number of runs (the best is reported).')
+    parser.add_argument('--output', '-o', type=str,
+                        help='The JSON file to save the results to.')
+    parser.add_argument('--baseline', type=str,
+                        help='The JSON results (e.g. of a previous commit) '
+                             'to compare against.')
+    parser.add_argument('--bulbs', '-b', type=int, nargs='*', default=[],
+                        help='The numbers of emulated bulbs to benchmark the '
+                             'controller against (e.g. 1 4 16).')
+    parser.add_argument('--rate', type=float, default=20,
+                        help='The rate (in Hz) of values to each controller.')
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help='The probability that a bulb drops a message.')
+    parser.add_argument('--reply-delay', type=int, default=0,
+                        help='The time (in ms) before a bulb replies.')
+    args = parser.parse_args()
+    main(args.number, args.repeat, args.bulbs, args.rate, args.loss,
+         args.reply_delay, args.output, args.baseline)
@@ -0,0 +1,38 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+
+from powerbulb.colors import BINARY_EXTENSION, ColorMap
+
+
+def main(input, output):
+    if output is None:
+        output = os.path.splitext(input)[0] + BINARY_EXTENSION
+    ColorMap.load(input).save(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Converts a color map between the JSON and the compact "
+                    "binary ({}) formats.".format(BINARY_EXTENSION))
+    parser.add_argument('input', type=str,
+                        help='The color map to convert.')
+    parser.add_argument('--output', '-o', type=str, required=False,
+                        help='The file to which to write the color map '
+                             '(defaults to the input with a {} '
+                             'extension).'.format(BINARY_EXTENSION))
+    args = parser.parse_args()
+    main(args.input, args.output)
@@ -0,0 +1,50 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+
+from powerbulb.colors import (
+    create_ftp_cadence_color_map,
+    create_ftp_hr_color_map
+)
+
+
+def main(ftp, heart_rate, cadence, output, kind):
+    if heart_rate is not None:
+        color_map = create_ftp_hr_color_map(ftp, heart_rate, kind)
+    else:
+        color_map = create_ftp_cadence_color_map(ftp, cadence, kind)
+    color_map.save(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Creates a two dimensional color map of power (colored "
+                    "by FTP) and either heart rate or cadence (which scales "
+                    "the brightness).")
+    parser.add_argument('--ftp', type=int, required=True,
+                        help='The FTP value, specified in W.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--heart_rate', '-hr', type=int,
+                       help='The maximum heart rate value, specified in BPM.')
+    group.add_argument('--cadence', '-c', type=int,
+                       help='The target cadence, specified in RPM.')
+    parser.add_argument('--output', '-o', type=str, required=True,
+                        help='The file to which to write the color map.')
+    parser.add_argument('--kind', '-k', type=str, required=False,
+                        default='discrete',
+                        help='The kind of FTP map (either "discrete" or '
+                             '"continuous").')
+    args = parser.parse_args()
+    main(args.ftp, args.heart_rate, args.cadence, args.output, args.kind)
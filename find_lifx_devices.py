@@ -12,25 +12,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import lifxlan
 import argparse
 
+from powerbulb.discovery import REGISTRY_FILENAME, BulbRegistry, discover
 
-def main():
-    lan = lifxlan.LifxLAN()
-    lights = lan.get_color_lights()
+
+def main(timeout_s, registry_filename, count):
+    bulbs = discover(timeout_s, count=count)
     print('----------------------')
-    print('Found {} color light(s).'.format(len(lights)))
-    for i, light in enumerate(lights):
-        print('----------------------')
-        print('Device {}'.format(i + 1))
-        print('----------------------')
-        print(light)
+    print('Found {} light(s).'.format(len(bulbs)))
+    print('----------------------')
+    for bulb in bulbs:
+        print('{:<20} {:<17} {:<15} product={}'.format(
+            bulb.label, bulb.mac_addr, bulb.ip_addr, bulb.product))
+    if registry_filename:
+        BulbRegistry(registry_filename).update(bulbs)
         print('----------------------')
+        print('Saved to {}.'.format(registry_filename))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description="Discovers LIFX lights on your LAN.")
+    parser.add_argument('--timeout', '-t', type=float, default=1.0,
+                        help='The time (in seconds) to wait for replies.')
+    parser.add_argument('--count', '-n', type=int,
+                        help='Stop once this many lights have replied.')
+    parser.add_argument('--registry', '-r', type=str,
+                        default=REGISTRY_FILENAME,
+                        help='The registry to save the lights to (or empty '
+                             'to not save them).')
     args = parser.parse_args()
-    main()
+    main(args.timeout, args.registry, args.count)
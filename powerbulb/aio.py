@@ -0,0 +1,142 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+
+from rx.concurrency import AsyncIOScheduler
+from rx.subjects import Subject
+
+from powerbulb.runtime import Runtime, create_bulb
+
+_LOGGER = logging.getLogger('powerbulb.aio')
+
+
+class AsyncioSubject(Subject):
+    """
+    A subject of values that may be received on any thread (e.g. the ANT
+    driver thread) but are queued and published on an asyncio event loop.
+    The subject completes when no value is received within `timeout_ms`
+    (unless `on_timeout` recovers, as with `TimeoutSubject`).
+    """
+
+    def __init__(self, timeout_ms, loop, on_timeout=None):
+        super(AsyncioSubject, self).__init__()
+        self.timeout_ms = timeout_ms
+        self._loop = loop
+        self._on_timeout = on_timeout
+        self._queue = None
+        self._task = None
+        # Callbacks run in order, so the queue exists before any value.
+        loop.call_soon_threadsafe(self._start)
+
+    def on_next(self, value):
+        self._loop.call_soon_threadsafe(self._put, value)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._cancel)
+
+    def _start(self):
+        self._queue = asyncio.Queue()
+        self._task = self._loop.create_task(self._run())
+
+    def _put(self, value):
+        self._queue.put_nowait(value)
+
+    def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        timeout_ms = self.timeout_ms
+        timeouts = 0
+        while True:
+            try:
+                value = await asyncio.wait_for(self._queue.get(),
+                                               timeout_ms / 1000.0)
+            except asyncio.TimeoutError:
+                _LOGGER.warning('timeout (%d secs) exceeded',
+                                timeout_ms / 1000)
+                if self._on_timeout is not None:
+                    timeouts += 1
+                    # Recovery (e.g. reopening the channel) waits on the ANT
+                    # node, so it is run off the loop.
+                    timeout_ms = await self._loop.run_in_executor(
+                        None, self._on_timeout, timeouts)
+                    if timeout_ms is not None:
+                        continue
+                super(AsyncioSubject, self).on_completed()
+                return
+            if timeouts:
+                timeouts = 0
+                timeout_ms = self.timeout_ms
+            super(AsyncioSubject, self).on_next(value)
+
+
+class AsyncioRuntime(Runtime):
+    """
+    A runtime whose pipelines run on a single asyncio event loop: values are
+    queued from the ANT driver thread and smoothing, color mapping and bulb
+    sends (which do not block) all happen on the loop, without the timer and
+    sender threads used by `Runtime`.
+
+    Riders must be started and stopped on the loop (e.g. using `call_soon`).
+    """
+
+    def __init__(self, node, network, loop=None, metrics=None):
+        self.loop = loop or asyncio.new_event_loop()
+        Runtime.__init__(self, node, network,
+                         scheduler=AsyncIOScheduler(self.loop),
+                         values_factory=self._create_values,
+                         metrics=metrics)
+
+    def call_soon(self, callback, *args):
+        """
+        Calls `callback` on the loop (from any thread).
+        """
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def run(self, riders, started=None):
+        """
+        Starts `riders` and runs the loop until every rider has stopped.
+        :param started: Called (on the loop) once the riders have started.
+        """
+        errors = []
+
+        def start():
+            try:
+                self.update(riders)
+                if started is not None:
+                    started()
+            except Exception as e:
+                errors.append(e)
+            if errors or self.wait(0):
+                self.loop.stop()
+
+        self.loop.call_soon(start)
+        self.loop.run_forever()
+        if errors:
+            raise errors[0]
+
+    def stop_rider(self, name):
+        Runtime.stop_rider(self, name)
+        if self.wait(0):
+            self.loop.stop()
+
+    def _create_values(self, timeout_ms, on_timeout=None):
+        return AsyncioSubject(timeout_ms, self.loop, on_timeout)
+
+    def _create_bulb(self, configuration, metrics=None, ride_log=None):
+        return create_bulb(configuration, background=False, metrics=metrics,
+                           ride_log=ride_log)
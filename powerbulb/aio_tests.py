@@ -0,0 +1,137 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from mock import Mock, patch
+
+from powerbulb.aio import AsyncioRuntime, AsyncioSubject
+from powerbulb.colors import create_ftp_color_map
+from powerbulb.simulator import SimulatedNode
+
+
+class AsyncioSubjectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.values = []
+        self.completed = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def create_subject(self, timeout_ms, on_timeout=None):
+        subject = AsyncioSubject(timeout_ms, self.loop, on_timeout)
+        subject.subscribe(on_next=self.values.append,
+                          on_completed=lambda: self.completed.append(True))
+        return subject
+
+    def run_loop(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_publishes_values_from_another_thread(self):
+        sut = self.create_subject(1000)
+        thread = threading.Thread(target=lambda: [sut.on_next(value)
+                                                  for value in (1, 2, 3)])
+        thread.start()
+        thread.join()
+
+        self.run_loop(0.05)
+
+        self.assertEqual([1, 2, 3], self.values)
+        sut.close()
+        self.run_loop(0.01)
+
+    def test_completes_on_timeout(self):
+        self.create_subject(50)
+
+        self.run_loop(0.2)
+
+        self.assertEqual([True], self.completed)
+
+    def test_recovers_on_timeout(self):
+        on_timeout = Mock(side_effect=[50, None])
+        sut = self.create_subject(50, on_timeout)
+
+        self.run_loop(0.08)
+        self.assertEqual([], self.completed)
+        sut.on_next(1)
+        self.run_loop(0.2)
+
+        self.assertEqual([1], self.values)
+        self.assertEqual([True], self.completed)
+        # The value resets the attempts.
+        self.assertEqual([((1,),), ((1,),)], on_timeout.call_args_list)
+
+
+class AsyncioRuntimeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.color_map = os.path.join(self.directory, 'ftp.cmap')
+        create_ftp_color_map(250, kind='continuous').save(self.color_map)
+        self.node = SimulatedNode(rate_hz=20, noise=5, seed=1)
+        self.bulb = Mock()
+        self.sut = AsyncioRuntime(self.node, Mock())
+
+    def tearDown(self):
+        self.node.stop()
+        # Runs the cancellation of the stopped sources.
+        self.sut.loop.run_until_complete(asyncio.sleep(0.01))
+        self.sut.loop.close()
+        shutil.rmtree(self.directory)
+
+    def create_rider(self, **controller):
+        return {'name': 'rider', 'bulb': {}, 'color_map': self.color_map,
+                'device': {'type': 'power', 'number': 0},
+                'controller': controller}
+
+    def run_for(self, rider, seconds):
+        with patch('powerbulb.runtime._create_lifx_bulb',
+                   return_value=self.bulb):
+            self.node.start()
+            self.sut.run([rider], started=lambda: self.sut.loop.call_later(
+                seconds, self.sut.stop))
+
+    def test_keeps_emitting_after_send_fails(self):
+        self.bulb.set_color.side_effect = [socket.error('unreachable')] + \
+            [None] * 100
+
+        self.run_for(self.create_rider(emit_interval_ms=100), 1.0)
+
+        self.assertTrue(self.bulb.set_color.call_count > 5,
+                        self.bulb.set_color.call_count)
+
+    def test_keeps_emitting_on_every_value_after_send_fails(self):
+        self.bulb.set_color.side_effect = socket.error('unreachable')
+
+        self.run_for(self.create_rider(emit_interval_ms=None), 1.0)
+
+        self.assertTrue(self.bulb.set_color.call_count > 5,
+                        self.bulb.set_color.call_count)
+
+    def test_stops_rider_on_timeout(self):
+        rider = self.create_rider()
+        rider['device'].update(timeout_ms=100, recovery=False)
+        with patch('powerbulb.runtime._create_lifx_bulb',
+                   return_value=self.bulb):
+            # The node is not started, so the sensor is never found.
+            self.sut.run([rider])
+
+        self.assertEqual([], self.sut.riders)
+        self.bulb.close.assert_called_once_with()
@@ -0,0 +1,315 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import timeit
+
+
+def measure(func, number=100000, repeat=5):
+    """
+    Measures the rate at which `func` can be called.
+    :return: The best rate (in calls per second) of `repeat` runs, each of
+    `number` calls.
+    """
+    return number / min(timeit.repeat(func, number=number, repeat=repeat))
+
+
+def create_power_pages(power=250, cadence=90):
+    """
+    Creates a cycle of Standard Power-Only (0x10) pages in which every page
+    is a new event (as retransmissions are dropped before they are
+    published), so the event count and accumulated power advance (and roll
+    over). The accumulated power is only continuous within a single cycle.
+    """
+    import struct
+    return [bytearray(struct.pack('<BBBBHH', 0x10, i, 0xFF, cadence,
+                                  (i * power) & 0xFFFF, power))
+            for i in range(256)]
+
+
+def benchmark_ant_decoding(number=100000, repeat=5):
+    """
+    Measures the rate at which ANT broadcast messages are decoded (up to
+    publishing the decoded value).
+    :return: A dict of device type to decoded samples per second.
+    """
+    import itertools
+    from rx.subjects import Subject
+    from powerbulb.net import (
+        AntPowerChannelEventCallback,
+        AntHeartRateChannelEventCallback,
+        create_broadcast_message
+    )
+
+    class Source(object):
+        values = Subject()
+
+    pages = {
+        # Standard Power-Only (0x10): 250W at 90RPM.
+        'power': (AntPowerChannelEventCallback, create_power_pages()),
+        # Heart Rate: 150BPM.
+        'hr': (AntHeartRateChannelEventCallback, [
+            bytearray([0x04, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01, 150])]),
+    }
+    results = {}
+    for device_type, (callback_type, device_pages) in pages.items():
+        callback = callback_type(Source())
+        messages = itertools.cycle([
+            create_broadcast_message(bytearray([0]) + page)
+            for page in device_pages])
+        results[device_type] = measure(
+            lambda: callback.process(next(messages), None), number, repeat)
+    return results
+
+
+def benchmark_get_color(stop_counts=(4, 16, 64, 256), number=100000,
+                        repeat=5):
+    """
+    Measures the rate at which colors are looked up, for both kinds of color
+    map with a growing number of stops and for grid color maps with a
+    growing number of columns (of 16 rows).
+    :return: A dict of '<kind>/<stops>' to lookups per second.
+    """
+    import itertools
+    from powerbulb.colors import (
+        Color,
+        ContinuousColorMap,
+        DiscreteColorMap,
+        GridColorMap
+    )
+
+    results = {}
+    for kind, color_map_type in (('discrete', DiscreteColorMap),
+                                 ('continuous', ContinuousColorMap)):
+        for stops in stop_counts:
+            color_map = color_map_type([
+                (i * 1000.0 / stops, Color(float(i) / stops, 1, 1, 0.5))
+                for i in range(stops)])
+            # The same values (spread across and beyond the stops) each run.
+            values = itertools.cycle([i * 1.1 / 97 * 1000 for i in range(97)])
+            results['{}/{}'.format(kind, stops)] = measure(
+                lambda: color_map.get_color(next(values)), number, repeat)
+    for columns in stop_counts:
+        color_map = GridColorMap((0.0, 1000.0), (0.0, 200.0), [
+            [Color(float(i) / columns, 1, float(j) / 16, 0.5)
+             for i in range(columns)]
+            for j in range(16)])
+        values = itertools.cycle([(i * 1.1 / 97 * 1000, i * 1.1 / 97 * 200)
+                                  for i in range(97)])
+        results['grid/{}'.format(columns)] = measure(
+            lambda: color_map.get_color(next(values)), number, repeat)
+    return results
+
+
+def benchmark_controller(number=100000, repeat=5):
+    """
+    Measures the rate at which `PowerBulbController` smooths values and
+    emits colors (in virtual time, with a value every 250ms and a color
+    emitted every 1000ms), and with the mean logging every color to a ride
+    log.
+    :return: A dict of smoothing kind (or 'ride_log') to values per second.
+    """
+    import os
+    import shutil
+    import tempfile
+    from rx.subjects import Subject
+    from rx.testing import TestScheduler
+    from powerbulb.bulb import LightBulb
+    from powerbulb.colors import create_ftp_color_map
+    from powerbulb.controller import PowerBulbController
+    from powerbulb.ridelog import RideLogWriter
+    from powerbulb.smoothing import create_smoother
+
+    class Source(object):
+        values = Subject()
+
+    class Bulb(LightBulb):
+        def set_color(self, color, duration=0):
+            pass
+
+    color_map = create_ftp_color_map(250, 'continuous')
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        for kind in ('mean', 'ewma', 'median', 'ride_log'):
+            source = Source()
+            scheduler = TestScheduler()
+            ride_log = None
+            if kind == 'ride_log':
+                ride_log = RideLogWriter(
+                    os.path.join(directory, 'benchmark.ridelog'))
+                ride_log.start()
+            smoother = create_smoother(
+                'mean' if kind == 'ride_log' else kind, 1000)
+            controller = PowerBulbController(source, Bulb(), color_map,
+                                             scheduler=scheduler,
+                                             smoother=smoother,
+                                             ride_log=ride_log)
+            controller.__enter__()
+            state = {'i': 0}
+
+            def step():
+                i = state['i'] = state['i'] + 1
+                scheduler.advance_by(250)
+                source.values.on_next(100 + (i * 37) % 300)
+
+            results[kind] = measure(step, number, repeat)
+            controller.__exit__(None, None, None)
+            if ride_log is not None:
+                ride_log.close()
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def benchmark_encoding(number=100000, repeat=5):
+    """
+    Measures the rate at which colors are converted to HSBK and encoded as
+    LIFX SetColor messages.
+    :return: A dict of encoder to messages per second.
+    """
+    from powerbulb.bulb import SetColorMessage, encode_set_color, to_hsbk
+    from powerbulb.colors import Color
+
+    color = Color(0.5, 1.0, 0.25, 0.1)
+    message = SetColorMessage(1234, 'd0:73:d5:21:5c:6d')
+    return {
+        'to_hsbk': measure(lambda: list(to_hsbk(color)), number, repeat),
+        'encode_set_color': measure(
+            lambda: encode_set_color(color, 1, 1234), number, repeat),
+        'set_color_message': measure(
+            lambda: message.update(color, 1), number, repeat)
+    }
+
+
+def run_benchmarks(number=100000, repeat=5):
+    """
+    Runs every micro-benchmark.
+    :return: A dict of '<benchmark>/<case>' to the rate per second.
+    """
+    results = {}
+    for name, benchmark in (('ant_decoding', benchmark_ant_decoding),
+                            ('get_color', benchmark_get_color),
+                            ('controller', benchmark_controller),
+                            ('encoding', benchmark_encoding)):
+        for case, rate in benchmark(number=number, repeat=repeat).items():
+            results['{}/{}'.format(name, case)] = rate
+    return results
+
+
+def compare(results, baseline):
+    """
+    Compares results to a baseline (e.g. of a previous commit).
+    :return: A dict of '<benchmark>/<case>' to the ratio of the rate to that
+    of the baseline (above 1 is faster).
+    """
+    return dict((name, rate / baseline[name])
+                for name, rate in results.items()
+                if baseline.get(name))
+
+
+def benchmark_bulbs(bulbs=1, rate_hz=20, duration_s=5.0, loss=0.0,
+                    reply_delay_ms=0, background=True):
+    """
+    Measures the update rate and latency of `PowerBulbController`s, one per
+    emulated bulb (see `EmulatedBulb`), each receiving values at `rate_hz`.
+    The latency is from publishing a value to the bulb receiving its color.
+    :param background: Whether colors are sent from a background thread (see
+    `AsyncLightBulb`).
+    :return: A dict of results.
+    """
+    import numpy as np
+    from rx.subjects import Subject
+    from powerbulb.bulb import AsyncLightBulb, LifxLightBulb
+    from powerbulb.colors import Color, ContinuousColorMap
+    from powerbulb.controller import PowerBulbController
+    from powerbulb.emulator import EmulatedBulb
+    from powerbulb.smoothing import Smoother
+
+    class Source(object):
+        def __init__(self):
+            self.values = Subject()
+
+    class LatestSmoother(Smoother):
+        # Sends every value unchanged so that colors map back to values.
+        def __init__(self):
+            Smoother.__init__(self, 0)
+
+        def add(self, value, timestamp_ms):
+            return value
+
+        def value(self, timestamp_ms):
+            return None
+
+    # The hue of each color (as sent) is the value that produced it.
+    color_map = ContinuousColorMap([(0, Color(0, 1, 1, 0)),
+                                    (65535, Color(1, 1, 1, 0))])
+    emulators = [EmulatedBulb(mac_addr='d0:73:d5:00:00:{:02x}'.format(i + 1),
+                              loss=loss, reply_delay_ms=reply_delay_ms,
+                              clock=time.time)
+                 for i in range(bulbs)]
+    pipelines = []
+    for emulator in emulators:
+        emulator.start()
+        ip_addr, port = emulator.address
+        bulb = LifxLightBulb(ip_addr, emulator.mac_addr, port)
+        if background:
+            bulb = AsyncLightBulb(bulb)
+        source = Source()
+        controller = PowerBulbController(source, bulb, color_map,
+                                         smoother=LatestSmoother(),
+                                         emit_interval_ms=None)
+        controller.__enter__()
+        pipelines.append((source, bulb, controller))
+
+    published = {}
+    count = int(duration_s * rate_hz)
+    started_at = time.time()
+    try:
+        for i in range(count):
+            delay = started_at + float(i) / rate_hz - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            value = i % 65536
+            published[value] = time.time()
+            for source, _, _ in pipelines:
+                source.values.on_next(value)
+        elapsed = time.time() - started_at
+    finally:
+        for _, bulb, controller in pipelines:
+            controller.__exit__(None, None, None)
+            bulb.close()
+        # Allow the last colors to arrive.
+        time.sleep(0.1)
+        for emulator in emulators:
+            emulator.close()
+
+    latencies = np.array(
+        [(color.timestamp - published[color.hue]) * 1000.0
+         for emulator in emulators for color in emulator.colors
+         if color.hue in published])
+    received = len(latencies)
+    if not received:
+        latencies = np.zeros(1)
+    return {
+        'bulbs': bulbs,
+        'published': count * bulbs,
+        'received': received,
+        'updates_per_s': received / elapsed / bulbs,
+        'latency_ms': {
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'max': float(latencies.max())
+        }
+    }
@@ -0,0 +1,64 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from mock import Mock
+
+from powerbulb.benchmarks import compare, create_power_pages, run_benchmarks
+from powerbulb.net import (
+    POWER_MODE_AVERAGE,
+    AntPowerChannelEventCallback,
+    create_broadcast_message
+)
+
+
+class BenchmarksTestCase(unittest.TestCase):
+    def test_runs_benchmarks(self):
+        results = run_benchmarks(number=10, repeat=1)
+
+        for name in ('ant_decoding/power', 'get_color/discrete/256',
+                     'get_color/continuous/4', 'get_color/grid/256',
+                     'controller/median', 'controller/ride_log',
+                     'encoding/to_hsbk'):
+            self.assertTrue(results[name] > 0, name)
+
+    def test_power_pages_decode_to_new_events(self):
+        source = Mock()
+        callback = AntPowerChannelEventCallback(source)
+
+        pages = create_power_pages()
+        for page in pages + pages[:2]:
+            callback.process(create_broadcast_message(bytearray([0]) + page),
+                             None)
+
+        self.assertEqual([250] * 258, [
+            c[0][0] for c in source.values.on_next.call_args_list])
+
+    def test_power_pages_average_to_power(self):
+        source = Mock()
+        callback = AntPowerChannelEventCallback(source, mode=POWER_MODE_AVERAGE)
+
+        for page in create_power_pages():
+            callback.process(create_broadcast_message(bytearray([0]) + page),
+                             None)
+
+        self.assertEqual([250.0] * 255, [
+            c[0][0] for c in source.values.on_next.call_args_list])
+
+    def test_compares_to_baseline(self):
+        ratios = compare({'a': 300.0, 'b': 100.0, 'c': 50.0},
+                         {'a': 200.0, 'b': 0.0})
+
+        self.assertEqual({'a': 1.5}, ratios)
@@ -13,17 +13,151 @@
 # limitations under the License.
 
 import logging
+import random
+import socket
+import struct
+import threading
 
-from lifxlan import Light
+from powerbulb.metrics import clock
 
 _LOGGER = logging.getLogger('powerbulb.bulb')
 
+LIFX_PORT = 56700
+
+# LIFX LAN Protocol (Header)
+# -----------------------------------------------------------------
+# Field               | Type     | Notes
+# -----------------------------------------------------------------
+# Size                | uint16   | Size of the entire message in bytes
+# Protocol/Flags      | uint16   | Protocol=1024, addressable=1, tagged
+# Source              | uint32   | Set by the client
+# Target              | uint64   | MAC address (or 0 for all devices)
+# Reserved            | 6 bytes  |
+# Flags               | uint8    | res_required (bit 0), ack_required (bit 1)
+# Sequence            | uint8    | Wrap around message sequence number
+# Reserved            | uint64   |
+# Type                | uint16   | Message type
+# Reserved            | uint16   |
+# -----------------------------------------------------------------
+LIFX_HEADER = struct.Struct('<HHI8s6sBBQHH')
+LIFX_RES_REQUIRED = 1 << 0
+LIFX_ACK_REQUIRED = 1 << 1
+_LIFX_SEQUENCE_OFFSET = 23
+_LIFX_PROTOCOL = 1024
+_LIFX_ADDRESSABLE = 1 << 12
+_LIFX_TAGGED = 1 << 13
+
+# LIFX LAN Protocol (SetColor, type 102)
+# -----------------------------------------------------------------
+# Field               | Type     | Notes
+# -----------------------------------------------------------------
+# Reserved            | uint8    |
+# Hue                 | uint16   | 0-65535
+# Saturation          | uint16   | 0-65535
+# Brightness          | uint16   | 0-65535
+# Kelvin              | uint16   | 2500-9000
+# Duration            | uint32   | Transition time in ms
+# -----------------------------------------------------------------
+LIFX_SET_COLOR = struct.Struct('<BHHHHI')
+LIFX_SET_COLOR_TYPE = 102
+
 
 def to_hsbk(color):
     values = (color.hue, color.saturation, color.brightness, color.kelvin)
     return map(lambda x: x * 65535, values)
 
 
+def _to_uint16(value):
+    if value <= 0:
+        return 0
+    return min(int(value + 0.5), 65535)
+
+
+def _to_target(mac_addr):
+    mac = bytearray(int(x, 16) for x in mac_addr.split(':'))
+    return bytes(mac.ljust(8, b'\x00'))
+
+
+def encode_message(type, source, sequence=0, mac_addr=None, payload=b'',
+                   flags=0):
+    """
+    Encodes a LIFX message (addressed to all devices if `mac_addr` is None).
+    :param flags: `LIFX_RES_REQUIRED` and/or `LIFX_ACK_REQUIRED` (or 0).
+    """
+    protocol = _LIFX_PROTOCOL | _LIFX_ADDRESSABLE
+    if mac_addr is None:
+        protocol |= _LIFX_TAGGED
+        target = bytes(bytearray(8))
+    else:
+        target = _to_target(mac_addr)
+    return LIFX_HEADER.pack(LIFX_HEADER.size + len(payload), protocol,
+                            source, target, bytes(bytearray(6)), flags,
+                            sequence & 0xFF, 0, type, 0) + payload
+
+
+class SetColorMessage(object):
+    """
+    A reusable LIFX SetColor message (without requiring an acknowledgement or
+    response). The header is encoded once and each update only writes the
+    sequence number and payload in place.
+    """
+
+    def __init__(self, source, mac_addr=None):
+        """
+        :param source: The (non-zero) client identifier.
+        :param mac_addr: The target bulb (or None to address all devices so
+        that the same message can be sent to any bulb).
+        """
+        self.buffer = bytearray(encode_message(
+            LIFX_SET_COLOR_TYPE, source, mac_addr=mac_addr,
+            payload=bytes(bytearray(LIFX_SET_COLOR.size))))
+
+    def update(self, color, sequence, duration=0):
+        """
+        :param color: The color (see `LightBulb.set_color`).
+        :param sequence: The message sequence number (0-255).
+        :param duration: The transition time in milliseconds.
+        :return: The encoded message.
+        """
+        buffer = self.buffer
+        buffer[_LIFX_SEQUENCE_OFFSET] = sequence & 0xFF
+        LIFX_SET_COLOR.pack_into(buffer, LIFX_HEADER.size, 0,
+                                 _to_uint16(color.hue * 65535),
+                                 _to_uint16(color.saturation * 65535),
+                                 _to_uint16(color.brightness * 65535),
+                                 _to_uint16(color.kelvin * 65535),
+                                 duration)
+        return buffer
+
+
+def encode_set_color(color, sequence, source, duration=0):
+    """
+    Encodes a LIFX SetColor message addressed to all devices (see
+    `SetColorMessage`).
+    """
+    return bytes(SetColorMessage(source).update(color, sequence, duration))
+
+
+def create_source():
+    # Source 0 and 1 cause devices to broadcast their responses.
+    return random.randint(2, 0xFFFFFFFF)
+
+
+_socket = None
+_socket_lock = threading.Lock()
+
+
+def get_socket():
+    """
+    :return: The UDP socket shared by every bulb in the process.
+    """
+    global _socket
+    with _socket_lock:
+        if _socket is None:
+            _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return _socket
+
+
 class LightBulb(object):
     def get_power(self):
         raise NotImplementedError()
@@ -34,7 +168,7 @@ class LightBulb(object):
     def turn_off(self):
         raise NotImplementedError()
 
-    def set_color(self, color):
+    def set_color(self, color, duration=0):
         """
         Sets the color of the bulb, specified in HSBK:
 
@@ -44,27 +178,227 @@ class LightBulb(object):
         Kelvin: range 2500 (warm) to 9000 (cool)
 
         :param color: The color to set, specified as a tuple of HSBK values.
+        :param duration: The time (in ms) over which the bulb transitions to
+        the color.
         """
         raise NotImplementedError()
 
+    def close(self):
+        pass
+
 
 class LifxLightBulb(LightBulb):
-    def __init__(self, ip_addr, mac_addr):
+    def __init__(self, ip_addr, mac_addr, port=LIFX_PORT):
         _LOGGER.info('creating ip_addr=%s mac_addr=%s', ip_addr, mac_addr)
-        self._device = Light(mac_addr, ip_addr)
+        self.ip_addr = ip_addr
+        self.mac_addr = mac_addr
+        self.port = port
+        self._device = None
+        # Colors bypass lifxlan (which builds a message per call) and are
+        # sent from the shared socket.
+        self._address = (ip_addr, port)
+        self._message = SetColorMessage(create_source(), mac_addr)
+        self._sequence = 0
+        self._socket = get_socket()
+
+    @classmethod
+    def from_label(cls, label, registry=None):
+        """
+        Creates the bulb with `label`, found in the registry of discovered
+        bulbs (and only discovered if it is not there, see `resolve`).
+        """
+        from powerbulb.discovery import resolve
+        bulb = resolve(label, registry)
+        return cls(bulb.ip_addr, bulb.mac_addr, bulb.port)
 
     def get_power(self):
         _LOGGER.info('getting power')
-        return self._device.get_power() == 65536
+        return self._get_device().get_power() == 65535
 
     def turn_on(self):
         _LOGGER.info('turning on')
-        self._device.set_power(True)
+        self._get_device().set_power(True)
 
     def turn_off(self):
         _LOGGER.info('turning off')
-        self._device.set_power(False)
+        self._get_device().set_power(False)
+
+    def set_color(self, color, duration=0):
+        _LOGGER.debug('setting color=%s duration=%d', color, duration)
+        self._sequence = (self._sequence + 1) & 0xFF
+        self._socket.sendto(
+            self._message.update(color, self._sequence, duration),
+            self._address)
+
+    def _get_device(self):
+        # lifxlan is only used for power (and is slow to import), so it is
+        # imported when first needed.
+        if self._device is None:
+            from lifxlan import Light
+            self._device = Light(self.mac_addr, self.ip_addr, port=self.port)
+        return self._device
+
+
+class BulbGroup(LightBulb):
+    """
+    A group of LIFX bulbs that are set to the same color. Each color is
+    encoded once and sent to every bulb from a single shared UDP socket.
+    """
+
+    def __init__(self, bulbs):
+        """
+        :param bulbs: The bulbs (each having an `ip_addr` and `port`).
+        """
+        assert len(bulbs) > 0
+        _LOGGER.info('creating group of %d bulb(s)', len(bulbs))
+        self._bulbs = bulbs
+        self._addresses = [(bulb.ip_addr, bulb.port) for bulb in bulbs]
+        self._message = SetColorMessage(create_source())
+        self._sequence = 0
+        self._socket = get_socket()
+
+    def get_power(self):
+        return all(bulb.get_power() for bulb in self._bulbs)
+
+    def turn_on(self):
+        for bulb in self._bulbs:
+            bulb.turn_on()
+
+    def turn_off(self):
+        for bulb in self._bulbs:
+            bulb.turn_off()
+
+    def set_color(self, color, duration=0):
+        _LOGGER.debug('setting color=%s duration=%d', color, duration)
+        self._sequence = (self._sequence + 1) & 0xFF
+        message = self._message.update(color, self._sequence, duration)
+        for address in self._addresses:
+            try:
+                self._socket.sendto(message, address)
+            except socket.error:
+                _LOGGER.exception('failed to send to %s', address)
+
+    def close(self):
+        for bulb in self._bulbs:
+            bulb.close()
+
+
+class LightBulbWrapper(LightBulb):
+    """
+    Wraps a bulb, delegating to it (subclasses override what they add).
+    """
+
+    def __init__(self, bulb):
+        self._bulb = bulb
+
+    def get_power(self):
+        return self._bulb.get_power()
+
+    def turn_on(self):
+        self._bulb.turn_on()
+
+    def turn_off(self):
+        self._bulb.turn_off()
+
+    def set_color(self, color, duration=0):
+        self._bulb.set_color(color, duration)
+
+    def close(self):
+        self._bulb.close()
+
+
+class InstrumentedLightBulb(LightBulbWrapper):
+    """
+    Wraps a bulb to measure the time taken by `set_color` and count its
+    failures (see `RiderMetrics`).
+    """
+
+    def __init__(self, bulb, metrics):
+        LightBulbWrapper.__init__(self, bulb)
+        self._metrics = metrics
+
+    def set_color(self, color, duration=0):
+        started_at = clock()
+        try:
+            self._bulb.set_color(color, duration)
+        except Exception:
+            self._metrics.on_send(started_at, False)
+            raise
+        self._metrics.on_send(started_at, True)
+
+
+class FailSafeLightBulb(LightBulbWrapper):
+    """
+    Wraps a bulb so that a failure to send a color (e.g. while the network
+    is down) is logged rather than raised, as with `AsyncLightBulb`. Colors
+    sent from the caller's thread (e.g. an asyncio loop) would otherwise
+    raise into the controller and stop its timer.
+    """
+
+    def set_color(self, color, duration=0):
+        try:
+            self._bulb.set_color(color, duration)
+        except Exception:
+            _LOGGER.exception('failed to set color=%s', color)
+
+
+class RideLogLightBulb(LightBulbWrapper):
+    """
+    Wraps a bulb to log the time taken by `set_color` (see `RideLogWriter`).
+    """
+
+    def __init__(self, bulb, ride_log):
+        LightBulbWrapper.__init__(self, bulb)
+        self._ride_log = ride_log
+
+    def set_color(self, color, duration=0):
+        started_at = clock()
+        self._bulb.set_color(color, duration)
+        self._ride_log.log_send(color, (clock() - started_at) * 1000.0)
+
+
+class AsyncLightBulb(LightBulbWrapper):
+    """
+    Wraps a bulb so that `set_color` never blocks on the network. Colors are
+    sent from a background thread and, if the bulb is slow, only the newest
+    pending color is sent (older pending colors are discarded).
+    """
+
+    def __init__(self, bulb):
+        LightBulbWrapper.__init__(self, bulb)
+        self._condition = threading.Condition()
+        self._pending = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='bulb-sender')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def set_color(self, color, duration=0):
+        with self._condition:
+            if self._pending is not None:
+                _LOGGER.debug('discarding color=%s', self._pending[0])
+            self._pending = (color, duration)
+            self._condition.notify()
+
+    def close(self):
+        """
+        Stops the background thread once any pending color has been sent.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._bulb.close()
 
-    def set_color(self, color):
-        _LOGGER.debug('setting color=%s', color)
-        self._device.set_color(to_hsbk(color), rapid=True)
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return  # closed (after sending any pending color)
+                (color, duration), self._pending = self._pending, None
+            try:
+                self._bulb.set_color(color, duration)
+            except Exception:
+                _LOGGER.exception('failed to set color=%s', color)
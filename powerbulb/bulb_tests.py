@@ -0,0 +1,225 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import struct
+import threading
+import unittest
+
+from mock import Mock
+
+from powerbulb.bulb import (
+    AsyncLightBulb,
+    BulbGroup,
+    LIFX_RES_REQUIRED,
+    LIFX_SET_COLOR_TYPE,
+    LifxLightBulb,
+    SetColorMessage,
+    encode_message,
+    encode_set_color
+)
+from powerbulb.colors import Color
+
+
+def decode_set_color(message):
+    header = struct.unpack_from('<HHI8s6sBBQHH', message)
+    payload = struct.unpack_from('<BHHHHI', message, 36)
+    return header, payload
+
+
+def create_listener(ip_addr, port=0):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listener.settimeout(5)
+    listener.bind((ip_addr, port))
+    return listener
+
+
+class EncodeMessageTestCase(unittest.TestCase):
+    def test_encodes_header(self):
+        message = encode_message(23, 1234, 257, 'd0:73:d5:21:5c:6d', b'\x01',
+                                 flags=LIFX_RES_REQUIRED)
+        size, protocol, source, target, _, flags, sequence, _, type, _ = \
+            struct.unpack_from('<HHI8s6sBBQHH', message)
+        self.assertEqual(37, len(message))
+        self.assertEqual(37, size)
+        self.assertEqual(1024 | (1 << 12), protocol)
+        self.assertEqual(1234, source)
+        self.assertEqual(b'\xd0\x73\xd5\x21\x5c\x6d\x00\x00', target)
+        self.assertEqual(1, flags)
+        self.assertEqual(1, sequence)
+        self.assertEqual(23, type)
+        self.assertEqual(b'\x01', message[36:])
+
+
+class EncodeSetColorTestCase(unittest.TestCase):
+    def test_encodes_set_color(self):
+        message = encode_set_color(Color(0.5, 1.0, 0.25, 0.1), 7, 1234,
+                                   duration=250)
+        header, payload = decode_set_color(message)
+        size, protocol, source, target, _, flags, sequence, _, type, _ = \
+            header
+        self.assertEqual(49, len(message))
+        self.assertEqual(49, size)
+        self.assertEqual(1024 | (1 << 12) | (1 << 13), protocol)
+        self.assertEqual(1234, source)
+        self.assertEqual(b'\x00' * 8, target)
+        self.assertEqual(0, flags)
+        self.assertEqual(7, sequence)
+        self.assertEqual(LIFX_SET_COLOR_TYPE, type)
+        self.assertEqual((0, 32768, 65535, 16384, 6554, 250), payload)
+
+    def test_clamps_channels(self):
+        message = encode_set_color(Color(-1, 2, 0, 0), 0, 1234)
+        _, payload = decode_set_color(message)
+        self.assertEqual((0, 0, 65535, 0, 0, 0), payload)
+
+
+class SetColorMessageTestCase(unittest.TestCase):
+    def test_encodes_target(self):
+        sut = SetColorMessage(1234, 'd0:73:d5:21:5c:6d')
+        header, _ = decode_set_color(sut.update(Color(0, 0, 0, 0), 1))
+        self.assertEqual(1024 | (1 << 12), header[1])
+        self.assertEqual(b'\xd0\x73\xd5\x21\x5c\x6d\x00\x00', header[3])
+
+    def test_updates_message_in_place(self):
+        sut = SetColorMessage(1234)
+        first = sut.update(Color(0.5, 1.0, 0.25, 0.1), 1)
+        second = sut.update(Color(1.0, 0.5, 0.5, 0.2), 2)
+        self.assertIs(first, second)
+        self.assertEqual(
+            encode_set_color(Color(1.0, 0.5, 0.5, 0.2), 2, 1234),
+            bytes(second))
+
+
+class LifxLightBulbTestCase(unittest.TestCase):
+    def setUp(self):
+        self.listener = create_listener('127.0.0.1')
+        self.sut = LifxLightBulb('127.0.0.1', 'd0:73:d5:21:5c:6d',
+                                 port=self.listener.getsockname()[1])
+
+    def tearDown(self):
+        self.sut.close()
+        self.listener.close()
+
+    def test_sends_set_color_to_bulb(self):
+        self.sut.set_color(Color(0.5, 1.0, 0.25, 0.1))
+        self.sut.set_color(Color(1.0, 0.5, 0.5, 0.2))
+        first = decode_set_color(self.listener.recv(1024))
+        second = decode_set_color(self.listener.recv(1024))
+        self.assertEqual(b'\xd0\x73\xd5\x21\x5c\x6d\x00\x00', first[0][3])
+        self.assertEqual((first[0][6] + 1) % 256, second[0][6])
+        self.assertEqual((0, 32768, 65535, 16384, 6554, 0), first[1])
+        self.assertEqual((0, 65535, 32768, 32768, 13107, 0), second[1])
+
+    def test_sends_set_color_with_duration(self):
+        self.sut.set_color(Color(0.5, 1.0, 0.25, 0.1), 750)
+        _, payload = decode_set_color(self.listener.recv(1024))
+        self.assertEqual(750, payload[5])
+
+
+class BulbGroupTestCase(unittest.TestCase):
+    def setUp(self):
+        # Each bulb has its own port (e.g. emulated bulbs).
+        self.listeners = [create_listener('127.0.0.1'),
+                          create_listener('127.0.0.2')]
+        self.bulbs = [Mock(ip_addr=ip_addr, port=port) for ip_addr, port in
+                      (listener.getsockname() for listener in self.listeners)]
+        self.sut = BulbGroup(self.bulbs)
+
+    def tearDown(self):
+        self.sut.close()
+        for listener in self.listeners:
+            listener.close()
+
+    def test_sends_same_message_to_every_bulb(self):
+        self.sut.set_color(Color(0.5, 1.0, 0.25, 0.1))
+        messages = [listener.recv(1024) for listener in self.listeners]
+        self.assertEqual(messages[0], messages[1])
+        _, payload = decode_set_color(messages[0])
+        self.assertEqual((0, 32768, 65535, 16384, 6554, 0), payload)
+
+    def test_increments_sequence(self):
+        self.sut.set_color(Color(0.5, 1.0, 0.25, 0.1))
+        self.sut.set_color(Color(0.5, 1.0, 0.25, 0.1))
+        first = decode_set_color(self.listeners[0].recv(1024))[0]
+        second = decode_set_color(self.listeners[0].recv(1024))[0]
+        self.assertEqual((first[6] + 1) % 256, second[6])
+
+    def test_turns_on_every_bulb(self):
+        self.sut.turn_on()
+        for bulb in self.bulbs:
+            bulb.turn_on.assert_called_once_with()
+
+    def test_closes_every_bulb(self):
+        self.sut.close()
+        for bulb in self.bulbs:
+            bulb.close.assert_called_once_with()
+
+
+class AsyncLightBulbTestCase(unittest.TestCase):
+    def setUp(self):
+        self.bulb = Mock()
+        self.sut = AsyncLightBulb(self.bulb)
+
+    def tearDown(self):
+        self.sut.close()
+
+    def test_sets_color_in_background(self):
+        sent = threading.Event()
+        self.bulb.set_color.side_effect = lambda *_: sent.set()
+        self.sut.set_color(Color(1, 1, 1, 1))
+        self.assertTrue(sent.wait(5))
+        self.bulb.set_color.assert_called_once_with(Color(1, 1, 1, 1), 0)
+
+    def test_sets_color_with_duration_in_background(self):
+        sent = threading.Event()
+        self.bulb.set_color.side_effect = lambda *_: sent.set()
+        self.sut.set_color(Color(1, 1, 1, 1), 500)
+        self.assertTrue(sent.wait(5))
+        self.bulb.set_color.assert_called_once_with(Color(1, 1, 1, 1), 500)
+
+    def test_sends_only_newest_color_while_bulb_is_busy(self):
+        started = threading.Event()
+        release = threading.Event()
+        sent = []
+
+        def set_color(color, duration):
+            started.set()
+            release.wait(5)
+            sent.append(color)
+
+        self.bulb.set_color.side_effect = set_color
+        self.sut.set_color(Color(1, 1, 1, 1))
+        self.assertTrue(started.wait(5))
+        self.sut.set_color(Color(2, 2, 2, 2))
+        self.sut.set_color(Color(3, 3, 3, 3))
+        release.set()
+        self.sut.close()
+        self.assertEqual([Color(1, 1, 1, 1), Color(3, 3, 3, 3)], sent)
+
+    def test_continues_after_failure(self):
+        failed = threading.Event()
+
+        def set_color(color, duration):
+            if not failed.is_set():
+                failed.set()
+                raise IOError()
+
+        self.bulb.set_color.side_effect = set_color
+        self.sut.set_color(Color(1, 1, 1, 1))
+        self.assertTrue(failed.wait(5))
+        self.sut.set_color(Color(2, 2, 2, 2))
+        self.sut.close()
+        self.bulb.set_color.assert_called_with(Color(2, 2, 2, 2), 0)
+        self.assertEqual(2, self.bulb.set_color.call_count)
@@ -12,48 +12,206 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import numpy as np
-import jsonpickle
+import math
+import struct
+import sys
+from array import array
+from bisect import bisect_right
 from collections import namedtuple
 
 Color = namedtuple('Color', ['hue', 'saturation', 'brightness', 'kelvin'])
 
-jsonpickle.set_encoder_options('json', indent=4)
+# Compact binary format
+# -----------------------------------------------------------------
+# Offset | Description          | Type          | Notes
+# -----------------------------------------------------------------
+# 0      | Magic                | 4 bytes       | "PBCM"
+# 4      | Version              | uint16 (LE)   | 1
+# 6      | Kind                 | uint8         | 0=discrete, 1=continuous,
+#        |                      |               | 2=grid
+# 7      | Reserved             | uint8         | 0
+# 8      | Number of stops (N)  | uint32 (LE)   | Cells for a grid
+# 12     | Stops                | N * 5 float32 | value, H, S, B, K
+# -----------------------------------------------------------------
+# A grid has a grid header in place of the stops:
+# 12     | Columns (X)          | uint16 (LE)   |
+# 14     | Rows (Y)             | uint16 (LE)   | N = X * Y
+# 16     | X range              | 2 float32     | lower, upper
+# 24     | Y range              | 2 float32     | lower, upper
+# 32     | Cells                | N * 4 float32 | H, S, B, K (by row)
+# -----------------------------------------------------------------
+BINARY_EXTENSION = '.cmap'
+_BINARY_MAGIC = b'PBCM'
+_BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct('<4sHBBI')
+_BINARY_STOP_TYPECODE = 'f'
+_BINARY_GRID_HEADER = struct.Struct('<HHffff')
+_BINARY_KINDS = ('discrete', 'continuous', 'grid')
 
 
 class ColorMap(object):
+    KIND = None
+
     def save(self, filename):
+        """
+        Saves the color map, as compact binary if `filename` has the
+        `BINARY_EXTENSION` and otherwise as JSON.
+        """
+        if filename.endswith(BINARY_EXTENSION):
+            self.save_binary(filename)
+        else:
+            self.save_json(filename)
+
+    def save_json(self, filename):
+        import jsonpickle
+        jsonpickle.set_encoder_options('json', indent=4)
         with open(filename, 'w') as f:
             f.write(jsonpickle.encode(self, f))
 
+    def save_binary(self, filename):
+        stops = self.get_color_stops()
+        table = array(_BINARY_STOP_TYPECODE)
+        for value, color in stops:
+            table.extend((value,) + tuple(color))
+        _write_binary(filename, self.KIND, len(stops), table)
+
     @staticmethod
     def load(filename):
+        """
+        Loads a color map saved in either the binary or the JSON format.
+        """
+        with open(filename, 'rb') as f:
+            header = f.read(_BINARY_HEADER.size)
+        if header.startswith(_BINARY_MAGIC):
+            return ColorMap.load_binary(filename)
+        return ColorMap.load_json(filename)
+
+    @staticmethod
+    def load_json(filename):
+        import jsonpickle
         with open(filename, 'r') as f:
-            return jsonpickle.decode(f.read())
+            color_map = jsonpickle.decode(f.read())
+        # Maps saved before the lookup engine existed are restored without
+        # calling __init__ or __setstate__.
+        color_map._compile()
+        return color_map
+
+    @staticmethod
+    def load_binary(filename):
+        # Loaded without NumPy, which is slow to import (see `get_colors`).
+        with open(filename, 'rb') as f:
+            header = f.read(_BINARY_HEADER.size)
+            data = f.read()
+        if len(header) < _BINARY_HEADER.size:
+            raise ValueError('Truncated color map: "{}".'.format(filename))
+        magic, version, kind, _, count = _BINARY_HEADER.unpack(header)
+        if magic != _BINARY_MAGIC:
+            raise ValueError('Not a binary color map: "{}".'.format(filename))
+        if version != _BINARY_VERSION:
+            raise ValueError(
+                'Unsupported color map version: {}.'.format(version))
+        if kind >= len(_BINARY_KINDS):
+            raise ValueError('Unknown kind: {}.'.format(kind))
+        if _BINARY_KINDS[kind] == GridColorMap.KIND:
+            return GridColorMap._load_binary(filename, count, data)
+        table = _read_binary_table(filename, data, count * 5)
+        stops = [(table[i], Color(*table[i + 1:i + 5]))
+                 for i in range(0, len(table), 5)]
+        return _create_color_map(stops, _BINARY_KINDS[kind])
+
+    def get_color_stops(self):
+        """
+        :return: The list of (value, color) stops that defines the map.
+        """
+        raise NotImplementedError()
 
     def get_color(self, value):
         raise NotImplementedError()
 
+    def get_colors(self, values):
+        """
+        Gets the colors for many values at once.
+        :param values: A sequence (or NumPy array) of values.
+        :return: An (N, 4) float array of hue, saturation, brightness and
+        kelvin (one row per value).
+        """
+        import numpy as np
+        colors = [self.get_color(value) for value in np.ravel(values)]
+        return np.array(colors, dtype=float).reshape(-1, 4)
+
+    def _compile(self):
+        """
+        Builds the lookup structures used by `get_color` from the public state.
+        """
+        pass
+
+    def _get_arrays(self):
+        # The arrays of `get_colors` are built on first use (and reset by
+        # `_compile`), so that NumPy is only imported when it is needed.
+        if self._arrays is None:
+            self._arrays = self._create_arrays()
+        return self._arrays
+
+    def _create_arrays(self):
+        """
+        :return: The NumPy arrays used by `get_colors`.
+        """
+        raise NotImplementedError()
+
+    def __getstate__(self):
+        # Only the public state is persisted; the lookup structures are
+        # rebuilt by `_compile` when the map is restored.
+        return dict((k, v) for k, v in self.__dict__.items()
+                    if not k.startswith('_'))
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
+
 
 class DiscreteColorMap(ColorMap):
+    KIND = 'discrete'
+
     def __init__(self, color_stops):
         assert len(color_stops) > 0
         self.color_stops = color_stops
+        self._compile()
+
+    def get_color_stops(self):
+        return list(self.color_stops)
+
+    def _compile(self):
+        stops = sorted(self.color_stops, key=lambda stop: stop[0])
+        self._lower_bounds = [lower for lower, _ in stops]
+        self._colors = [Color(*color) for _, color in stops]
+        self._arrays = None
 
     def get_color(self, value):
-        result = None
-        for i, stop in enumerate(self.color_stops):
-            lower, colour = stop
-            if i == 0:
-                result = colour
-                continue
-            if lower > value:
-                break
-            result = colour
-        return result
+        # The first stop also covers every value below its lower bound.
+        i = bisect_right(self._lower_bounds, value)
+        return self._colors[i - 1 if i > 0 else 0]
+
+    def get_colors(self, values):
+        import numpy as np
+        lower_bounds, colors = self._get_arrays()
+        values = np.ravel(np.asarray(values, dtype=float))
+        i = np.searchsorted(lower_bounds, values, side='right')
+        return colors[np.maximum(i - 1, 0)]
+
+    def _create_arrays(self):
+        import numpy as np
+        return (np.array(self._lower_bounds, dtype=float),
+                np.array(self._colors, dtype=float).reshape(-1, 4))
 
 
 class ContinuousColorMap(ColorMap):
+    KIND = 'continuous'
+    # The number of lookup table cells per unit (i.e. W or BPM).
+    LOOKUP_RESOLUTION = 1
+    # The maximum number of lookup table cells, values beyond the table are
+    # resolved by bisecting the stops instead.
+    LOOKUP_SIZE = 4096
+
     def __init__(self, color_stops):
         assert len(color_stops) > 0
         self.values = []
@@ -67,13 +225,266 @@ class ContinuousColorMap(ColorMap):
             self.saturation.append(color.saturation)
             self.brightness.append(color.brightness)
             self.kelvin.append(color.kelvin)
+        self._compile()
+
+    def get_color_stops(self):
+        colors = zip(self.hue, self.saturation, self.brightness, self.kelvin)
+        return [(value, Color(*color))
+                for value, color in zip(self.values, colors)]
+
+    def _compile(self):
+        values = [float(x) for x in self.values]
+        colors = [Color(*map(float, color)) for color in
+                  zip(self.hue, self.saturation, self.brightness, self.kelvin)]
+        self._lower, self._upper = values[0], values[-1]
+        self._first, self._last = colors[0], colors[-1]
+        # Each segment is stored as (start, end, color at start, slope).
+        self._segments = []
+        for i in range(len(values) - 1):
+            x0, x1 = values[i], values[i + 1]
+            if x1 <= x0:
+                continue
+            slope = Color(*[(c1 - c0) / (x1 - x0)
+                            for c0, c1 in zip(colors[i], colors[i + 1])])
+            self._segments.append((x0, x1, colors[i], slope))
+        self._starts = [segment[0] for segment in self._segments]
+        self._arrays = None
+        # The table maps each cell to the segment containing its lower edge.
+        size = int(math.ceil((self._upper - self._lower) *
+                             self.LOOKUP_RESOLUTION))
+        self._table = [
+            bisect_right(self._starts,
+                         self._lower + float(i) / self.LOOKUP_RESOLUTION) - 1
+            for i in range(min(size, self.LOOKUP_SIZE))
+        ]
 
     def get_color(self, value):
-        h = np.interp(value, self.values, self.hue)
-        s = np.interp(value, self.values, self.saturation)
-        b = np.interp(value, self.values, self.brightness)
-        k = np.interp(value, self.values, self.kelvin)
-        return Color(h, s, b, k)
+        # Outside of the stops the color is clamped (as with `np.interp`).
+        if value <= self._lower:
+            return self._first
+        if value >= self._upper:
+            return self._last
+        cell = int((value - self._lower) * self.LOOKUP_RESOLUTION)
+        if cell < len(self._table):
+            i = self._table[cell]
+            # A stop can fall within a cell, in which case the value may
+            # belong to one of the following segments.
+            while value >= self._segments[i][1]:
+                i += 1
+        else:
+            i = bisect_right(self._starts, value) - 1
+        x0, _, c, m = self._segments[i]
+        d = value - x0
+        return Color(c.hue + m.hue * d,
+                     c.saturation + m.saturation * d,
+                     c.brightness + m.brightness * d,
+                     c.kelvin + m.kelvin * d)
+
+    def get_colors(self, values):
+        import numpy as np
+        values = np.ravel(np.asarray(values, dtype=float))
+        if not self._segments:
+            return np.tile(np.array(self._first, dtype=float),
+                           (len(values), 1))
+        starts, colors, slopes = self._get_arrays()
+        clipped = np.clip(values, self._lower, self._upper)
+        i = np.searchsorted(starts, clipped, side='right') - 1
+        i = np.clip(i, 0, len(self._segments) - 1)
+        d = clipped - starts[i]
+        result = colors[i] + slopes[i] * d[:, np.newaxis]
+        # As with `get_color`, the first and last stops win at the bounds
+        # (where stops may share a value).
+        result[values <= self._lower] = self._first
+        result[values >= self._upper] = self._last
+        return result
+
+    def _create_arrays(self):
+        import numpy as np
+        return (np.array(self._starts, dtype=float),
+                np.array([segment[2] for segment in self._segments],
+                         dtype=float),
+                np.array([segment[3] for segment in self._segments],
+                         dtype=float))
+
+
+class GridColorMap(ColorMap):
+    """
+    A map of two values (e.g. power and heart rate) to color, stored as a
+    dense grid of colors evenly spaced over a range of each value. Colors
+    between the grid points are interpolated bilinearly, so a lookup takes
+    the same time whatever the size of the grid.
+    """
+    KIND = 'grid'
+
+    def __init__(self, x_range, y_range, colors):
+        """
+        :param x_range: The (lower, upper) range of the first value.
+        :param y_range: The (lower, upper) range of the second value.
+        :param colors: The rows of the grid (one per second value, from
+        lower to upper), each of which is a list of colors (one per first
+        value, from lower to upper). There are at least two of each.
+        """
+        assert len(colors) > 1 and len(colors[0]) > 1
+        self.x_range = list(x_range)
+        self.y_range = list(y_range)
+        self.hue = []
+        self.saturation = []
+        self.brightness = []
+        self.kelvin = []
+        for row in colors:
+            assert len(row) == len(colors[0])
+            self.hue.append([color.hue for color in row])
+            self.saturation.append([color.saturation for color in row])
+            self.brightness.append([color.brightness for color in row])
+            self.kelvin.append([color.kelvin for color in row])
+        self._compile()
+
+    @property
+    def shape(self):
+        """
+        :return: The number of (columns, rows) of the grid.
+        """
+        return self._columns, self._rows
+
+    def get_color_stops(self):
+        raise TypeError('A grid color map has no color stops.')
+
+    def save_binary(self, filename):
+        header = _BINARY_GRID_HEADER.pack(self._columns, self._rows,
+                                          *(self.x_range + self.y_range))
+        _write_binary(filename, self.KIND, self._columns * self._rows,
+                      array(_BINARY_STOP_TYPECODE, self._cells), header)
+
+    @staticmethod
+    def _load_binary(filename, count, data):
+        if len(data) < _BINARY_GRID_HEADER.size:
+            raise ValueError('Truncated color map: "{}".'.format(filename))
+        columns, rows, x0, x1, y0, y1 = _BINARY_GRID_HEADER.unpack(
+            data[:_BINARY_GRID_HEADER.size])
+        if columns * rows != count:
+            raise ValueError('Invalid grid: "{}".'.format(filename))
+        table = _read_binary_table(
+            filename, data[_BINARY_GRID_HEADER.size:], count * 4)
+        colors = [[Color(*table[i:i + 4])
+                   for i in range(start, start + columns * 4, 4)]
+                  for start in range(0, len(table), columns * 4)]
+        return GridColorMap((x0, x1), (y0, y1), colors)
+
+    def _compile(self):
+        self._rows = len(self.hue)
+        self._columns = len(self.hue[0])
+        # The cells are stored as a flat row-major table of H, S, B, K.
+        self._cells = array('d')
+        for channels in zip(self.hue, self.saturation, self.brightness,
+                            self.kelvin):
+            for color in zip(*channels):
+                self._cells.extend(color)
+        self._x_lower, self._x_scale = _get_grid_axis(self.x_range,
+                                                      self._columns)
+        self._y_lower, self._y_scale = _get_grid_axis(self.y_range,
+                                                      self._rows)
+        self._arrays = None
+
+    def get_color(self, value):
+        """
+        :param value: The (first, second) values. Outside of the grid, the
+        color is clamped to its edge.
+        """
+        x, y = value
+        column, fx = _get_grid_position(x, self._x_lower, self._x_scale,
+                                        self._columns)
+        row, fy = _get_grid_position(y, self._y_lower, self._y_scale,
+                                     self._rows)
+        cells = self._cells
+        i00 = (row * self._columns + column) * 4
+        i01 = i00 + 4
+        i10 = i00 + self._columns * 4
+        i11 = i10 + 4
+        w00 = (1.0 - fx) * (1.0 - fy)
+        w01 = fx * (1.0 - fy)
+        w10 = (1.0 - fx) * fy
+        w11 = fx * fy
+        return Color(
+            cells[i00] * w00 + cells[i01] * w01 +
+            cells[i10] * w10 + cells[i11] * w11,
+            cells[i00 + 1] * w00 + cells[i01 + 1] * w01 +
+            cells[i10 + 1] * w10 + cells[i11 + 1] * w11,
+            cells[i00 + 2] * w00 + cells[i01 + 2] * w01 +
+            cells[i10 + 2] * w10 + cells[i11 + 2] * w11,
+            cells[i00 + 3] * w00 + cells[i01 + 3] * w01 +
+            cells[i10 + 3] * w10 + cells[i11 + 3] * w11)
+
+    def get_colors(self, values):
+        """
+        :param values: An (N, 2) sequence (or NumPy array) of the first and
+        second values.
+        """
+        import numpy as np
+        grid = self._get_arrays()
+        values = np.asarray(values, dtype=float).reshape(-1, 2)
+        x = np.clip((values[:, 0] - self._x_lower) * self._x_scale,
+                    0, self._columns - 1)
+        y = np.clip((values[:, 1] - self._y_lower) * self._y_scale,
+                    0, self._rows - 1)
+        column = np.minimum(x.astype(int), self._columns - 2)
+        row = np.minimum(y.astype(int), self._rows - 2)
+        fx = (x - column)[:, np.newaxis]
+        fy = (y - row)[:, np.newaxis]
+        return (grid[row, column] * (1.0 - fx) * (1.0 - fy) +
+                grid[row, column + 1] * fx * (1.0 - fy) +
+                grid[row + 1, column] * (1.0 - fx) * fy +
+                grid[row + 1, column + 1] * fx * fy)
+
+    def _create_arrays(self):
+        import numpy as np
+        return np.array(self._cells, dtype=float).reshape(
+            self._rows, self._columns, 4)
+
+
+def _get_grid_axis(value_range, count):
+    lower, upper = value_range
+    if upper <= lower:
+        return float(lower), 0.0
+    return float(lower), (count - 1) / float(upper - lower)
+
+
+def _get_grid_position(value, lower, scale, count):
+    """
+    :return: The index of the grid point at or below `value` and the
+    fraction of the way from it to the next point.
+    """
+    position = (value - lower) * scale
+    if position <= 0.0:
+        return 0, 0.0
+    i = int(position)
+    if i >= count - 1:
+        return count - 2, 1.0
+    return i, position - i
+
+
+def _write_binary(filename, kind, count, table, header=b''):
+    if sys.byteorder != 'little':
+        table.byteswap()
+    with open(filename, 'wb') as f:
+        f.write(_BINARY_HEADER.pack(_BINARY_MAGIC, _BINARY_VERSION,
+                                    _BINARY_KINDS.index(kind), 0, count))
+        f.write(header)
+        f.write(table.tostring() if sys.version_info[0] < 3
+                else table.tobytes())
+
+
+def _read_binary_table(filename, data, length):
+    table = array(_BINARY_STOP_TYPECODE)
+    size = length * table.itemsize
+    if len(data) < size:
+        raise ValueError('Truncated color map: "{}".'.format(filename))
+    if sys.version_info[0] < 3:
+        table.fromstring(data[:size])
+    else:
+        table.frombytes(data[:size])
+    if sys.byteorder != 'little':
+        table.byteswap()
+    return table
 
 
 def _create_color_map(stops, kind):
@@ -133,3 +544,65 @@ def create_hr_color_map(heart_rate, kind='discrete'):
         (heart_rate * 0.94, z6)
     ]
     return _create_color_map(stops, kind)
+
+
+def create_grid_color_map(color_map, brightness_stops, x_range, y_range,
+                          shape=(256, 16)):
+    """
+    Creates a two dimensional color map that colors the first value (e.g.
+    power) using `color_map` and scales its brightness by the second value
+    (e.g. heart rate).
+    :param color_map: The color map of the first value.
+    :param brightness_stops: The list of (value, scale) stops of the second
+    value, between which the brightness scale is interpolated.
+    :param x_range: The (lower, upper) range of the first value.
+    :param y_range: The (lower, upper) range of the second value.
+    :param shape: The number of (columns, rows) of the grid. A discrete
+    `color_map` is sampled at the columns, so its zones blend over a column.
+    :return: A `GridColorMap`.
+    """
+    import numpy as np
+    columns, rows = shape
+    colors = color_map.get_colors(np.linspace(x_range[0], x_range[1],
+                                              columns))
+    scales = np.interp(np.linspace(y_range[0], y_range[1], rows),
+                       [value for value, _ in brightness_stops],
+                       [scale for _, scale in brightness_stops])
+    grid = np.repeat(colors[np.newaxis], rows, axis=0)
+    grid[:, :, 2] *= scales[:, np.newaxis]
+    return GridColorMap(x_range, y_range,
+                        [[Color(*color) for color in row]
+                         for row in grid.tolist()])
+
+
+def create_ftp_hr_color_map(ftp, heart_rate, kind='discrete'):
+    """
+    Creates a color profile based on your FTP (see `create_ftp_color_map`)
+    that brightens as your heart rate rises towards your MHR, so that a
+    rising heart rate at the same power (i.e. cardiac drift) is visible.
+    :param ftp: The FTP value (specified in W).
+    :param heart_rate: The MHR value (specified in BPM).
+    :param kind: The kind of the FTP color map (either 'discrete' or
+    'continuous').
+    :return: A color map of (power, heart rate) values.
+    """
+    return create_grid_color_map(
+        create_ftp_color_map(ftp, kind),
+        [(heart_rate * 0.50, 0.3), (heart_rate * 0.95, 1.0)],
+        (0.0, ftp * 1.5), (heart_rate * 0.40, heart_rate * 1.00))
+
+
+def create_ftp_cadence_color_map(ftp, cadence, kind='discrete'):
+    """
+    Creates a color profile based on your FTP (see `create_ftp_color_map`)
+    that dims as your cadence falls below your target cadence.
+    :param ftp: The FTP value (specified in W).
+    :param cadence: The target cadence (specified in RPM).
+    :param kind: The kind of the FTP color map (either 'discrete' or
+    'continuous').
+    :return: A color map of (power, cadence) values.
+    """
+    return create_grid_color_map(
+        create_ftp_color_map(ftp, kind),
+        [(cadence * 0.60, 0.3), (cadence * 0.95, 1.0)],
+        (0.0, ftp * 1.5), (0.0, cadence * 1.20))
@@ -12,12 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import unittest
 import numpy as np
 
 from tempfile import NamedTemporaryFile
 
-from powerbulb.colors import Color, DiscreteColorMap, ContinuousColorMap
+from powerbulb.colors import (
+    BINARY_EXTENSION,
+    Color,
+    ColorMap,
+    DiscreteColorMap,
+    ContinuousColorMap,
+    GridColorMap,
+    create_ftp_color_map,
+    create_ftp_hr_color_map
+)
+
+_COLORS_PATH = os.path.join(os.path.dirname(__file__), '..', 'colors')
+_FTP_COLOR_MAP = os.path.join(_COLORS_PATH, 'ftp.json')
+_HR_COLOR_MAP = os.path.join(_COLORS_PATH, 'hr.json')
 
 
 def assert_color_equal(first, second):
@@ -36,6 +50,15 @@ def interpolate(color_stops, x):
     return Color(h, s, b, k)
 
 
+def legacy_get_color(color_stops, value):
+    result = None
+    for i, (lower, color) in enumerate(color_stops):
+        if i > 0 and lower > value:
+            break
+        result = color
+    return result
+
+
 class DiscreteColorMapTestCase(unittest.TestCase):
     def test_can_round_trip(self):
         expected = DiscreteColorMap([
@@ -50,6 +73,40 @@ class DiscreteColorMapTestCase(unittest.TestCase):
         for x, y in zip(expected.color_stops, actual.color_stops):
             self.assertEqual(x, y)
 
+    def test_can_round_trip_binary(self):
+        expected = DiscreteColorMap([
+            (0, Color(0.1, 0.2, 0.3, 0.4)),
+            (5, Color(0.5, 0.6, 0.7, 0.8)),
+            (10, Color(0.9, 1.0, 1.0, 0.14))
+        ])
+        with NamedTemporaryFile(suffix=BINARY_EXTENSION) as f:
+            expected.save(f.name)
+            actual = ColorMap.load(f.name)
+        self.assertIsInstance(actual, DiscreteColorMap)
+        self.assertEqual(len(expected.color_stops), len(actual.color_stops))
+        for (x1, c1), (x2, c2) in zip(expected.color_stops,
+                                      actual.color_stops):
+            self.assertAlmostEqual(x1, x2)
+            assert_color_equal(c1, c2)
+
+    def test_can_convert_legacy_map_to_binary(self):
+        expected = ColorMap.load(_FTP_COLOR_MAP)
+        with NamedTemporaryFile() as f:
+            expected.save_binary(f.name)
+            actual = ColorMap.load(f.name)
+        # Stops are stored as float32, so avoid sampling exactly at a stop.
+        for value in np.arange(-10, 400) + 0.5:
+            assert_color_equal(expected.get_color(value),
+                               actual.get_color(value))
+
+    def test_cannot_load_unsupported_binary_version(self):
+        with NamedTemporaryFile(suffix=BINARY_EXTENSION) as f:
+            DiscreteColorMap([(0, Color(1, 1, 1, 1))]).save(f.name)
+            with open(f.name, 'r+b') as fp:
+                fp.seek(4)
+                fp.write(b'\x02\x00')
+            self.assertRaises(ValueError, ColorMap.load, f.name)
+
     def test_can_get_colors_at_stops(self):
         color_stops = [
             (0, Color(1, 10, 100, 1000)),
@@ -88,6 +145,36 @@ class DiscreteColorMapTestCase(unittest.TestCase):
         assert_color_equal(stop1, sut.get_color(-1))
         assert_color_equal(stop2, sut.get_color(3))
 
+    def test_can_get_many_colors(self):
+        color_stops = [
+            (0, Color(1, 10, 100, 1000)),
+            (3, Color(2, 20, 200, 2000)),
+            (5, Color(3, 30, 300, 3000))
+        ]
+        sut = DiscreteColorMap(color_stops)
+        values = np.linspace(-2, 8, 41)
+        expected = [sut.get_color(x) for x in values]
+        np.testing.assert_array_almost_equal(expected, sut.get_colors(values))
+
+    def test_can_get_color_from_unsorted_stops(self):
+        stop1 = Color(1, 10, 100, 1000)
+        stop2 = Color(2, 20, 200, 2000)
+        stop3 = Color(3, 30, 300, 3000)
+        sut = DiscreteColorMap([
+            (5, stop3),
+            (0, stop1),
+            (3, stop2)
+        ])
+        assert_color_equal(stop1, sut.get_color(2.5))
+        assert_color_equal(stop2, sut.get_color(4.5))
+        assert_color_equal(stop3, sut.get_color(5))
+
+    def test_can_get_colors_after_loading_legacy_map(self):
+        sut = DiscreteColorMap.load(_FTP_COLOR_MAP)
+        for value in range(-10, 400):
+            assert_color_equal(legacy_get_color(sut.color_stops, value),
+                               sut.get_color(value))
+
 
 class ContinuousColorMapTestCase(unittest.TestCase):
     def test_can_round_trip(self):
@@ -104,6 +191,22 @@ class ContinuousColorMapTestCase(unittest.TestCase):
         np.testing.assert_array_almost_equal(expected.saturation, actual.saturation)
         np.testing.assert_array_almost_equal(expected.kelvin, actual.kelvin)
 
+    def test_can_round_trip_binary(self):
+        expected = ContinuousColorMap([
+            (0, Color(1, 10, 100, 1000)),
+            (5, Color(2, 20, 200, 2000)),
+            (10, Color(3, 30, 300, 3000))
+        ])
+        with NamedTemporaryFile(suffix=BINARY_EXTENSION) as f:
+            expected.save(f.name)
+            actual = ColorMap.load(f.name)
+        self.assertIsInstance(actual, ContinuousColorMap)
+        np.testing.assert_array_almost_equal(expected.values, actual.values)
+        np.testing.assert_array_almost_equal(expected.hue, actual.hue)
+        np.testing.assert_array_almost_equal(expected.brightness, actual.brightness)
+        np.testing.assert_array_almost_equal(expected.saturation, actual.saturation)
+        np.testing.assert_array_almost_equal(expected.kelvin, actual.kelvin)
+
     def test_can_get_colors_at_stops(self):
         color_stops = [
             (0, Color(1, 10, 100, 1000)),
@@ -137,3 +240,125 @@ class ContinuousColorMapTestCase(unittest.TestCase):
         assert_color_equal(interpolate(color_stops, -1), sut.get_color(-1))
         assert_color_equal(interpolate(color_stops, 5), sut.get_color(5))
 
+    def test_can_get_many_colors(self):
+        color_stops = [
+            (0, Color(1, 10, 100, 1000)),
+            (3, Color(2, 20, 200, 2000)),
+            (3, Color(4, 40, 400, 4000)),
+            (5, Color(3, 30, 300, 3000))
+        ]
+        sut = ContinuousColorMap(color_stops)
+        values = np.linspace(-2, 8, 41)
+        expected = [sut.get_color(x) for x in values]
+        np.testing.assert_array_almost_equal(expected, sut.get_colors(values))
+
+    def test_can_get_many_colors_where_bounding_stops_share_a_value(self):
+        sut = ContinuousColorMap([
+            (0, Color(1, 10, 100, 1000)),
+            (0, Color(2, 20, 200, 2000)),
+            (100, Color(3, 30, 300, 3000)),
+            (100, Color(4, 40, 400, 4000))
+        ])
+        values = [-50, 0, 50, 100, 150]
+        expected = [sut.get_color(x) for x in values]
+        assert_color_equal(Color(1, 10, 100, 1000), sut.get_color(-50))
+        assert_color_equal(Color(4, 40, 400, 4000), sut.get_color(150))
+        np.testing.assert_array_almost_equal(expected, sut.get_colors(values))
+
+    def test_can_get_many_colors_from_a_single_stop(self):
+        sut = ContinuousColorMap([(3, Color(1, 10, 100, 1000))])
+        np.testing.assert_array_almost_equal(
+            [(1, 10, 100, 1000)] * 3, sut.get_colors([0, 3, 6]))
+
+    def test_can_get_colors_between_stops_within_a_lookup_cell(self):
+        color_stops = [
+            (0.25, Color(1, 10, 100, 1000)),
+            (0.5, Color(2, 20, 200, 2000)),
+            (0.75, Color(3, 30, 300, 3000)),
+            (2.5, Color(4, 40, 400, 4000))
+        ]
+        sut = ContinuousColorMap(color_stops)
+        for x in np.linspace(-1, 3, 97):
+            assert_color_equal(interpolate(color_stops, x), sut.get_color(x))
+
+    def test_can_get_colors_beyond_lookup_table(self):
+        color_stops = [
+            (0, Color(1, 10, 100, 1000)),
+            (100, Color(2, 20, 200, 2000)),
+            (10000, Color(3, 30, 300, 3000))
+        ]
+        sut = ContinuousColorMap(color_stops)
+        for x in np.linspace(0, 10000, 101):
+            assert_color_equal(interpolate(color_stops, x), sut.get_color(x))
+
+    def test_can_get_colors_after_loading_legacy_map(self):
+        sut = ContinuousColorMap.load(_HR_COLOR_MAP)
+        color_stops = [(x, Color(*c)) for x, c in zip(
+            sut.values,
+            zip(sut.hue, sut.saturation, sut.brightness, sut.kelvin))]
+        for x in np.linspace(-10, 250, 521):
+            assert_color_equal(interpolate(color_stops, x), sut.get_color(x))
+
+
+class GridColorMapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sut = GridColorMap((0, 10), (100, 200), [
+            [Color(1, 10, 100, 1000), Color(2, 20, 200, 2000)],
+            [Color(3, 30, 300, 3000), Color(4, 40, 400, 4000)]
+        ])
+
+    def test_can_get_colors_at_grid_points(self):
+        assert_color_equal(Color(1, 10, 100, 1000), self.sut.get_color((0, 100)))
+        assert_color_equal(Color(2, 20, 200, 2000), self.sut.get_color((10, 100)))
+        assert_color_equal(Color(3, 30, 300, 3000), self.sut.get_color((0, 200)))
+        assert_color_equal(Color(4, 40, 400, 4000), self.sut.get_color((10, 200)))
+
+    def test_can_get_interpolated_colors_between_grid_points(self):
+        assert_color_equal(Color(1.5, 15, 150, 1500),
+                           self.sut.get_color((5, 100)))
+        assert_color_equal(Color(2.5, 25, 250, 2500),
+                           self.sut.get_color((5, 150)))
+        assert_color_equal(Color(3.25, 32.5, 325, 3250),
+                           self.sut.get_color((7.5, 175)))
+
+    def test_can_get_clamped_colors(self):
+        assert_color_equal(Color(1, 10, 100, 1000),
+                           self.sut.get_color((-5, 0)))
+        assert_color_equal(Color(4, 40, 400, 4000),
+                           self.sut.get_color((50, 500)))
+
+    def test_can_get_many_colors(self):
+        sut = create_ftp_hr_color_map(250, 190, kind='continuous')
+        values = np.column_stack([np.linspace(-10, 500, 97),
+                                  np.linspace(0, 250, 97)])
+        expected = [sut.get_color(value) for value in values]
+        np.testing.assert_array_almost_equal(expected, sut.get_colors(values))
+
+    def test_can_round_trip(self):
+        with NamedTemporaryFile() as f:
+            self.sut.save(f.name)
+            actual = ColorMap.load(f.name)
+        for value in [(0, 100), (5, 150), (7.5, 175)]:
+            assert_color_equal(self.sut.get_color(value),
+                               actual.get_color(value))
+
+    def test_can_round_trip_binary(self):
+        expected = create_ftp_hr_color_map(250, 190)
+        with NamedTemporaryFile(suffix=BINARY_EXTENSION) as f:
+            expected.save(f.name)
+            actual = ColorMap.load(f.name)
+        self.assertIsInstance(actual, GridColorMap)
+        self.assertEqual(expected.shape, actual.shape)
+        values = np.column_stack([np.linspace(0, 400, 41),
+                                  np.linspace(60, 200, 41)])
+        np.testing.assert_array_almost_equal(
+            expected.get_colors(values), actual.get_colors(values), decimal=5)
+
+    def test_ftp_hr_color_map_scales_brightness_by_heart_rate(self):
+        ftp_color_map = create_ftp_color_map(250, kind='continuous')
+        sut = create_ftp_hr_color_map(250, 190, kind='continuous')
+        low, high = sut.get_color((200, 80)), sut.get_color((200, 190))
+        self.assertAlmostEqual(ftp_color_map.get_color(200).hue, low.hue)
+        self.assertAlmostEqual(ftp_color_map.get_color(200).hue, high.hue)
+        self.assertAlmostEqual(0.3, low.brightness)
+        self.assertAlmostEqual(1.0, high.brightness)
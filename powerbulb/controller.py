@@ -13,31 +13,203 @@
 # limitations under the License.#
 
 import logging
+import threading
+
+from rx.concurrency import timeout_scheduler
+from rx.disposables import CompositeDisposable
+
+from powerbulb.smoothing import RollingMeanSmoother
 
 _LOGGER = logging.getLogger('powerbulb.controller')
 
 
+def color_delta(first, second):
+    """
+    Gets the largest difference between any two channels of two colors (hue
+    wraps around, so 0.95 and 0.05 are 0.1 apart).
+    """
+    hue = abs(first.hue - second.hue) % 1.0
+    return max(min(hue, 1.0 - hue),
+               abs(first.saturation - second.saturation),
+               abs(first.brightness - second.brightness),
+               abs(first.kelvin - second.kelvin))
+
+
 class PowerBulbController(object):
     BUFFER_TIME_MS = 1000
+    KEEP_ALIVE_MS = 10 * 1000
 
-    def __init__(self, source, bulb, color_map, scheduler=None):
+    def __init__(self, source, bulb, color_map, scheduler=None, min_delta=0.0,
+                 keep_alive_ms=KEEP_ALIVE_MS, smoother=None,
+                 emit_interval_ms=BUFFER_TIME_MS, transition=False,
+                 metrics=None, ride_log=None):
+        """
+        :param min_delta: Colors that differ from the last color sent to the
+        bulb by no more than this (see `color_delta`) are not sent.
+        :param keep_alive_ms: The interval after which the last color is sent
+        again even if it has not changed.
+        :param smoother: The smoother applied to the values (defaults to the
+        mean over `BUFFER_TIME_MS`).
+        :param emit_interval_ms: The interval at which the smoothed value is
+        emitted, or None to emit on every value.
+        :param transition: Whether the bulb transitions to each color over the
+        expected interval until the next update (see `_get_transition_ms`)
+        rather than changing immediately.
+        :param metrics: The `RiderMetrics` of the colors (or None).
+        :param ride_log: The `RideLogWriter` of the colors (or None).
+        """
         self._source = source
         self._bulb = bulb
         self._color_map = color_map
-        self._scheduler = scheduler
+        self._scheduler = scheduler or timeout_scheduler
+        self._min_delta = min_delta
+        self._keep_alive_ms = keep_alive_ms
+        self._smoother = smoother or RollingMeanSmoother(self.BUFFER_TIME_MS)
+        self._emit_interval_ms = emit_interval_ms
+        self._transition = transition
+        self._metrics = metrics
+        self._ride_log = ride_log
+        self._last_value = None
+        self._update_interval_ms = emit_interval_ms
+        self._last_update_at = None
+        # Values arrive on the ANT thread whereas ticks arrive on a timer.
+        self._lock = threading.Lock()
         self._subscription = None
+        self._last_color = None
+        self._last_sent_at = None
 
     def __enter__(self):
-        self._subscription = self._source.values \
-            .buffer_with_time(self.BUFFER_TIME_MS, scheduler=self._scheduler) \
-            .where(lambda x: len(x) > 0) \
-            .select(lambda x: float(sum(x)) / len(x)) \
-            .subscribe(on_next=self._update)
+        subscription = CompositeDisposable(
+            self._source.values.subscribe(on_next=self._on_value))
+        if self._emit_interval_ms is not None:
+            subscription.add(self._scheduler.schedule_periodic(
+                self._emit_interval_ms, self._on_tick))
+        self._subscription = subscription
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._subscription.dispose()
 
+    def _now(self):
+        return self._scheduler.to_relative(self._scheduler.now)
+
+    def _on_value(self, value):
+        self._last_value = value
+        with self._lock:
+            smoothed = self._smoother.add(value, self._now())
+        if self._emit_interval_ms is None:
+            self._update(smoothed)
+
+    def _on_tick(self, _):
+        with self._lock:
+            smoothed = self._smoother.value(self._now())
+        if smoothed is not None:
+            self._update(smoothed)
+
     def _update(self, value):
         color = self._color_map.get_color(value)
-        self._bulb.set_color(color)
-        _LOGGER.debug('set color, value=%d, color=%s', value, color)
+        now = self._now()
+        self._measure_update_interval(now)
+        changed = self._has_changed(color, now)
+        if self._ride_log is not None:
+            self._log(value, color, changed)
+        if not changed:
+            _LOGGER.debug('skipped color, value=%s, color=%s', value, color)
+            if self._metrics is not None:
+                self._metrics.on_skip()
+            return
+        if self._metrics is not None:
+            self._metrics.on_emit()
+        duration = self._get_transition_ms() if self._transition else 0
+        self._bulb.set_color(color, duration)
+        self._last_color = color
+        self._last_sent_at = now
+        _LOGGER.debug('set color, value=%s, color=%s', value, color)
+
+    def _log(self, value, color, sent):
+        self._ride_log.log_color(self._last_value, value, color, sent)
+
+    def _measure_update_interval(self, now):
+        if self._last_update_at is not None:
+            interval = now - self._last_update_at
+            if self._update_interval_ms is None:
+                self._update_interval_ms = interval
+            else:
+                self._update_interval_ms += \
+                    (interval - self._update_interval_ms) / 4.0
+        self._last_update_at = now
+
+    def _get_transition_ms(self):
+        """
+        Gets the expected interval until the next update (measured, so that
+        it accounts for emitting on every value), limited to the smoothing
+        window so that the bulb never lags further behind than the smoothing.
+        """
+        if self._update_interval_ms is None:
+            return 0
+        return int(min(self._update_interval_ms, self._smoother.window_ms))
+
+    def _has_changed(self, color, now):
+        if self._last_color is None:
+            return True
+        if now - self._last_sent_at >= self._keep_alive_ms:
+            return True
+        if color == self._last_color:
+            return False
+        return color_delta(color, self._last_color) > self._min_delta
+
+
+class CombinedPowerBulbController(PowerBulbController):
+    """
+    A controller of two sources (e.g. power and heart rate) whose pairs of
+    values are mapped to colors by a two dimensional color map (see
+    `GridColorMap`). Each source is smoothed separately, and a color is
+    emitted from both smoothed values at the same time, so the sources are
+    aligned in time even though their values arrive independently. No color
+    is emitted while either source has no value within its window.
+    """
+
+    def __init__(self, source, second_source, bulb, color_map,
+                 second_smoother=None, **kwargs):
+        """
+        :param second_smoother: The smoother applied to the values of
+        `second_source` (defaults to the mean over `BUFFER_TIME_MS`).
+        See `PowerBulbController` for the other parameters.
+        """
+        PowerBulbController.__init__(self, source, bulb, color_map, **kwargs)
+        self._second_source = second_source
+        self._second_smoother = second_smoother or \
+            RollingMeanSmoother(self.BUFFER_TIME_MS)
+
+    def __enter__(self):
+        PowerBulbController.__enter__(self)
+        self._subscription.add(self._second_source.values.subscribe(
+            on_next=self._on_second_value))
+
+    def _on_value(self, value):
+        self._last_value = value
+        with self._lock:
+            now = self._now()
+            values = (self._smoother.add(value, now),
+                      self._second_smoother.value(now))
+        if self._emit_interval_ms is None and values[1] is not None:
+            self._update(values)
+
+    def _on_second_value(self, value):
+        with self._lock:
+            now = self._now()
+            values = (self._smoother.value(now),
+                      self._second_smoother.add(value, now))
+        if self._emit_interval_ms is None and values[0] is not None:
+            self._update(values)
+
+    def _on_tick(self, _):
+        with self._lock:
+            now = self._now()
+            values = (self._smoother.value(now),
+                      self._second_smoother.value(now))
+        if values[0] is not None and values[1] is not None:
+            self._update(values)
+
+    def _log(self, values, color, sent):
+        # The ride log has the values of the first source.
+        self._ride_log.log_color(self._last_value, values[0], color, sent)
@@ -14,12 +14,22 @@
 
 import unittest
 
-from mock import Mock
+from mock import Mock, call
 from rx.subjects import Subject
 from rx.testing import TestScheduler
 
-from powerbulb.controller import PowerBulbController
-from powerbulb.colors import Color, DiscreteColorMap
+from powerbulb.controller import (
+    CombinedPowerBulbController,
+    PowerBulbController,
+    color_delta
+)
+from powerbulb.colors import (
+    Color,
+    ContinuousColorMap,
+    DiscreteColorMap,
+    GridColorMap
+)
+from powerbulb.smoothing import MedianSmoother
 
 
 class PowerBulbControllerTestCase(unittest.TestCase):
@@ -43,17 +53,17 @@ class PowerBulbControllerTestCase(unittest.TestCase):
             expected = self.color_map.get_color(1)
             self.source.values.on_next(1)
             self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
-            self.bulb.set_color.assert_called_with(expected)
+            self.bulb.set_color.assert_called_with(expected, 0)
 
             expected = self.color_map.get_color(2)
             self.source.values.on_next(2)
             self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
-            self.bulb.set_color.assert_called_with(expected)
+            self.bulb.set_color.assert_called_with(expected, 0)
 
             expected = self.color_map.get_color(3)
             self.source.values.on_next(3)
             self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
-            self.bulb.set_color.assert_called_with(expected)
+            self.bulb.set_color.assert_called_with(expected, 0)
 
     def test_uses_average_over_value_during_buffer_window(self):
         with self.sut:
@@ -62,7 +72,35 @@ class PowerBulbControllerTestCase(unittest.TestCase):
             self.source.values.on_next(3)
             self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
             expected = self.color_map.get_color(2)  # e.g. (1+2+3)/3=2
-            self.bulb.set_color.assert_called_with(expected)
+            self.bulb.set_color.assert_called_with(expected, 0)
+
+    def test_reports_emitted_and_skipped_colors(self):
+        metrics = Mock()
+        sut = PowerBulbController(self.source, self.bulb, self.color_map,
+                                  scheduler=self.scheduler, metrics=metrics)
+        with sut:
+            self.source.values.on_next(1)
+            self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+            self.source.values.on_next(1)
+            self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+
+        self.assertEqual(1, metrics.on_emit.call_count)
+        self.assertEqual(1, metrics.on_skip.call_count)
+
+    def test_logs_emitted_and_skipped_colors(self):
+        ride_log = Mock()
+        sut = PowerBulbController(self.source, self.bulb, self.color_map,
+                                  scheduler=self.scheduler, ride_log=ride_log)
+        with sut:
+            self.source.values.on_next(1)
+            self.source.values.on_next(2)
+            self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+            self.source.values.on_next(1)
+            self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+
+        ride_log.log_color.assert_has_calls([
+            call(2, 1.5, self.color_map.get_color(1.5), True),
+            call(1, 1.0, self.color_map.get_color(1), False)])
 
     def test_does_not_throw_when_no_values_are_received(self):
         with self.sut:
@@ -76,3 +114,146 @@ class PowerBulbControllerTestCase(unittest.TestCase):
         self.source.values.on_next(1)
         self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
         self.bulb.set_color.assert_not_called()
+
+    def test_does_not_set_bulb_to_unchanged_color(self):
+        with self.sut:
+            self.source.values.on_next(1)
+            self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+            self.source.values.on_next(1.5)
+            self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+            self.bulb.set_color.assert_called_once_with(
+                self.color_map.get_color(1), 0)
+
+    def test_does_not_set_bulb_to_color_within_delta(self):
+        color_map = ContinuousColorMap([
+            (0, Color(0, 0, 0, 0)),
+            (1, Color(1, 1, 1, 1))
+        ])
+        sut = PowerBulbController(self.source, self.bulb, color_map,
+                                  scheduler=self.scheduler, min_delta=0.1)
+        with sut:
+            for value in (0.5, 0.55, 0.6, 0.65):
+                self.source.values.on_next(value)
+                self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+        self.assertEqual(
+            [call(color_map.get_color(0.5), 0),
+             call(color_map.get_color(0.65), 0)],
+            self.bulb.set_color.call_args_list)
+
+    def test_sets_bulb_to_unchanged_color_after_keep_alive(self):
+        sut = PowerBulbController(self.source, self.bulb, self.color_map,
+                                  scheduler=self.scheduler,
+                                  keep_alive_ms=3000)
+        with sut:
+            for _ in range(7):
+                self.source.values.on_next(1)
+                self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+        self.assertEqual(3, self.bulb.set_color.call_count)
+
+    def test_sets_bulb_on_every_value_without_emit_interval(self):
+        sut = PowerBulbController(self.source, self.bulb, self.color_map,
+                                  scheduler=self.scheduler,
+                                  smoother=MedianSmoother(1000),
+                                  emit_interval_ms=None)
+        with sut:
+            self.source.values.on_next(1)
+            self.bulb.set_color.assert_called_with(self.color_map.get_color(1), 0)
+            self.scheduler.advance_by(250)
+            self.source.values.on_next(3)
+            self.scheduler.advance_by(250)
+            self.source.values.on_next(3)
+            self.bulb.set_color.assert_called_with(self.color_map.get_color(3), 0)
+            self.assertEqual(3, self.bulb.set_color.call_count)
+
+    def test_uses_rolling_value_at_emit_interval(self):
+        sut = PowerBulbController(self.source, self.bulb, self.color_map,
+                                  scheduler=self.scheduler,
+                                  emit_interval_ms=250)
+        with sut:
+            self.source.values.on_next(1)
+            self.scheduler.advance_by(250)
+            self.bulb.set_color.assert_called_with(self.color_map.get_color(1), 0)
+            self.source.values.on_next(3)
+            self.source.values.on_next(3)
+            self.scheduler.advance_by(250)
+            expected = self.color_map.get_color(2)  # e.g. (1+3+3)/3
+            self.bulb.set_color.assert_called_with(expected, 0)
+
+    def test_sets_bulb_with_transition_over_emit_interval(self):
+        sut = PowerBulbController(self.source, self.bulb, self.color_map,
+                                  scheduler=self.scheduler,
+                                  emit_interval_ms=500, transition=True)
+        with sut:
+            self.source.values.on_next(1)
+            self.scheduler.advance_by(500)
+            self.bulb.set_color.assert_called_with(
+                self.color_map.get_color(1), 500)
+
+    def test_sets_bulb_with_transition_over_measured_interval(self):
+        sut = PowerBulbController(self.source, self.bulb, self.color_map,
+                                  scheduler=self.scheduler,
+                                  emit_interval_ms=None, transition=True)
+        with sut:
+            self.source.values.on_next(1)
+            self.bulb.set_color.assert_called_with(self.color_map.get_color(1), 0)
+            for value in (2, 3):
+                self.scheduler.advance_by(250)
+                self.source.values.on_next(value)
+            expected = self.color_map.get_color(2)  # e.g. (1+2+3)/3
+            self.bulb.set_color.assert_called_with(expected, 250)
+
+    def test_color_delta_wraps_hue(self):
+        self.assertAlmostEqual(
+            0.1, color_delta(Color(0.95, 1, 1, 1), Color(0.05, 1, 1, 1)))
+        self.assertAlmostEqual(
+            0.2, color_delta(Color(0.5, 1, 1, 1), Color(0.5, 1, 0.8, 1)))
+
+
+class CombinedPowerBulbControllerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.source = Mock()
+        self.source.values = Subject()
+        self.second_source = Mock()
+        self.second_source.values = Subject()
+        self.bulb = Mock()
+        self.color_map = GridColorMap((0, 10), (0, 10), [
+            [Color(0, 0, 0, 0), Color(1, 0, 0, 0)],
+            [Color(0, 0, 1, 0), Color(1, 0, 1, 0)]
+        ])
+        self.scheduler = TestScheduler()
+
+    def test_sets_bulb_to_color_of_both_values(self):
+        sut = CombinedPowerBulbController(
+            self.source, self.second_source, self.bulb, self.color_map,
+            scheduler=self.scheduler)
+        with sut:
+            self.source.values.on_next(5)
+            self.second_source.values.on_next(10)
+            self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+            self.bulb.set_color.assert_called_with(
+                self.color_map.get_color((5, 10)), 0)
+
+    def test_aligns_values_in_time(self):
+        sut = CombinedPowerBulbController(
+            self.source, self.second_source, self.bulb, self.color_map,
+            scheduler=self.scheduler, emit_interval_ms=None)
+        with sut:
+            self.source.values.on_next(2)
+            self.bulb.set_color.assert_not_called()
+            self.scheduler.advance_by(500)
+            self.second_source.values.on_next(4)
+            self.bulb.set_color.assert_called_with(
+                self.color_map.get_color((2, 4)), 0)
+            # The first value has left its window by the time of the second.
+            self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+            self.second_source.values.on_next(6)
+            self.assertEqual(1, self.bulb.set_color.call_count)
+
+    def test_does_not_set_bulb_without_both_values(self):
+        sut = CombinedPowerBulbController(
+            self.source, self.second_source, self.bulb, self.color_map,
+            scheduler=self.scheduler)
+        with sut:
+            self.source.values.on_next(5)
+            self.scheduler.advance_by(PowerBulbController.BUFFER_TIME_MS)
+            self.bulb.set_color.assert_not_called()
@@ -0,0 +1,263 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import socket
+import struct
+import tempfile
+import time
+from collections import namedtuple
+
+from powerbulb.bulb import (
+    LIFX_HEADER,
+    LIFX_PORT,
+    LIFX_RES_REQUIRED,
+    create_source,
+    encode_message
+)
+
+_LOGGER = logging.getLogger('powerbulb.discovery')
+
+# LIFX LAN Protocol (Discovery)
+# -----------------------------------------------------------------
+# Message             | Type | Payload
+# -----------------------------------------------------------------
+# GetService          | 2    |
+# StateService        | 3    | service (uint8), port (uint32)
+# GetLabel            | 23   |
+# StateLabel          | 25   | label (32 bytes, UTF-8, NUL padded)
+# GetVersion          | 32   |
+# StateVersion        | 33   | vendor, product, version (uint32)
+# -----------------------------------------------------------------
+LIFX_GET_SERVICE_TYPE = 2
+LIFX_STATE_SERVICE_TYPE = 3
+LIFX_GET_LABEL_TYPE = 23
+LIFX_STATE_LABEL_TYPE = 25
+LIFX_GET_VERSION_TYPE = 32
+LIFX_STATE_VERSION_TYPE = 33
+LIFX_STATE_SERVICE = struct.Struct('<BI')
+LIFX_STATE_LABEL = struct.Struct('<32s')
+LIFX_STATE_VERSION = struct.Struct('<III')
+_LIFX_SERVICE_UDP = 1
+
+# The registry of the bulbs that have been discovered (by default).
+REGISTRY_FILENAME = os.path.join(os.path.expanduser('~'), '.powerbulb',
+                                 'bulbs.json')
+
+# A discovered bulb.
+BulbInfo = namedtuple('BulbInfo', [
+    'mac_addr', 'ip_addr', 'port', 'label', 'vendor', 'product', 'seen_at'])
+
+
+def _to_mac_addr(target):
+    return ':'.join('{:02x}'.format(x) for x in bytearray(target[:6]))
+
+
+class _Discovery(object):
+    """
+    The state of a single discovery, which queries every bulb at once over
+    one socket.
+    """
+
+    def __init__(self, sock, addresses):
+        self._socket = sock
+        self._addresses = addresses
+        self._source = create_source()
+        self._sequence = 0
+        self.bulbs = {}
+
+    def broadcast(self):
+        for address in self._addresses:
+            self._send(encode_message(LIFX_GET_SERVICE_TYPE, self._source,
+                                      self._next_sequence(),
+                                      flags=LIFX_RES_REQUIRED), address)
+        for mac_addr, bulb in self.bulbs.items():
+            if not self._is_complete(bulb):
+                self._query(mac_addr, bulb)
+
+    def receive(self, message, address, now):
+        if len(message) < LIFX_HEADER.size:
+            return
+        _, _, source, target, _, _, _, _, type, _ = \
+            LIFX_HEADER.unpack_from(message)
+        if source != self._source:
+            return  # A reply to another client.
+        mac_addr = _to_mac_addr(target)
+        bulb = self.bulbs.get(mac_addr)
+        if type == LIFX_STATE_SERVICE_TYPE:
+            service, port = LIFX_STATE_SERVICE.unpack_from(
+                message, LIFX_HEADER.size)
+            if service != _LIFX_SERVICE_UDP or bulb is not None:
+                return
+            bulb = self.bulbs[mac_addr] = {
+                'ip_addr': address[0], 'port': port, 'seen_at': now}
+            # Query each bulb as soon as it replies (rather than once every
+            # bulb has replied).
+            self._query(mac_addr, bulb)
+        elif bulb is None:
+            return
+        elif type == LIFX_STATE_LABEL_TYPE:
+            label, = LIFX_STATE_LABEL.unpack_from(message, LIFX_HEADER.size)
+            bulb['label'] = label.rstrip(b'\x00').decode('utf-8', 'replace')
+        elif type == LIFX_STATE_VERSION_TYPE:
+            bulb['vendor'], bulb['product'], _ = \
+                LIFX_STATE_VERSION.unpack_from(message, LIFX_HEADER.size)
+
+    def is_complete(self, count):
+        return count is not None and len(self.bulbs) >= count and \
+            all(self._is_complete(bulb) for bulb in self.bulbs.values())
+
+    def get_results(self):
+        return [BulbInfo(mac_addr, bulb['ip_addr'], bulb['port'],
+                         bulb.get('label'), bulb.get('vendor'),
+                         bulb.get('product'), bulb['seen_at'])
+                for mac_addr, bulb in sorted(self.bulbs.items())]
+
+    def _query(self, mac_addr, bulb):
+        address = (bulb['ip_addr'], bulb['port'])
+        if 'label' not in bulb:
+            self._send(encode_message(LIFX_GET_LABEL_TYPE, self._source,
+                                      self._next_sequence(), mac_addr,
+                                      flags=LIFX_RES_REQUIRED), address)
+        if 'product' not in bulb:
+            self._send(encode_message(LIFX_GET_VERSION_TYPE, self._source,
+                                      self._next_sequence(), mac_addr,
+                                      flags=LIFX_RES_REQUIRED), address)
+
+    @staticmethod
+    def _is_complete(bulb):
+        return 'label' in bulb and 'product' in bulb
+
+    def _next_sequence(self):
+        self._sequence = (self._sequence + 1) & 0xFF
+        return self._sequence
+
+    def _send(self, message, address):
+        try:
+            self._socket.sendto(message, address)
+        except socket.error:
+            _LOGGER.warning('failed to send to %s', address)
+
+
+def discover(timeout_s=1.0, addresses=None, count=None,
+             retry_interval_s=0.25, clock=time.time):
+    """
+    Discovers the LIFX bulbs on the LAN, querying the label and version of
+    every bulb at once (and again, until the deadline, if a reply is lost).
+    :param timeout_s: The time after which discovery ends.
+    :param addresses: The addresses to broadcast to (defaults to the LAN).
+    :param count: The number of bulbs after which discovery ends early (or
+    None to discover until the deadline).
+    :return: The list of bulbs (see `BulbInfo`).
+    """
+    addresses = addresses or [('255.255.255.255', LIFX_PORT)]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind(('', 0))
+        discovery = _Discovery(sock, addresses)
+        deadline = clock() + timeout_s
+        broadcast_at = clock()
+        while not discovery.is_complete(count):
+            now = clock()
+            if now >= deadline:
+                break
+            if now >= broadcast_at:
+                discovery.broadcast()
+                broadcast_at = now + retry_interval_s
+            sock.settimeout(max(min(deadline, broadcast_at) - now, 0.001))
+            try:
+                message, address = sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            discovery.receive(message, address, time.time())
+    finally:
+        sock.close()
+    results = discovery.get_results()
+    _LOGGER.info('discovered %d bulb(s)', len(results))
+    return results
+
+
+class BulbRegistry(object):
+    """
+    The bulbs that have been discovered, stored on disk (as JSON) by MAC
+    address so that a bulb can be found without discovering it again.
+    """
+
+    def __init__(self, filename=REGISTRY_FILENAME):
+        self.filename = filename
+        self._bulbs = {}
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                for mac_addr, bulb in json.load(f).items():
+                    self._bulbs[mac_addr] = BulbInfo(mac_addr=mac_addr,
+                                                     **bulb)
+
+    @property
+    def bulbs(self):
+        return [self._bulbs[mac_addr] for mac_addr in sorted(self._bulbs)]
+
+    def get(self, mac_addr):
+        return self._bulbs.get(mac_addr.lower())
+
+    def find(self, label):
+        """
+        :return: The bulb with `label` (or None).
+        """
+        for bulb in self.bulbs:
+            if bulb.label == label:
+                return bulb
+        return None
+
+    def update(self, bulbs):
+        """
+        Adds (or replaces) `bulbs` and saves the registry.
+        """
+        for bulb in bulbs:
+            self._bulbs[bulb.mac_addr] = bulb
+        self.save()
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        state = dict((bulb.mac_addr, dict((k, v) for k, v
+                                          in bulb._asdict().items()
+                                          if k != 'mac_addr'))
+                     for bulb in self.bulbs)
+        # Written to a temporary file first so that the registry is never
+        # left partially written.
+        fd, temp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f, indent=4, sort_keys=True)
+        os.rename(temp, self.filename)
+
+
+def resolve(label, registry=None, discover=discover):
+    """
+    Finds the bulb with `label` in the registry, discovering the bulbs (and
+    updating the registry) only if it is not there.
+    :return: The bulb (see `BulbInfo`).
+    """
+    registry = registry or BulbRegistry()
+    bulb = registry.find(label)
+    if bulb is None:
+        _LOGGER.info('discovering label=%s', label)
+        registry.update(discover())
+        bulb = registry.find(label)
+        if bulb is None:
+            raise ValueError("'{}' is not a discovered bulb".format(label))
+    return bulb
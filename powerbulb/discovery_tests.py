@@ -0,0 +1,118 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import Mock
+
+from powerbulb.bulb import LifxLightBulb
+from powerbulb.discovery import BulbInfo, BulbRegistry, discover, resolve
+from powerbulb.emulator import EmulatedBulb
+
+
+class DiscoverTestCase(unittest.TestCase):
+    def create_bulbs(self, count, **kwargs):
+        bulbs = []
+        for i in range(count):
+            bulb = EmulatedBulb(mac_addr='d0:73:d5:00:00:{:02x}'.format(i),
+                                label='Bulb {}'.format(i), **kwargs)
+            bulb.start()
+            self.addCleanup(bulb.close)
+            bulbs.append(bulb)
+        return bulbs
+
+    def test_discovers_every_bulb(self):
+        bulbs = self.create_bulbs(20)
+
+        started_at = time.time()
+        results = discover(timeout_s=5,
+                           addresses=[bulb.address for bulb in bulbs],
+                           count=len(bulbs))
+
+        self.assertLess(time.time() - started_at, 1)
+        self.assertEqual([(bulb.mac_addr, bulb.address[0], bulb.address[1],
+                           bulb.label, EmulatedBulb.VENDOR,
+                           EmulatedBulb.PRODUCT) for bulb in bulbs],
+                         [result[:6] for result in results])
+
+    def test_queries_again_when_replies_are_lost(self):
+        bulbs = self.create_bulbs(5, loss=0.3, seed=1)
+
+        results = discover(timeout_s=5,
+                           addresses=[bulb.address for bulb in bulbs],
+                           count=len(bulbs), retry_interval_s=0.05)
+
+        self.assertEqual(['Bulb {}'.format(i) for i in range(5)],
+                         [result.label for result in results])
+
+    def test_ends_at_deadline(self):
+        bulbs = self.create_bulbs(1)
+
+        started_at = time.time()
+        results = discover(timeout_s=0.2, addresses=[bulbs[0].address])
+
+        self.assertTrue(0.2 <= time.time() - started_at < 1)
+        self.assertEqual(1, len(results))
+
+
+class BulbRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'registry', 'bulbs.json')
+        self.bulb = BulbInfo('d0:73:d5:21:5c:6d', '192.168.254.50', 56700,
+                             'Desk', 1, 27, 1000.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        BulbRegistry(self.filename).update([self.bulb])
+
+        sut = BulbRegistry(self.filename)
+
+        self.assertEqual([self.bulb], sut.bulbs)
+        self.assertEqual(self.bulb, sut.get('D0:73:D5:21:5C:6D'))
+        self.assertEqual(self.bulb, sut.find('Desk'))
+        self.assertIsNone(sut.find('Kitchen'))
+
+    def test_resolves_from_registry(self):
+        BulbRegistry(self.filename).update([self.bulb])
+        discover = Mock()
+
+        bulb = resolve('Desk', BulbRegistry(self.filename), discover)
+
+        self.assertEqual(self.bulb, bulb)
+        self.assertFalse(discover.called)
+
+    def test_discovers_on_miss(self):
+        registry = BulbRegistry(self.filename)
+        discover = Mock(return_value=[self.bulb])
+
+        bulb = resolve('Desk', registry, discover)
+
+        self.assertEqual(self.bulb, bulb)
+        self.assertEqual([self.bulb], BulbRegistry(self.filename).bulbs)
+        self.assertRaises(ValueError, resolve, 'Kitchen', registry, discover)
+
+    def test_creates_bulb_from_label(self):
+        BulbRegistry(self.filename).update([self.bulb])
+
+        bulb = LifxLightBulb.from_label('Desk', BulbRegistry(self.filename))
+
+        self.assertEqual('192.168.254.50', bulb.ip_addr)
+        self.assertEqual('d0:73:d5:21:5c:6d', bulb.mac_addr)
@@ -0,0 +1,203 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from powerbulb.bulb import (
+    LIFX_ACK_REQUIRED,
+    LIFX_HEADER,
+    LIFX_RES_REQUIRED,
+    LIFX_SET_COLOR,
+    LIFX_SET_COLOR_TYPE,
+    encode_message
+)
+from powerbulb.discovery import (
+    LIFX_GET_LABEL_TYPE,
+    LIFX_GET_SERVICE_TYPE,
+    LIFX_GET_VERSION_TYPE,
+    LIFX_STATE_LABEL,
+    LIFX_STATE_LABEL_TYPE,
+    LIFX_STATE_SERVICE,
+    LIFX_STATE_SERVICE_TYPE,
+    LIFX_STATE_VERSION,
+    LIFX_STATE_VERSION_TYPE
+)
+
+_LOGGER = logging.getLogger('powerbulb.emulator')
+
+# The subset of the LIFX LAN protocol used by `LifxLightBulb` (via lifxlan
+# for power) and discovery.
+_LIFX_GET_POWER_TYPE = 20
+_LIFX_SET_POWER_TYPE = 21
+_LIFX_STATE_POWER_TYPE = 22
+_LIFX_ACKNOWLEDGEMENT_TYPE = 45
+_LIFX_POWER = struct.Struct('<H')
+# The light messages (used by lifxlan's `Light`) add a duration to SetPower.
+_LIFX_LIGHT_GET_POWER_TYPE = 116
+_LIFX_LIGHT_SET_POWER_TYPE = 117
+_LIFX_LIGHT_STATE_POWER_TYPE = 118
+_STATE_POWER_TYPES = {
+    _LIFX_GET_POWER_TYPE: _LIFX_STATE_POWER_TYPE,
+    _LIFX_SET_POWER_TYPE: _LIFX_STATE_POWER_TYPE,
+    _LIFX_LIGHT_GET_POWER_TYPE: _LIFX_LIGHT_STATE_POWER_TYPE,
+    _LIFX_LIGHT_SET_POWER_TYPE: _LIFX_LIGHT_STATE_POWER_TYPE
+}
+
+# A SetColor message received by an `EmulatedBulb` (the HSBK values are as
+# sent, from 0 to 65535).
+ReceivedColor = namedtuple('ReceivedColor', [
+    'timestamp', 'sequence', 'hue', 'saturation', 'brightness', 'kelvin',
+    'duration'])
+
+
+class EmulatedBulb(object):
+    """
+    A local UDP server that behaves as a LIFX bulb, recording the colors it
+    receives (e.g. to measure the rate and latency of updates without any
+    bulbs).
+    """
+
+    # The vendor and product (LIFX A19) reported by `GetVersion`.
+    VENDOR = 1
+    PRODUCT = 27
+
+    def __init__(self, ip_addr='127.0.0.1', port=0,
+                 mac_addr='d0:73:d5:00:00:01', label='Bulb', loss=0.0,
+                 reply_delay_ms=0, seed=None, clock=time.time):
+        """
+        :param port: The port (or 0 for any free port).
+        :param loss: The probability that a received message is dropped.
+        :param reply_delay_ms: The time before each reply is sent.
+        :param clock: The clock of the receive timestamps.
+        """
+        self.mac_addr = mac_addr
+        self.label = label
+        self.loss = loss
+        self.reply_delay_ms = reply_delay_ms
+        self.power_level = 0
+        self.dropped = 0
+        self._rng = random.Random(seed)
+        self._clock = clock
+        self._colors = []
+        self._lock = threading.Lock()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((ip_addr, port))
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    @property
+    def colors(self):
+        """
+        :return: The colors received (see `ReceivedColor`).
+        """
+        with self._lock:
+            return list(self._colors)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        _LOGGER.info('emulating mac_addr=%s address=%s', self.mac_addr,
+                     self.address)
+        self._thread = threading.Thread(target=self._run,
+                                        name='bulb-emulator')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        try:
+            # Unblock the receiving thread.
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._socket.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                message, address = self._socket.recvfrom(1024)
+            except socket.error:
+                return
+            if not message:
+                return  # shutdown
+            timestamp = self._clock()
+            if self.loss and self._rng.random() < self.loss:
+                self.dropped += 1
+                continue
+            try:
+                self._receive(message, address, timestamp)
+            except struct.error:
+                _LOGGER.warning('malformed message from %s', address)
+
+    def _receive(self, message, address, timestamp):
+        _, _, source, _, _, flags, sequence, _, type, _ = \
+            LIFX_HEADER.unpack_from(message)
+        if type == LIFX_SET_COLOR_TYPE:
+            _, hue, saturation, brightness, kelvin, duration = \
+                LIFX_SET_COLOR.unpack_from(message, LIFX_HEADER.size)
+            with self._lock:
+                self._colors.append(ReceivedColor(
+                    timestamp, sequence, hue, saturation, brightness, kelvin,
+                    duration))
+        elif type in (_LIFX_SET_POWER_TYPE, _LIFX_LIGHT_SET_POWER_TYPE):
+            self.power_level, = _LIFX_POWER.unpack_from(message,
+                                                        LIFX_HEADER.size)
+        if flags & LIFX_ACK_REQUIRED:
+            self._reply(address, source, sequence, _LIFX_ACKNOWLEDGEMENT_TYPE)
+        if type in (_LIFX_GET_POWER_TYPE, _LIFX_LIGHT_GET_POWER_TYPE) or \
+                flags & LIFX_RES_REQUIRED and type in _STATE_POWER_TYPES:
+            self._reply(address, source, sequence, _STATE_POWER_TYPES[type],
+                        _LIFX_POWER.pack(self.power_level))
+        elif type == LIFX_GET_SERVICE_TYPE:
+            self._reply(address, source, sequence, LIFX_STATE_SERVICE_TYPE,
+                        LIFX_STATE_SERVICE.pack(1, self.address[1]))
+        elif type == LIFX_GET_LABEL_TYPE:
+            self._reply(address, source, sequence, LIFX_STATE_LABEL_TYPE,
+                        LIFX_STATE_LABEL.pack(self.label.encode('utf-8')))
+        elif type == LIFX_GET_VERSION_TYPE:
+            self._reply(address, source, sequence, LIFX_STATE_VERSION_TYPE,
+                        LIFX_STATE_VERSION.pack(self.VENDOR, self.PRODUCT, 0))
+
+    def _reply(self, address, source, sequence, type, payload=b''):
+        message = encode_message(type, source, sequence, self.mac_addr,
+                                 payload)
+        if self.reply_delay_ms:
+            timer = threading.Timer(self.reply_delay_ms / 1000.0, self._send,
+                                    (message, address))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._send(message, address)
+
+    def _send(self, message, address):
+        try:
+            self._socket.sendto(message, address)
+        except socket.error:
+            _LOGGER.warning('failed to reply to %s', address)
@@ -0,0 +1,77 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+from powerbulb.bulb import LifxLightBulb
+from powerbulb.colors import Color
+from powerbulb.emulator import EmulatedBulb
+
+
+class EmulatedBulbTestCase(unittest.TestCase):
+    def create_bulb(self, **kwargs):
+        emulator = EmulatedBulb(**kwargs)
+        emulator.start()
+        self.addCleanup(emulator.close)
+        ip_addr, port = emulator.address
+        return emulator, LifxLightBulb(ip_addr, emulator.mac_addr, port)
+
+    def wait_for_colors(self, emulator, count):
+        for _ in range(100):
+            if len(emulator.colors) >= count:
+                break
+            time.sleep(0.01)
+        return emulator.colors
+
+    def test_records_colors(self):
+        emulator, bulb = self.create_bulb()
+
+        before = time.time()
+        bulb.set_color(Color(0.5, 1.0, 0.25, 0.1))
+        bulb.set_color(Color(1.0, 0.0, 0.0, 0.0), 250)
+        colors = self.wait_for_colors(emulator, 2)
+
+        self.assertEqual([(1, 32768, 65535, 16384, 6554, 0),
+                          (2, 65535, 0, 0, 0, 250)],
+                         [color[1:] for color in colors])
+        self.assertTrue(before <= colors[0].timestamp <= time.time())
+
+    def test_can_set_power(self):
+        emulator, bulb = self.create_bulb()
+
+        self.assertFalse(bulb.get_power())
+        bulb.turn_on()
+        self.assertEqual(65535, emulator.power_level)
+        self.assertTrue(bulb.get_power())
+        bulb.turn_off()
+        self.assertFalse(bulb.get_power())
+
+    def test_replies_slowly(self):
+        emulator, bulb = self.create_bulb(reply_delay_ms=200)
+
+        started_at = time.time()
+        bulb.get_power()
+
+        self.assertTrue(time.time() - started_at >= 0.2)
+
+    def test_drops_messages(self):
+        emulator, bulb = self.create_bulb(loss=0.5, seed=1)
+
+        for _ in range(100):
+            bulb.set_color(Color(0, 0, 0, 0))
+        time.sleep(0.1)
+
+        self.assertEqual(100, len(emulator.colors) + emulator.dropped)
+        self.assertTrue(20 < emulator.dropped < 80, emulator.dropped)
@@ -0,0 +1,286 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+
+_LOGGER = logging.getLogger('powerbulb.metrics')
+
+# The upper bounds (in ms) of the latency buckets (the last is unbounded).
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# The stages of the latency of a color: decoding a sample (from receiving it
+# to publishing its value), the age of the newest sample when a color is
+# emitted (the smoothing buffer), the wait to be sent (e.g. behind a slow
+# bulb) and sending.
+STAGES = ('decode', 'buffer', 'queue', 'send')
+
+try:
+    # A monotonic clock in seconds, unaffected by setting the system clock.
+    from time import monotonic as clock
+except ImportError:
+    # Python 2 has no monotonic clock, so this is the wall clock (in seconds),
+    # which jumps when the system clock is set (e.g. by NTP at boot).
+    from time import time as clock
+
+
+class Histogram(object):
+    """
+    Counts values in fixed buckets, preallocated so that observing a value
+    never allocates.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.counts = array('L', [0]) * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Values are observed from one thread per stage, so no lock is taken.
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_percentile(self, percentile):
+        """
+        :return: The upper bound of the bucket containing the percentile (or
+        None if there are no values or it is beyond the last bound).
+        """
+        if not self.count:
+            return None
+        rank = self.count * percentile / 100.0
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return None
+
+
+class RiderMetrics(object):
+    """
+    The counters and latency histograms of the pipeline of a rider.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = 0
+        self.dropped = 0
+        self.colors = 0
+        self.skipped = 0
+        self.send_failures = 0
+        self.latency = dict((stage, Histogram()) for stage in STAGES)
+        self._decode = self.latency['decode']
+        self._buffer = self.latency['buffer']
+        self._queue = self.latency['queue']
+        self._send = self.latency['send']
+        self._last_sample_at = None
+        self._emitted_at = None
+
+    def on_sample(self, received_at):
+        """
+        Called once a sample (received at `received_at`) has been published.
+        """
+        now = clock()
+        self.samples += 1
+        self._last_sample_at = received_at
+        self._decode.observe((now - received_at) * 1000.0)
+
+    def on_dropped(self):
+        """
+        Called when a sample is dropped (e.g. a retransmission).
+        """
+        self.dropped += 1
+
+    def on_emit(self):
+        """
+        Called when the controller emits a color.
+        """
+        now = clock()
+        self.colors += 1
+        self._emitted_at = now
+        if self._last_sample_at is not None:
+            self._buffer.observe((now - self._last_sample_at) * 1000.0)
+
+    def on_skip(self):
+        """
+        Called when the controller skips an unchanged color.
+        """
+        self.skipped += 1
+
+    def on_send(self, started_at, succeeded):
+        """
+        Called when `set_color` (called at `started_at`) has returned.
+        """
+        now = clock()
+        if not succeeded:
+            self.send_failures += 1
+        emitted_at = self._emitted_at
+        if emitted_at is not None and emitted_at <= started_at:
+            self._queue.observe((started_at - emitted_at) * 1000.0)
+        self._send.observe((now - started_at) * 1000.0)
+
+
+class MetricsRegistry(object):
+    """
+    The metrics of every rider.
+    """
+
+    def __init__(self):
+        self._riders = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            metrics = self._riders.get(name)
+            if metrics is None:
+                metrics = self._riders[name] = RiderMetrics(name)
+            return metrics
+
+    @property
+    def riders(self):
+        with self._lock:
+            return [self._riders[name] for name in sorted(self._riders)]
+
+    def render(self):
+        """
+        :return: The metrics in the Prometheus text format.
+        """
+        riders = self.riders
+        lines = []
+        for name, attribute, description in (
+                ('samples', 'samples', 'The samples received.'),
+                ('dropped_samples', 'dropped',
+                 'The samples dropped (e.g. retransmissions).'),
+                ('colors', 'colors', 'The colors emitted.'),
+                ('skipped_colors', 'skipped', 'The unchanged colors skipped.'),
+                ('send_failures', 'send_failures',
+                 'The colors that failed to send.')):
+            lines.append('# HELP powerbulb_{}_total {}'.format(
+                name, description))
+            lines.append('# TYPE powerbulb_{}_total counter'.format(name))
+            for rider in riders:
+                lines.append('powerbulb_{}_total{{rider="{}"}} {}'.format(
+                    name, rider.name, getattr(rider, attribute)))
+        lines.append('# HELP powerbulb_latency_ms The latency of each stage.')
+        lines.append('# TYPE powerbulb_latency_ms histogram')
+        for rider in riders:
+            for stage in STAGES:
+                histogram = rider.latency[stage]
+                labels = 'rider="{}",stage="{}"'.format(rider.name, stage)
+                total = 0
+                for bound, count in zip(histogram.bounds + ('+Inf',),
+                                        histogram.counts):
+                    total += count
+                    lines.append('powerbulb_latency_ms_bucket{{{},le="{}"}} '
+                                 '{}'.format(labels, bound, total))
+                lines.append('powerbulb_latency_ms_sum{{{}}} {}'.format(
+                    labels, histogram.sum))
+                lines.append('powerbulb_latency_ms_count{{{}}} {}'.format(
+                    labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    """
+    Serves the metrics (in the Prometheus text format) over HTTP.
+    """
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        try:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='metrics')
+        self._thread.daemon = True
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        _LOGGER.info('serving metrics address=%s', self.address)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MetricsLogger(object):
+    """
+    Periodically logs the rates and latencies of each rider.
+    """
+
+    def __init__(self, registry, interval_s=60):
+        self._registry = registry
+        self._interval_s = interval_s
+        self._previous = {}
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='metrics-logger')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+
+    def log(self):
+        now = clock()
+        for rider in self._registry.riders:
+            previous_at, previous_samples = self._previous.get(
+                rider.name, (None, 0))
+            self._previous[rider.name] = (now, rider.samples)
+            rate = 0.0
+            if previous_at is not None and now > previous_at:
+                rate = (rider.samples - previous_samples) / (now - previous_at)
+            _LOGGER.info(
+                'rider=%s samples/s=%.1f dropped=%d colors=%d skipped=%d '
+                'send_failures=%d %s', rider.name, rate, rider.dropped,
+                rider.colors, rider.skipped, rider.send_failures,
+                ' '.join('{}_p95_ms={}'.format(
+                    stage, rider.latency[stage].get_percentile(95))
+                    for stage in STAGES))
+
+    def _run(self):
+        while not self._closed.wait(self._interval_s):
+            try:
+                self.log()
+            except Exception:
+                _LOGGER.exception('failed to log metrics')
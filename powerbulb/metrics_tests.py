@@ -0,0 +1,97 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from mock import Mock, patch
+
+from powerbulb.bulb import InstrumentedLightBulb
+from powerbulb.metrics import Histogram, MetricsRegistry, RiderMetrics
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_counts_values_in_buckets(self):
+        sut = Histogram((1, 10, 100))
+
+        for value in (0.5, 1, 5, 50, 500, 5000):
+            sut.observe(value)
+
+        self.assertEqual([2, 1, 1, 2], list(sut.counts))
+        self.assertEqual(6, sut.count)
+        self.assertEqual(5556.5, sut.sum)
+
+    def test_gets_percentile(self):
+        sut = Histogram((1, 10, 100))
+
+        self.assertIsNone(sut.get_percentile(50))
+        for value in (0.5, 5, 5, 50):
+            sut.observe(value)
+
+        self.assertEqual(10, sut.get_percentile(50))
+        self.assertEqual(100, sut.get_percentile(95))
+
+
+class RiderMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        patcher = patch('powerbulb.metrics.clock', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sut = RiderMetrics('rider')
+
+    def test_measures_each_stage(self):
+        self.now = 10.001
+        self.sut.on_sample(10.0)
+        self.now = 10.5
+        self.sut.on_emit()
+        self.now = 10.52
+        self.sut.on_send(10.51, True)
+
+        self.assertEqual(1, self.sut.samples)
+        self.assertEqual(1, self.sut.colors)
+        self.assertAlmostEqual(1, self.sut.latency['decode'].sum)
+        self.assertAlmostEqual(500, self.sut.latency['buffer'].sum)
+        self.assertAlmostEqual(10, self.sut.latency['queue'].sum)
+        self.assertAlmostEqual(10, self.sut.latency['send'].sum)
+
+    def test_counts_failed_sends(self):
+        bulb = Mock()
+        bulb.set_color.side_effect = IOError()
+        sut = InstrumentedLightBulb(bulb, self.sut)
+
+        self.assertRaises(IOError, sut.set_color, Mock())
+        self.assertEqual(1, self.sut.send_failures)
+        self.assertEqual(1, self.sut.latency['send'].count)
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+    def test_renders_prometheus_text(self):
+        sut = MetricsRegistry()
+        metrics = sut.get('alice')
+        metrics.on_dropped()
+        metrics.latency['send'].observe(3)
+
+        text = sut.render()
+
+        self.assertIs(metrics, sut.get('alice'))
+        self.assertIn('powerbulb_dropped_samples_total{rider="alice"} 1\n',
+                      text)
+        self.assertIn('powerbulb_latency_ms_bucket{rider="alice",'
+                      'stage="send",le="2"} 0\n', text)
+        self.assertIn('powerbulb_latency_ms_bucket{rider="alice",'
+                      'stage="send",le="5"} 1\n', text)
+        self.assertIn('powerbulb_latency_ms_bucket{rider="alice",'
+                      'stage="send",le="+Inf"} 1\n', text)
+        self.assertIn('powerbulb_latency_ms_count{rider="alice",'
+                      'stage="send"} 1\n', text)
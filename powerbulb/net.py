@@ -13,6 +13,8 @@
 # limitations under the License.
 
 import logging
+import threading
+import time
 import uuid
 import struct
 
@@ -22,13 +24,44 @@ from ant.core.event import EventCallback
 from ant.core.constants import CHANNEL_TYPE_TWOWAY_RECEIVE, TIMEOUT_NEVER
 from ant.core.message import ChannelBroadcastDataMessage
 
-from rx.concurrency import TimeoutScheduler
 from rx.subjects import Subject
 
+from powerbulb.metrics import clock
+
 _LOGGER = logging.getLogger('powerbulb.ant')
 
+# Broadcast payloads are prefixed by the channel number, so byte N of a data
+# page (as numbered by the ANT+ device profiles) is at offset N + 1.
+_PAGE_OFFSET = 1
+_POWER_ONLY_PAGE = 0x10
+_POWER_ONLY = struct.Struct('<BBBBHH')
+_COMPUTED_HEART_RATE_OFFSET = 7 + _PAGE_OFFSET
+_CADENCE = struct.Struct('<HH')
+_CADENCE_OFFSET = 4 + _PAGE_OFFSET
+
+# Power is either the instantaneous power of the latest event or the average
+# power since the previous event (derived from the accumulated power).
+POWER_MODE_INSTANTANEOUS = 'instantaneous'
+POWER_MODE_AVERAGE = 'average'
+
+
+def create_broadcast_message(payload):
+    """
+    Creates a broadcast message (e.g. to replay or simulate a channel).
+    :param payload: The payload, beginning with the channel number.
+    """
+    payload = bytearray(payload)
+    return ChannelBroadcastDataMessage(number=payload[0], data=payload[1:])
+
+
+def is_broadcast_message(msg):
+    return type(msg) is ChannelBroadcastDataMessage
+
 
 class AntChannelEventCallback(EventCallback):
+    # The `RiderMetrics` of the samples (or None).
+    metrics = None
+
     def __init__(self, source):
         self.source = source
 
@@ -36,22 +69,51 @@ class AntChannelEventCallback(EventCallback):
         raise NotImplementedError()
 
     def decode(self, payload):
+        """
+        :return: The decoded value (or None if the payload is to be ignored).
+        """
         raise NotImplementedError()
 
+    def reset(self):
+        """
+        Forgets any previous events (e.g. after the sensor has been lost).
+        """
+        pass
+
     def process(self, msg, channel):
-        if not isinstance(msg, ChannelBroadcastDataMessage):
+        # This is called for every message on the channel (~4Hz per sensor),
+        # so avoid anything that allocates or formats unless it is needed.
+        if type(msg) is not ChannelBroadcastDataMessage:
             return
+        metrics = self.metrics
+        if metrics is not None:
+            received_at = clock()
         payload = msg.payload
         if not self.can_decode(payload):
             return
         value = self.decode(payload)
-        _LOGGER.debug('received: %s (value=%d)', map(str, msg.payload), value)
+        if value is None:
+            if metrics is not None:
+                metrics.on_dropped()
+            return
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug('received: %s (value=%d)', list(payload), value)
+        if metrics is not None:
+            metrics.on_sample(received_at)
         self.source.values.on_next(value)
 
 
 class AntPowerChannelEventCallback(AntChannelEventCallback):
+    def __init__(self, source, mode=POWER_MODE_INSTANTANEOUS):
+        AntChannelEventCallback.__init__(self, source)
+        if mode not in (POWER_MODE_INSTANTANEOUS, POWER_MODE_AVERAGE):
+            raise ValueError("'{}' is not a supported power mode".format(mode))
+        self._average = mode == POWER_MODE_AVERAGE
+        self._event_count = None
+        self._accumulated_power = None
+
     def can_decode(self, payload):
-        return payload[1] == 0x10  # Standard Power-Only message
+        return payload[_PAGE_OFFSET] == _POWER_ONLY_PAGE
 
     def decode(self, payload):
         # ANT+ Device Profile: Bicycle Power (Standard Power-Only Main Data Page)
@@ -59,12 +121,34 @@ class AntPowerChannelEventCallback(AntChannelEventCallback):
         # Byte | Description              | Length   | Units | Notes
         # -----------------------------------------------------------------
         # 0    | Page Number              | 1 bytes  | -     | ...
+        # 1    | Update Event Count       | 1 bytes  | -     | Rollover at 256
         # ...
         # 3    | Instantaneous Cadence    | 1 bytes  | RPM   | 0-254 (Invalid=0xFF)
-        # ...
+        # 4-5  | Accumulated Power        | 2 bytes  | W     | Rollover at 65536
         # 6-7  | Instantaneous Power LSB  | 2 bytes  | W     | 0-65.535kW
         # -----------------------------------------------------------------
-        return struct.unpack('h', payload[-2:])[0]
+        _, event_count, _, _, accumulated_power, power = \
+            _POWER_ONLY.unpack_from(payload, _PAGE_OFFSET)
+        last_event_count = self._event_count
+        last_accumulated_power = self._accumulated_power
+        if event_count == last_event_count:
+            return None  # Retransmission of the previous event.
+        self._event_count = event_count
+        self._accumulated_power = accumulated_power
+        if not self._average:
+            return power
+        if last_event_count is None:
+            return None  # An average requires a previous event.
+        events = (event_count - last_event_count) & 0xFF
+        return ((accumulated_power - last_accumulated_power) & 0xFFFF) / \
+            float(events)
+
+    def reset(self):
+        """
+        Forgets the previous event (e.g. after the sensor has been lost).
+        """
+        self._event_count = None
+        self._accumulated_power = None
 
 
 class AntHeartRateChannelEventCallback(AntChannelEventCallback):
@@ -80,69 +164,335 @@ class AntHeartRateChannelEventCallback(AntChannelEventCallback):
         # 6    | Heart Beat Count    | 1 byte  | Rollover at 255 counts
         # 7    | Computed Heart Rate | 1 byte  | Invalid=0x00, max 255bpm.
         # -----------------------------------------------------------------
-        return payload[-1]
+        return payload[_COMPUTED_HEART_RATE_OFFSET]
+
+
+class AntCadenceChannelEventCallback(AntChannelEventCallback):
+    def __init__(self, source):
+        AntChannelEventCallback.__init__(self, source)
+        self._event_time = None
+        self._revolutions = None
+
+    def can_decode(self, payload):
+        return True
+
+    def decode(self, payload):
+        # ANT+ Device Profile: Bike Speed and Cadence (Bike Cadence Sensor)
+        # -----------------------------------------------------------------
+        # Byte | Description              | Length  | Units  | Notes
+        # -----------------------------------------------------------------
+        # ...
+        # 4-5  | Cadence Event Time       | 2 bytes | 1/1024s| Rollover at 64s
+        # 6-7  | Cumulative Revolutions   | 2 bytes | -      | Rollover at 65536
+        # -----------------------------------------------------------------
+        event_time, revolutions = _CADENCE.unpack_from(payload,
+                                                       _CADENCE_OFFSET)
+        last_event_time = self._event_time
+        last_revolutions = self._revolutions
+        if event_time == last_event_time:
+            return None  # No new revolution (e.g. the rider has stopped).
+        self._event_time = event_time
+        self._revolutions = revolutions
+        if last_event_time is None:
+            return None  # Cadence requires a previous event.
+        elapsed = (event_time - last_event_time) & 0xFFFF
+        return 60 * 1024 * ((revolutions - last_revolutions) & 0xFFFF) / \
+            float(elapsed)
+
+    def reset(self):
+        self._event_time = None
+        self._revolutions = None
+
+
+class AntChannelRouter(EventCallback):
+    """
+    Routes the messages of a node to the callbacks of its channels by
+    channel number. The router is the only listener of the node, so each
+    message is dispatched once (rather than offered to every channel and
+    callback of the node).
+    """
+
+    def __init__(self, node):
+        self._routes = {}
+        node.evm.registerCallback(self)
+
+    def register(self, channel, callback):
+        if channel.number in self._routes:
+            raise ValueError(
+                'channel {} is already registered'.format(channel.number))
+        _LOGGER.debug('registering channel=%d', channel.number)
+        # A channel may wrap its callbacks (e.g. a `RecordingChannel`).
+        wrap_callback = getattr(channel, 'wrap_callback', None)
+        if wrap_callback is not None:
+            callback = wrap_callback(callback)
+        self._routes[channel.number] = (channel, callback)
+
+    def unregister(self, channel):
+        self._routes.pop(channel.number, None)
+
+    def process(self, msg, channel=None):
+        if type(msg) is not ChannelBroadcastDataMessage:
+            return
+        # Broadcast payloads begin with the number of their channel.
+        route = self._routes.get(msg.payload[0])
+        if route is not None:
+            route[1].process(msg, route[0])
 
 
 class AntDataSource(object):
-    def __init__(self, channel, callback):
-        self._values = TimeoutSubject()
-        channel = channel
-        channel.registerCallback(callback)
+    # The time without a value after which the source completes.
+    TIMEOUT_MS = 30 * 1000
+
+    def __init__(self, channel, callback, router=None, timeout_ms=None,
+                 values_factory=None, recovery=None):
+        """
+        :param values_factory: Creates the subject of values given the timeout
+        in milliseconds (and, with `recovery`, an `on_timeout` callback, see
+        `TimeoutSubject`). Defaults to a `TimeoutSubject`.
+        :param recovery: The `ChannelRecovery` used when the timeout is
+        exceeded (or None to complete the values instead).
+        """
+        values_factory = values_factory or TimeoutSubject
+        if recovery is None:
+            self._values = values_factory(timeout_ms or self.TIMEOUT_MS)
+        else:
+            self._values = values_factory(timeout_ms or self.TIMEOUT_MS,
+                                          on_timeout=self._on_timeout)
+        self.callback = callback
+        self._recovery = recovery
+        if router is None:
+            channel.registerCallback(callback)
+        else:
+            router.register(channel, callback)
 
     @property
     def values(self):
         return self._values
 
+    def close(self):
+        self._values.close()
+
+    def _on_timeout(self, attempt):
+        self.callback.reset()
+        return self._recovery.recover(attempt)
+
+
+class ChannelRecovery(object):
+    """
+    Recovers a channel that has stopped receiving data (e.g. the rider has
+    paused or the sensor has gone to sleep) by reopening it, so that it
+    searches for its sensor again, rather than the source completing. While
+    the sensor stays lost, the channel is reopened again after a backoff that
+    doubles with each attempt.
+    """
+    BACKOFF_MS = 2 * 1000
+    MAX_BACKOFF_MS = 60 * 1000
+
+    def __init__(self, channel, backoff_ms=BACKOFF_MS,
+                 max_backoff_ms=MAX_BACKOFF_MS, max_attempts=None):
+        """
+        :param max_attempts: The number of attempts after which the source
+        completes (or None to never give up).
+        """
+        self.channel = channel
+        self.backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.max_attempts = max_attempts
+
+    def recover(self, attempt):
+        """
+        Reopens the channel.
+        :param attempt: The number of consecutive attempts (from 1).
+        :return: The time to wait for data before the next attempt (or None
+        to give up).
+        """
+        if self.max_attempts is not None and attempt > self.max_attempts:
+            _LOGGER.warning('giving up channel=%s after %d attempt(s)',
+                            self.channel.name, attempt - 1)
+            return None
+        _LOGGER.info('reopening channel=%s attempt=%d', self.channel.name,
+                     attempt)
+        try:
+            self.channel.close()
+            self.channel.open()
+        except Exception:
+            _LOGGER.exception('failed to reopen channel=%s',
+                              self.channel.name)
+        return min(self.backoff_ms * 2 ** (attempt - 1), self.max_backoff_ms)
+
+
+class Watchdog(object):
+    """
+    Completes the watched subjects that have not received a value within
+    their timeout. A single long-lived thread checks every subject, so that
+    receiving a value only has to record the time. Times are measured by
+    `powerbulb.metrics.clock`, which is monotonic on Python 3, so that setting
+    the system clock (e.g. by NTP at boot on a Pi, which has no RTC) neither
+    times out nor hides a lost sensor. On Python 2 it is the wall clock.
+    """
+    CHECK_INTERVAL_MS = 1000
+
+    def __init__(self, check_interval_ms=CHECK_INTERVAL_MS, clock=clock):
+        self.clock = clock
+        self._check_interval_ms = check_interval_ms
+        self._subjects = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, subject):
+        with self._lock:
+            self._subjects.append(subject)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='watchdog')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def unwatch(self, subject):
+        with self._lock:
+            if subject in self._subjects:
+                self._subjects.remove(subject)
+
+    def check(self):
+        now = self.clock()
+        with self._lock:
+            expired = [subject for subject in self._subjects
+                       if subject.has_expired(now)]
+            for subject in expired:
+                self._subjects.remove(subject)
+        for subject in expired:
+            # A value may have been received since the subject expired, in
+            # which case it is live and watched again.
+            if subject.has_expired(self.clock()):
+                subject._timeout()
+            elif not subject._closed:
+                self.watch(subject)
+
+    def _run(self):
+        while True:
+            time.sleep(self._check_interval_ms / 1000.0)
+            try:
+                self.check()
+            except Exception:
+                _LOGGER.exception('watchdog check failed')
+
+
+_watchdog = Watchdog()
+
 
 class TimeoutSubject(Subject):
     TIMEOUT_MS = 30 * 1000
 
-    def __init__(self, scheduler=None):
+    def __init__(self, timeout_ms=TIMEOUT_MS, watchdog=None, on_timeout=None):
+        """
+        :param on_timeout: Called (with the number of consecutive timeouts)
+        when no value has been received within the timeout. It returns the
+        time to wait for a value before it is called again, or None to
+        complete. Without it, the subject completes on the first timeout.
+        """
         super(TimeoutSubject, self).__init__()
-        self._scheduler = scheduler or TimeoutScheduler()
-        self._timer = None
-        self._reset()
+        self.timeout_ms = timeout_ms
+        self._watchdog = watchdog or _watchdog
+        self._on_timeout = on_timeout
+        self._expires_after_ms = timeout_ms
+        self._timeouts = 0
+        self._last_seen = self._watchdog.clock()
+        self._closed = False
+        self._watchdog.watch(self)
 
     def on_next(self, value):
-        self._reset()
+        self._last_seen = self._watchdog.clock()
+        if self._timeouts:
+            self._timeouts = 0
+            self._expires_after_ms = self.timeout_ms
         super(TimeoutSubject, self).on_next(value)
 
-    def _reset(self):
-        if self._timer is not None:
-            self._timer.dispose()
-        self._timer = self._scheduler.schedule_periodic(self.TIMEOUT_MS,
-                                                        self._timeout)
-
-    def _timeout(self, _):
-        _LOGGER.warn('timeout (%d secs) exceeded', self.TIMEOUT_MS / 1000)
+    def has_expired(self, now):
+        return (now - self._last_seen) * 1000 >= self._expires_after_ms
+
+    def close(self):
+        self._closed = True
+        self._watchdog.unwatch(self)
+
+    def _timeout(self):
+        _LOGGER.warn('timeout (%d secs) exceeded',
+                     self._expires_after_ms / 1000)
+        if self._on_timeout is not None:
+            self._timeouts += 1
+            expires_after_ms = self._on_timeout(self._timeouts)
+            if expires_after_ms is not None and not self._closed:
+                self._expires_after_ms = expires_after_ms
+                self._last_seen = self._watchdog.clock()
+                self._watchdog.watch(self)
+                return
         super(TimeoutSubject, self).on_completed()
 
 
 class AntPowerDataSource(AntDataSource):
-    def __init__(self, channel):
+    def __init__(self, channel, mode=POWER_MODE_INSTANTANEOUS, router=None,
+                 timeout_ms=None, values_factory=None, recovery=None):
         AntDataSource.__init__(self, channel,
-                               AntPowerChannelEventCallback(self))
+                               AntPowerChannelEventCallback(self, mode),
+                               router, timeout_ms, values_factory, recovery)
 
 
 class AntHeartRateDataSource(AntDataSource):
-    def __init__(self, channel):
+    def __init__(self, channel, router=None, timeout_ms=None,
+                 values_factory=None, recovery=None):
+        AntDataSource.__init__(self, channel,
+                               AntHeartRateChannelEventCallback(self), router,
+                               timeout_ms, values_factory, recovery)
+
+
+class AntCadenceDataSource(AntDataSource):
+    # Cadence sensors only broadcast new events while the pedals turn.
+    TIMEOUT_MS = 60 * 1000
+
+    def __init__(self, channel, router=None, timeout_ms=None,
+                 values_factory=None, recovery=None):
         AntDataSource.__init__(self, channel,
-                               AntHeartRateChannelEventCallback(self))
+                               AntCadenceChannelEventCallback(self), router,
+                               timeout_ms, values_factory, recovery)
 
 
 class AntDataSourceFactory:
-    def create(self, device_type, channel):
+    def __init__(self, router=None, values_factory=None):
+        """
+        :param router: The router shared by the channels of a node (or None
+        to register each source with its channel directly).
+        :param values_factory: See `AntDataSource`.
+        """
+        self.router = router
+        self.values_factory = values_factory
+
+    def create(self, device_type, channel,
+               power_mode=POWER_MODE_INSTANTANEOUS, timeout_ms=None,
+               recovery=None):
+        """
+        :param timeout_ms: The time without a value after which the source
+        completes or recovers (or None for the default of the device type).
+        :param recovery: See `AntDataSource`.
+        """
         _LOGGER.debug('creating device_type=%s', device_type)
         if device_type == 'hr':
-            return AntHeartRateDataSource(channel)
+            return AntHeartRateDataSource(channel, self.router, timeout_ms,
+                                          self.values_factory, recovery)
         elif device_type == 'power':
-            return AntPowerDataSource(channel)
+            return AntPowerDataSource(channel, power_mode, self.router,
+                                      timeout_ms, self.values_factory,
+                                      recovery)
+        elif device_type == 'cadence':
+            return AntCadenceDataSource(channel, self.router, timeout_ms,
+                                        self.values_factory, recovery)
         else:
             raise ValueError(
                 "'{}' is not a supported device type".format(device_type))
 
 
 class AntChannelFactory(object):
+    # The channel period (in 1/32768s) of each device type.
+    PERIODS = {11: 8182, 120: 8070, 122: 8102}
+
     def __init__(self, node):
         self.node = node
 
@@ -152,20 +502,30 @@ class AntChannelFactory(object):
     def create_heart_rate(self, network, device_number=0):
         return self.create(network, 120, device_number)
 
+    def create_cadence(self, network, device_number=0):
+        return self.create(network, 122, device_number)
+
     def create(self, network, device_type, device_number):
         device_type = self.get_device_type(device_type)
         name = 'C:{}'.format(str(uuid.uuid1()))
         _LOGGER.info(
             'creating network=%s channel=%s device_type=%d, device_number=%d',
             name, network, device_type, device_number)
+        # Fails once every channel of the node is in use (e.g. 8 channels on
+        # an ANTUSB-m).
         channel = self.node.getFreeChannel()
         channel.name = name
         channel.assign(network, CHANNEL_TYPE_TWOWAY_RECEIVE)
-        channel.setID(device_type, device_number, 0)
-        channel.searchTimeout = TIMEOUT_NEVER
-        channel.period = 8070
-        channel.frequency = 57
-        channel.open()
+        try:
+            channel.setID(device_type, device_number, 0)
+            channel.searchTimeout = TIMEOUT_NEVER
+            channel.period = self.PERIODS.get(device_type, 8070)
+            channel.frequency = 57
+            channel.open()
+        except Exception:
+            # Frees the channel for the next rider.
+            channel.unassign()
+            raise
         return channel
 
     @staticmethod
@@ -174,6 +534,8 @@ class AntChannelFactory(object):
             return 120
         elif device_type == 'power':
             return 11
+        elif device_type == 'cadence':
+            return 122
         else:
             return device_type
 
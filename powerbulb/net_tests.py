@@ -0,0 +1,322 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from mock import Mock
+
+from powerbulb.net import (
+    POWER_MODE_AVERAGE,
+    AntCadenceChannelEventCallback,
+    AntChannelRouter,
+    AntPowerChannelEventCallback,
+    AntPowerDataSource,
+    ChannelRecovery,
+    TimeoutSubject,
+    Watchdog,
+    create_broadcast_message
+)
+from powerbulb.metrics import clock
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TimeoutSubjectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.watchdog = Watchdog(clock=self.clock)
+        # Checked by the tests rather than a thread.
+        self.watchdog._thread = Mock()
+        self.completed = Mock()
+
+    def create_subject(self, on_timeout=None):
+        sut = TimeoutSubject(1000, self.watchdog, on_timeout)
+        sut.subscribe(on_completed=self.completed)
+        return sut
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        self.watchdog.check()
+
+    def test_completes_on_timeout(self):
+        self.create_subject()
+
+        self.advance(0.5)
+        self.assertFalse(self.completed.called)
+        self.advance(0.5)
+        self.assertTrue(self.completed.called)
+
+    def test_recovers_with_backoff(self):
+        on_timeout = Mock(side_effect=[2000, 4000, None])
+        self.create_subject(on_timeout)
+
+        self.advance(1)
+        on_timeout.assert_called_once_with(1)
+        self.advance(1.5)
+        self.assertEqual(1, on_timeout.call_count)
+        self.advance(0.5)
+        on_timeout.assert_called_with(2)
+        self.advance(4)
+        on_timeout.assert_called_with(3)
+        self.assertTrue(self.completed.called)
+
+    def test_resets_after_value(self):
+        on_timeout = Mock(return_value=5000)
+        sut = self.create_subject(on_timeout)
+
+        self.advance(1)
+        sut.on_next(1)
+        self.advance(1)
+
+        self.assertEqual([((1,),), ((1,),)], on_timeout.call_args_list)
+        self.assertFalse(self.completed.called)
+
+    def test_does_not_recover_once_closed(self):
+        sut = self.create_subject(lambda attempt: sut.close() or 1000)
+
+        self.advance(1)
+        self.advance(1)
+
+        self.assertNotIn(sut, self.watchdog._subjects)
+
+    def test_does_not_time_out_after_value_received_during_check(self):
+        sut = self.create_subject()
+        # The value arrives between finding the subject expired and acting.
+        sut.has_expired = Mock(side_effect=[True, False])
+
+        self.advance(1)
+
+        self.assertFalse(self.completed.called)
+        self.assertIn(sut, self.watchdog._subjects)
+
+    def test_uses_metrics_clock(self):
+        self.assertIs(clock, Watchdog().clock)
+
+
+class ChannelRecoveryTestCase(unittest.TestCase):
+    def test_reopens_channel(self):
+        channel = Mock()
+        sut = ChannelRecovery(channel, backoff_ms=1000, max_backoff_ms=5000)
+
+        self.assertEqual([1000, 2000, 4000, 5000],
+                         [sut.recover(attempt) for attempt in range(1, 5)])
+        self.assertEqual(4, channel.close.call_count)
+        self.assertEqual(4, channel.open.call_count)
+
+    def test_gives_up_after_max_attempts(self):
+        channel = Mock()
+        sut = ChannelRecovery(channel, max_attempts=2)
+
+        self.assertIsNotNone(sut.recover(2))
+        self.assertIsNone(sut.recover(3))
+        self.assertEqual(1, channel.open.call_count)
+
+    def test_continues_when_reopening_fails(self):
+        channel = Mock()
+        channel.open.side_effect = IOError()
+        sut = ChannelRecovery(channel, backoff_ms=1000)
+
+        self.assertEqual(1000, sut.recover(1))
+
+
+class AntPowerChannelEventCallbackTestCase(unittest.TestCase):
+    # Standard Power-Only pages on channel 0 (event count, accumulated power
+    # and instantaneous power are little-endian).
+    PAGE_1 = bytearray([0x00, 0x10, 0x01, 0xFF, 90, 0xFA, 0x00, 0xFA, 0x00])
+    PAGE_2 = bytearray([0x00, 0x10, 0x02, 0xFF, 90, 0xF4, 0x01, 0x2C, 0x01])
+    PAGE_4 = bytearray([0x00, 0x10, 0x04, 0xFF, 90, 0x20, 0x03, 0x90, 0x01])
+
+    def test_decodes_instantaneous_power(self):
+        sut = AntPowerChannelEventCallback(Mock())
+
+        self.assertEqual(250, sut.decode(self.PAGE_1))
+        self.assertEqual(300, sut.decode(self.PAGE_2))
+
+    def test_drops_retransmitted_page(self):
+        source = Mock()
+        sut = AntPowerChannelEventCallback(source)
+
+        for payload in (self.PAGE_1, self.PAGE_1, self.PAGE_2, self.PAGE_2):
+            sut.process(create_broadcast_message(payload), None)
+
+        self.assertEqual([((250,),), ((300,),)],
+                         source.values.on_next.call_args_list)
+
+    def test_decodes_average_power(self):
+        sut = AntPowerChannelEventCallback(Mock(), mode=POWER_MODE_AVERAGE)
+
+        self.assertIsNone(sut.decode(self.PAGE_1))
+        self.assertEqual(250.0, sut.decode(self.PAGE_2))
+
+    def test_decodes_average_power_across_missed_page(self):
+        sut = AntPowerChannelEventCallback(Mock(), mode=POWER_MODE_AVERAGE)
+
+        sut.decode(self.PAGE_2)
+
+        # Event 3 was missed: (800 - 500) / (4 - 2).
+        self.assertEqual(150.0, sut.decode(self.PAGE_4))
+
+    def test_decodes_average_power_across_event_count_rollover(self):
+        sut = AntPowerChannelEventCallback(Mock(), mode=POWER_MODE_AVERAGE)
+
+        sut.decode(
+            bytearray([0x00, 0x10, 0xFF, 0xFF, 90, 0xE8, 0x03, 0xC8, 0x00]))
+
+        # (1200 - 1000) / ((0x00 - 0xFF) & 0xFF).
+        self.assertEqual(200.0, sut.decode(
+            bytearray([0x00, 0x10, 0x00, 0xFF, 90, 0xB0, 0x04, 0xC8, 0x00])))
+
+    def test_decodes_average_power_across_accumulated_power_rollover(self):
+        sut = AntPowerChannelEventCallback(Mock(), mode=POWER_MODE_AVERAGE)
+
+        sut.decode(
+            bytearray([0x00, 0x10, 0x10, 0xFF, 90, 0x9C, 0xFF, 0xFA, 0x00]))
+
+        # ((0x00C8 - 0xFF9C) & 0xFFFF) / 2: 65436 + 300 wraps to 200.
+        self.assertEqual(150.0, sut.decode(
+            bytearray([0x00, 0x10, 0x12, 0xFF, 90, 0xC8, 0x00, 0x96, 0x00])))
+
+    def test_forgets_previous_event_on_reset(self):
+        sut = AntPowerChannelEventCallback(Mock(), mode=POWER_MODE_AVERAGE)
+        sut.decode(self.PAGE_1)
+
+        sut.reset()
+
+        self.assertIsNone(sut.decode(self.PAGE_2))
+
+
+class AntCadenceChannelEventCallbackTestCase(unittest.TestCase):
+    def test_decodes_cadence(self):
+        sut = AntCadenceChannelEventCallback(Mock())
+
+        # Event time 1024 (1s), 10 revolutions.
+        self.assertIsNone(sut.decode(
+            bytearray([0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x04, 0x0A, 0x00])))
+        # Event time 1536, 11 revolutions: 1 revolution in 0.5s.
+        self.assertEqual(120.0, sut.decode(
+            bytearray([0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x06, 0x0B, 0x00])))
+
+    def test_ignores_unchanged_event_time(self):
+        sut = AntCadenceChannelEventCallback(Mock())
+        payload = bytearray(
+            [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x04, 0x0A, 0x00])
+        sut.decode(payload)
+
+        self.assertIsNone(sut.decode(payload))
+
+    def test_decodes_cadence_across_rollover(self):
+        sut = AntCadenceChannelEventCallback(Mock())
+
+        # Event time 0xFE00, 0xFFFF revolutions.
+        sut.decode(
+            bytearray([0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0xFE, 0xFF, 0xFF]))
+
+        # Event time 0x0200 (1024 later), 2 revolutions later.
+        self.assertEqual(120.0, sut.decode(
+            bytearray([0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x02, 0x01, 0x00])))
+
+
+class AntChannelRouterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.node = Mock()
+        self.sut = AntChannelRouter(self.node)
+        self.channels = [self.create_channel(number) for number in range(2)]
+        self.callbacks = [Mock() for _ in self.channels]
+        for channel, callback in zip(self.channels, self.callbacks):
+            self.sut.register(channel, callback)
+
+    @staticmethod
+    def create_channel(number):
+        return Mock(spec=['number', 'registerCallback'], number=number)
+
+    @staticmethod
+    def create_message(number):
+        return create_broadcast_message(
+            bytearray([number, 0x04, 0, 0, 0, 0, 0, 1, 150]))
+
+    def test_listens_to_node(self):
+        self.node.evm.registerCallback.assert_called_once_with(self.sut)
+        self.channels[0].registerCallback.assert_not_called()
+
+    def test_routes_by_channel_number(self):
+        msg = self.create_message(1)
+
+        self.sut.process(msg)
+
+        self.callbacks[1].process.assert_called_once_with(msg,
+                                                          self.channels[1])
+        self.callbacks[0].process.assert_not_called()
+
+    def test_ignores_unregistered_channel_number(self):
+        self.sut.process(self.create_message(2))
+
+        self.callbacks[0].process.assert_not_called()
+        self.callbacks[1].process.assert_not_called()
+
+    def test_ignores_other_messages(self):
+        self.sut.process(Mock(payload=bytearray([0])))
+
+        self.callbacks[0].process.assert_not_called()
+
+    def test_wraps_callback_of_channel(self):
+        channel = self.create_channel(2)
+        channel.wrap_callback = Mock()
+        callback = Mock()
+        msg = self.create_message(2)
+
+        self.sut.register(channel, callback)
+        self.sut.process(msg)
+
+        channel.wrap_callback.assert_called_once_with(callback)
+        channel.wrap_callback.return_value.process.assert_called_once_with(
+            msg, channel)
+
+    def test_raises_when_already_registered(self):
+        with self.assertRaises(ValueError):
+            self.sut.register(self.create_channel(0), Mock())
+
+    def test_unregisters(self):
+        self.sut.unregister(self.channels[0])
+        self.sut.process(self.create_message(0))
+
+        self.callbacks[0].process.assert_not_called()
+        self.sut.register(self.channels[0], Mock())
+
+
+class AntDataSourceTestCase(unittest.TestCase):
+    def test_resets_callback_on_recovery(self):
+        values_factory = Mock()
+        recovery = Mock()
+        recovery.recover.return_value = 1000
+        sut = AntPowerDataSource(Mock(), values_factory=values_factory,
+                                 recovery=recovery)
+        sut.callback.reset = Mock()
+        on_timeout = values_factory.call_args[1]['on_timeout']
+
+        self.assertEqual(1000, on_timeout(1))
+        sut.callback.reset.assert_called_once_with()
+        recovery.recover.assert_called_once_with(1)
+
+    def test_completes_without_recovery(self):
+        values_factory = Mock()
+
+        AntPowerDataSource(Mock(), values_factory=values_factory)
+
+        values_factory.assert_called_once_with(AntPowerDataSource.TIMEOUT_MS)
@@ -0,0 +1,53 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from timeit import default_timer
+
+_LOGGER = logging.getLogger('powerbulb.profiling')
+
+
+class StartupProfiler(object):
+    """
+    Measures the time taken by each stage of starting up (e.g. importing a
+    dependency or creating the node), where a stage ends when it is marked.
+    """
+
+    def __init__(self, started_at=None, clock=default_timer):
+        """
+        :param started_at: The time (from `clock`) at which startup began
+        (defaults to now).
+        """
+        self._clock = clock
+        self._started_at = started_at if started_at is not None else clock()
+        self._marked_at = self._started_at
+        self.stages = []
+
+    def mark(self, name):
+        """
+        Ends the stage `name` (which began when the previous stage ended).
+        """
+        now = self._clock()
+        self.stages.append((name, now - self._marked_at))
+        self._marked_at = now
+
+    @property
+    def total(self):
+        return self._marked_at - self._started_at
+
+    def report(self):
+        for name, elapsed in self.stages:
+            _LOGGER.info('startup stage=%s elapsed_ms=%.1f', name,
+                         elapsed * 1000)
+        _LOGGER.info('startup total_ms=%.1f', self.total * 1000)
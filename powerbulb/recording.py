@@ -0,0 +1,220 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import struct
+import threading
+import time
+from collections import deque
+
+from powerbulb.net import create_broadcast_message, is_broadcast_message
+
+_LOGGER = logging.getLogger('powerbulb.recording')
+
+# Recording format
+# -----------------------------------------------------------------
+# Field               | Type          | Notes
+# -----------------------------------------------------------------
+# Magic               | 4 bytes       | "PBAR"
+# Version             | uint16 (LE)   | 1
+# Records...          |               |
+#   Timestamp         | float64 (LE)  | Seconds since the epoch
+#   Length (N)        | uint8         |
+#   Payload           | N bytes       | Beginning with the channel number
+# -----------------------------------------------------------------
+RECORDING_EXTENSION = '.antrec'
+_MAGIC = b'PBAR'
+_VERSION = 1
+_HEADER = struct.Struct('<4sH')
+_RECORD = struct.Struct('<dB')
+
+
+class AntRecorder(object):
+    """
+    Appends broadcast payloads (with the time at which they were received)
+    to a recording. Payloads are queued and written in batches from a
+    background thread (as with `RideLogWriter`), so that recording never
+    waits on the file from the ANT thread, and each batch is flushed so that
+    a killed process loses at most an interval of the recording.
+    """
+    INTERVAL_S = 1.0
+    # The payloads that can be queued before the oldest are discarded (e.g.
+    # while the disk is stalled).
+    MAX_PENDING = 65536
+
+    def __init__(self, filename, interval_s=INTERVAL_S, clock=time.time):
+        _LOGGER.info('recording to filename=%s', filename)
+        self._interval_s = interval_s
+        self._clock = clock
+        self._pending = deque(maxlen=self.MAX_PENDING)
+        self._file = open(filename, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(_HEADER.pack(_MAGIC, _VERSION))
+            self._file.flush()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='recorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, payload, timestamp=None):
+        if timestamp is None:
+            timestamp = self._clock()
+        # Appending to a deque is atomic, so no lock is taken.
+        self._pending.append((timestamp, bytes(payload)))
+
+    def close(self):
+        """
+        Stops the background thread once every payload has been written.
+        """
+        self._closed.set()
+        self._thread.join()
+        self._write()
+        self._file.close()
+
+    def _run(self):
+        while not self._closed.wait(self._interval_s):
+            try:
+                self._write()
+            except Exception:
+                _LOGGER.exception('failed to write recording')
+
+    def _write(self):
+        records = []
+        while self._pending:
+            timestamp, payload = self._pending.popleft()
+            records.append(_RECORD.pack(timestamp, len(payload)))
+            records.append(payload)
+        if records:
+            self._file.write(b''.join(records))
+            self._file.flush()
+
+
+class RecordingEventCallback(object):
+    """
+    Records the broadcast messages of a channel before passing them on.
+    """
+
+    def __init__(self, callback, recorder, number):
+        self._callback = callback
+        self._recorder = recorder
+        self._number = number
+
+    def process(self, msg, channel):
+        if is_broadcast_message(msg) and msg.payload[0] == self._number:
+            self._recorder.write(msg.payload)
+        self._callback.process(msg, channel)
+
+
+class RecordingChannel(object):
+    """
+    A channel whose broadcast messages are recorded (otherwise behaving as
+    the channel it wraps).
+    """
+
+    def __init__(self, channel, recorder):
+        self._channel = channel
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    def wrap_callback(self, callback):
+        """
+        :return: `callback`, recording the messages of the channel first.
+        """
+        return RecordingEventCallback(callback, self._recorder,
+                                      self._channel.number)
+
+    def registerCallback(self, callback):
+        self._channel.registerCallback(self.wrap_callback(callback))
+
+    def close(self):
+        self._channel.close()
+        self._recorder.close()
+
+
+def read_recording(filename):
+    """
+    Reads a recording.
+    :return: A list of (timestamp, payload) records.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise ValueError('Truncated recording: "{}".'.format(filename))
+    magic, version = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError('Not a recording: "{}".'.format(filename))
+    if version != _VERSION:
+        raise ValueError('Unsupported recording version: {}.'.format(version))
+    records = []
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(data):
+        timestamp, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if offset + length > len(data):
+            break  # The last record was only partially written.
+        records.append((timestamp, bytearray(data[offset:offset + length])))
+        offset += length
+    return records
+
+
+class AntReplayChannel(object):
+    """
+    A channel that replays a recording to its callbacks (e.g. to create a
+    data source without an ANT device).
+    """
+
+    def __init__(self, filename):
+        self._records = read_recording(filename)
+        self._callbacks = []
+        self.number = self._records[0][1][0] if self._records else 0
+        self.name = 'R:{}'.format(filename)
+
+    def __len__(self):
+        return len(self._records)
+
+    def registerCallback(self, callback):
+        self._callbacks.append(callback)
+
+    def close(self):
+        pass
+
+    def replay(self, speed=1.0, scheduler=None):
+        """
+        Replays the recording, sending each message to the callbacks.
+        :param speed: The multiple of real time at which to replay (or None to
+        replay as fast as possible).
+        :param scheduler: A virtual time scheduler (e.g. a `TestScheduler`)
+        to advance to the time of each message, so that time-based processing
+        (e.g. smoothing) is preserved when replaying as fast as possible.
+        :return: The number of messages replayed.
+        """
+        if not self._records:
+            return 0
+        start = self._records[0][0]
+        started_at = time.time()
+        origin = scheduler.clock if scheduler is not None else 0
+        for timestamp, payload in self._records:
+            elapsed = timestamp - start
+            if scheduler is not None:
+                scheduler.advance_to(origin + int(elapsed * 1000))
+            if speed:
+                delay = started_at + elapsed / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            msg = create_broadcast_message(payload)
+            for callback in self._callbacks:
+                callback.process(msg, self)
+        return len(self._records)
@@ -0,0 +1,123 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import Mock
+from rx.testing import TestScheduler
+
+from powerbulb.net import create_broadcast_message
+from powerbulb.recording import (
+    AntRecorder,
+    AntReplayChannel,
+    RecordingChannel,
+    read_recording
+)
+
+
+class RecordingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'ride.antrec')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        recorder = AntRecorder(self.filename)
+        recorder.write(bytearray([1, 2, 3]), 10.0)
+        recorder.write(bytearray([1, 4]), 10.25)
+        recorder.close()
+
+        self.assertEqual([(10.0, bytearray([1, 2, 3])),
+                          (10.25, bytearray([1, 4]))],
+                         read_recording(self.filename))
+
+    def test_writes_before_close(self):
+        recorder = AntRecorder(self.filename, interval_s=0.01)
+        self.addCleanup(recorder.close)
+        recorder.write(bytearray([1, 2, 3]), 10.0)
+
+        for _ in range(500):
+            if read_recording(self.filename):
+                break
+            time.sleep(0.01)
+
+        self.assertEqual([(10.0, bytearray([1, 2, 3]))],
+                         read_recording(self.filename))
+
+    def test_appends_to_existing(self):
+        for timestamp in (1.0, 2.0):
+            recorder = AntRecorder(self.filename)
+            recorder.write(bytearray([1]), timestamp)
+            recorder.close()
+
+        self.assertEqual([1.0, 2.0],
+                         [t for t, _ in read_recording(self.filename)])
+
+    def test_ignores_partial_record(self):
+        recorder = AntRecorder(self.filename)
+        recorder.write(bytearray([1, 2, 3]), 1.0)
+        recorder.write(bytearray([1, 2, 3]), 2.0)
+        recorder.close()
+        with open(self.filename, 'rb+') as f:
+            f.truncate(os.path.getsize(self.filename) - 1)
+
+        self.assertEqual(1, len(read_recording(self.filename)))
+
+    def test_raises_on_unknown_file(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'{"values": []}')
+
+        self.assertRaises(ValueError, read_recording, self.filename)
+
+    def test_records_own_channel(self):
+        channel = Mock()
+        channel.number = 1
+        callback = Mock()
+        sut = RecordingChannel(channel, AntRecorder(self.filename))
+        sut.registerCallback(callback)
+        recording_callback = channel.registerCallback.call_args[0][0]
+
+        for payload in (bytearray([1, 10]), bytearray([2, 20])):
+            recording_callback.process(create_broadcast_message(payload),
+                                       channel)
+        sut.close()
+
+        self.assertEqual(2, callback.process.call_count)
+        self.assertEqual([bytearray([1, 10])],
+                         [p for _, p in read_recording(self.filename)])
+        channel.close.assert_called_once_with()
+
+    def test_replays_in_virtual_time(self):
+        recorder = AntRecorder(self.filename)
+        recorder.write(bytearray([3, 10]), 100.0)
+        recorder.write(bytearray([3, 20]), 100.25)
+        recorder.close()
+        sut = AntReplayChannel(self.filename)
+        scheduler = TestScheduler()
+        received = []
+        callback = Mock()
+        callback.process.side_effect = lambda msg, channel: received.append(
+            (scheduler.clock, bytearray(msg.payload)))
+        sut.registerCallback(callback)
+
+        self.assertEqual(2, sut.replay(None, scheduler))
+        self.assertEqual(3, sut.number)
+        self.assertEqual([(0, bytearray([3, 10])), (250, bytearray([3, 20]))],
+                         received)
@@ -0,0 +1,267 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+from powerbulb.colors import create_ftp_color_map
+
+_LOGGER = logging.getLogger('powerbulb.ridelog')
+
+# Ride log format
+# -----------------------------------------------------------------
+# Field               | Type          | Notes
+# -----------------------------------------------------------------
+# Magic               | 4 bytes       | "PBRL"
+# Version             | uint16 (LE)   | 1
+# Record size         | uint16 (LE)   | 36
+# Records...          |               | One per color update
+#   Timestamp         | float64 (LE)  | Seconds since the epoch
+#   Raw               | float32 (LE)  | The newest value
+#   Smoothed          | float32 (LE)  | The value mapped to the color
+#   H, S, B, K        | 4 float32     | The color
+#   Send              | float32 (LE)  | The send latency in ms (or NaN if
+#                     |               | the color was not sent)
+# -----------------------------------------------------------------
+RIDE_LOG_EXTENSION = '.ridelog'
+COLUMNS = ('timestamp', 'raw', 'smoothed', 'hue', 'saturation', 'brightness',
+           'kelvin', 'send_ms')
+_MAGIC = b'PBRL'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHH')
+_RECORD = struct.Struct('<dfffffff')
+_NAN = float('nan')
+
+
+class RideLogWriter(object):
+    """
+    Appends the color updates of a rider to a ride log. Updates are queued
+    and written in batches from a background thread, so that logging never
+    waits on the file (or a lock).
+    """
+    INTERVAL_S = 1.0
+    # The updates that can be queued before the oldest are discarded (e.g.
+    # while the disk is stalled).
+    MAX_PENDING = 65536
+
+    def __init__(self, filename, interval_s=INTERVAL_S, clock=time.time):
+        """
+        :param interval_s: The interval at which updates are written. The
+        newest updates are held back for an interval, so that the latency of
+        sending their color can be recorded with them.
+        """
+        _LOGGER.info('logging ride to filename=%s', filename)
+        self._interval_s = interval_s
+        self._clock = clock
+        self._pending = deque(maxlen=self.MAX_PENDING)
+        # The updates that have been dequeued but not yet written (only used
+        # by the background thread, or after it has stopped).
+        self._rows = []
+        self._file = open(filename, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(_HEADER.pack(_MAGIC, _VERSION, _RECORD.size))
+            self._file.flush()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ride-log')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def log_color(self, raw, smoothed, color, sent):
+        """
+        Logs a color update (called by the controller).
+        :param raw: The newest value.
+        :param smoothed: The value mapped to `color`.
+        :param sent: Whether the color is sent to the bulb (rather than
+        skipped).
+        """
+        # Appending to a deque is atomic, so no lock is taken.
+        self._pending.append((self._clock(), raw, smoothed, color, sent))
+
+    def log_send(self, color, latency_ms):
+        """
+        Logs the latency of sending a color (called by the bulb, see
+        `RideLogLightBulb`). The latency is recorded with the newest update
+        of the same color that was sent.
+        """
+        self._pending.append((color, latency_ms))
+
+    def close(self):
+        """
+        Stops the background thread once every update has been written.
+        """
+        self._closed.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._write(self._drain(), flush=True)
+        self._file.close()
+
+    def _run(self):
+        while not self._closed.wait(self._interval_s):
+            try:
+                self._write(self._drain(self._clock() - self._interval_s))
+            except Exception:
+                _LOGGER.exception('failed to write ride log')
+
+    def _drain(self, before=None):
+        """
+        Dequeues the pending updates and latencies.
+        :return: The rows of the updates before `before` (or every update).
+        """
+        rows = self._rows
+        while self._pending:
+            event = self._pending.popleft()
+            if len(event) == 2:
+                self._set_latency(*event)
+                continue
+            timestamp, raw, smoothed, color, sent = event
+            # The color is kept (at the end) until its latency is known.
+            rows.append([timestamp, _to_float(raw), _to_float(smoothed),
+                         color.hue, color.saturation, color.brightness,
+                         color.kelvin, _NAN, color if sent else None])
+        count = len(rows)
+        if before is not None:
+            while count > 0 and rows[count - 1][0] >= before:
+                count -= 1
+        self._rows = rows[count:]
+        return rows[:count]
+
+    def _set_latency(self, color, latency_ms):
+        for row in reversed(self._rows):
+            if row[8] is not None and row[8] == color:
+                row[7] = latency_ms
+                row[8] = None
+                return
+
+    def _write(self, rows, flush=False):
+        if rows:
+            self._file.write(b''.join(_RECORD.pack(*row[:8]) for row in rows))
+        if rows or flush:
+            self._file.flush()
+
+
+def _to_float(value):
+    return _NAN if value is None else float(value)
+
+
+class RideLog(object):
+    """
+    A ride log, mapped into memory as a NumPy array of records (so that
+    summaries of a multi-hour log do not read it into Python objects).
+    A column (see `COLUMNS`) is an array view, e.g. `ride_log['smoothed']`.
+    """
+    # Rows further apart than this (e.g. while the rider was stopped) do not
+    # count towards the time of the first row.
+    MAX_GAP_S = 5.0
+
+    def __init__(self, filename):
+        import numpy as np
+        with open(filename, 'rb') as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError('Truncated ride log: "{}".'.format(filename))
+        magic, version, size = _HEADER.unpack(header)
+        if magic != _MAGIC:
+            raise ValueError('Not a ride log: "{}".'.format(filename))
+        if version != _VERSION or size != _RECORD.size:
+            raise ValueError(
+                'Unsupported ride log version: {}.'.format(version))
+        dtype = np.dtype([(name, '<f8' if name == 'timestamp' else '<f4')
+                          for name in COLUMNS])
+        # A partial trailing record (e.g. after a crash) is ignored.
+        count = (os.path.getsize(filename) - _HEADER.size) // _RECORD.size
+        if count > 0:
+            self.records = np.memmap(filename, dtype=dtype, mode='r',
+                                     offset=_HEADER.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, column):
+        return self.records[column]
+
+    def get_durations(self):
+        """
+        :return: The time (in s) of each row, until the next row.
+        """
+        import numpy as np
+        timestamps = self.records['timestamp']
+        if not len(timestamps):
+            return np.zeros(0)
+        # Not np.diff(..., append=...), which requires NumPy 1.16.
+        durations = np.append(np.diff(timestamps), 0.0)
+        durations[(durations < 0) | (durations > self.MAX_GAP_S)] = 0.0
+        return durations
+
+    def get_duration(self):
+        """
+        :return: The total time (in s) of the rows.
+        """
+        return float(self.get_durations().sum())
+
+    def get_max(self, column='smoothed'):
+        """
+        :return: The largest value of `column` (or None if there are none).
+        """
+        import numpy as np
+        values = self.records[column]
+        values = values[~np.isnan(values)]
+        return float(values.max()) if len(values) else None
+
+    def get_mean(self, column='smoothed'):
+        """
+        :return: The mean of `column`, weighted by the time of each row (or
+        None if there are no values).
+        """
+        import numpy as np
+        values = self.records[column]
+        durations = self.get_durations()
+        mask = ~np.isnan(values)
+        if not mask.any():
+            return None
+        if durations[mask].sum() <= 0:
+            return float(values[mask].mean())
+        return float(np.average(values[mask], weights=durations[mask]))
+
+    def get_time_in_zones(self, lower_bounds, column='smoothed'):
+        """
+        :param lower_bounds: The sorted lower bound of each zone (the first
+        zone also covers every value below its lower bound, as with a
+        discrete color map).
+        :return: The time (in s) spent in each zone.
+        """
+        import numpy as np
+        values = self.records[column]
+        durations = self.get_durations()
+        mask = ~np.isnan(values)
+        zones = np.searchsorted(np.asarray(lower_bounds, dtype=float),
+                                values[mask], side='right') - 1
+        return np.bincount(np.maximum(zones, 0), weights=durations[mask],
+                           minlength=len(lower_bounds))
+
+    def get_time_in_ftp_zones(self, ftp, column='smoothed'):
+        """
+        :return: The time (in s) spent in each zone of the color map of
+        `ftp` (see `create_ftp_color_map`).
+        """
+        lower_bounds = [value for value, _ in
+                        create_ftp_color_map(ftp).get_color_stops()]
+        return self.get_time_in_zones(lower_bounds, column)
@@ -0,0 +1,153 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from mock import Mock
+
+from powerbulb.bulb import RideLogLightBulb
+from powerbulb.colors import Color
+from powerbulb.ridelog import RideLog, RideLogWriter
+
+
+class RideLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'rider.ridelog')
+        self.now = 100.0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_writer(self):
+        return RideLogWriter(self.filename, clock=lambda: self.now)
+
+    def log(self, writer, values, interval_s=1.0):
+        for value in values:
+            writer.log_color(value, value, Color(0, 0, 1, 0), True)
+            self.now += interval_s
+
+    def test_round_trip(self):
+        writer = self.create_writer()
+        writer.log_color(210, 200.5, Color(0.5, 1, 0.75, 0.14), True)
+        writer.close()
+
+        sut = RideLog(self.filename)
+
+        self.assertEqual(1, len(sut))
+        self.assertEqual(100.0, sut['timestamp'][0])
+        self.assertEqual(210, sut['raw'][0])
+        self.assertEqual(200.5, sut['smoothed'][0])
+        np.testing.assert_array_almost_equal(
+            [0.5, 1, 0.75, 0.14],
+            [sut[column][0] for column in
+             ('hue', 'saturation', 'brightness', 'kelvin')])
+
+    def test_writes_in_background(self):
+        sut = RideLogWriter(self.filename, interval_s=0.01)
+        sut.start()
+        sut.log_color(1, 1, Color(0, 0, 1, 0), True)
+        for _ in range(100):
+            if len(RideLog(self.filename)):
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, len(RideLog(self.filename)))
+        sut.close()
+
+    def test_logs_send_latency_of_sent_color(self):
+        writer = self.create_writer()
+        sent, skipped = Color(1, 1, 1, 1), Color(2, 2, 2, 2)
+        writer.log_color(1, 1, sent, True)
+        writer.log_color(2, 2, sent, False)
+        writer.log_color(3, 3, skipped, False)
+        writer.log_send(sent, 12.5)
+        writer.close()
+
+        latencies = RideLog(self.filename)['send_ms']
+
+        self.assertEqual(12.5, latencies[0])
+        self.assertTrue(math.isnan(latencies[1]))
+        self.assertTrue(math.isnan(latencies[2]))
+
+    def test_appends_to_existing(self):
+        for value in (1, 2):
+            writer = self.create_writer()
+            self.log(writer, [value])
+            writer.close()
+
+        self.assertEqual([1, 2], list(RideLog(self.filename)['raw']))
+
+    def test_ignores_partial_record(self):
+        writer = self.create_writer()
+        self.log(writer, [1, 2])
+        writer.close()
+        with open(self.filename, 'ab') as f:
+            f.write(b'\x00' * 10)
+
+        self.assertEqual(2, len(RideLog(self.filename)))
+
+    def test_summarizes(self):
+        writer = self.create_writer()
+        self.log(writer, [100, 300, 200, 400])
+        # A pause (longer than `MAX_GAP_S`) does not count.
+        self.now += 60
+        self.log(writer, [100])
+        writer.close()
+
+        sut = RideLog(self.filename)
+
+        self.assertEqual(3.0, sut.get_duration())
+        self.assertEqual(400, sut.get_max())
+        self.assertEqual(600 / 3.0, sut.get_mean())
+        np.testing.assert_array_equal([1, 2], sut.get_time_in_zones([0, 150]))
+
+    def test_gets_time_in_ftp_zones(self):
+        writer = self.create_writer()
+        # Z1 (below 56% of FTP), Z4 (90-106%) and Z6 (above 121%).
+        self.log(writer, [50, 95, 100, 130, 0], interval_s=2.0)
+        writer.close()
+
+        sut = RideLog(self.filename)
+
+        np.testing.assert_array_equal([2, 0, 0, 4, 0, 2],
+                                      sut.get_time_in_ftp_zones(100))
+
+    def test_summarizes_empty_log(self):
+        self.create_writer().close()
+
+        sut = RideLog(self.filename)
+
+        self.assertEqual(0, len(sut))
+        self.assertEqual(0.0, sut.get_duration())
+        self.assertIsNone(sut.get_max())
+        self.assertIsNone(sut.get_mean())
+
+
+class RideLogLightBulbTestCase(unittest.TestCase):
+    def test_logs_send_latency(self):
+        bulb, ride_log = Mock(), Mock()
+        sut = RideLogLightBulb(bulb, ride_log)
+
+        sut.set_color(Color(1, 1, 1, 1), 500)
+
+        bulb.set_color.assert_called_once_with(Color(1, 1, 1, 1), 500)
+        color, latency_ms = ride_log.log_send.call_args[0]
+        self.assertEqual(Color(1, 1, 1, 1), color)
+        self.assertTrue(latency_ms >= 0)
@@ -0,0 +1,376 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import threading
+
+from rx.concurrency import EventLoopScheduler
+from rx.disposables import CompositeDisposable
+
+from powerbulb.bulb import (
+    AsyncLightBulb,
+    BulbGroup,
+    FailSafeLightBulb,
+    InstrumentedLightBulb,
+    LifxLightBulb,
+    RideLogLightBulb
+)
+from powerbulb.colors import ColorMap
+from powerbulb.controller import (
+    CombinedPowerBulbController,
+    PowerBulbController
+)
+from powerbulb.net import (
+    AntChannelFactory,
+    AntChannelRouter,
+    AntDataSourceFactory,
+    ChannelRecovery,
+    POWER_MODE_INSTANTANEOUS
+)
+from powerbulb.recording import AntRecorder, RecordingChannel
+from powerbulb.ridelog import RideLogWriter
+from powerbulb.smoothing import create_smoother
+
+_LOGGER = logging.getLogger('powerbulb.runtime')
+
+
+def get_riders(configuration):
+    """
+    Gets the rider configurations, either from the list of `riders` or (for
+    a single rider) from the configuration itself. Each rider has a unique
+    `name`, a `device`, a `bulb` (or `bulbs`), a `color_map` and optionally
+    `controller` settings, a `second_device` (whose values are combined
+    with those of `device` by a two dimensional color map) and a `ride_log`
+    (the file to which its color updates are appended).
+    """
+    riders = configuration.get('riders')
+    if riders is None:
+        riders = [dict(configuration, name=configuration.get('name', 'rider'))]
+    names = set()
+    for i, rider in enumerate(riders):
+        rider.setdefault('name', 'rider{}'.format(i + 1))
+        if rider['name'] in names:
+            raise ValueError(
+                "'{}' is not a unique rider name".format(rider['name']))
+        names.add(rider['name'])
+    return riders
+
+
+def _create_lifx_bulb(configuration):
+    if 'label' in configuration and 'ip' not in configuration:
+        return LifxLightBulb.from_label(configuration['label'])
+    return LifxLightBulb(configuration['ip'], configuration['mac'])
+
+
+def create_bulb(configuration, background=True, metrics=None,
+                ride_log=None):
+    """
+    :param background: Whether colors are sent from a background thread (see
+    `AsyncLightBulb`) rather than the caller's thread (see
+    `FailSafeLightBulb`).
+    :param metrics: The `RiderMetrics` of the bulb (or None).
+    :param ride_log: The `RideLogWriter` of the bulb (or None).
+    """
+    if 'bulbs' in configuration:
+        bulb = BulbGroup([_create_lifx_bulb(bulb)
+                          for bulb in configuration['bulbs']])
+    else:
+        bulb = _create_lifx_bulb(configuration['bulb'])
+    if metrics is not None:
+        bulb = InstrumentedLightBulb(bulb, metrics)
+    if ride_log is not None:
+        bulb = RideLogLightBulb(bulb, ride_log)
+    return AsyncLightBulb(bulb) if background else FailSafeLightBulb(bulb)
+
+
+def create_controller(source, bulb, color_map, configuration,
+                      scheduler=None, metrics=None, second_source=None,
+                      ride_log=None):
+    """
+    :param second_source: The source of the second value of a two
+    dimensional color map (see `CombinedPowerBulbController`), or None.
+    :param ride_log: The `RideLogWriter` of the colors (or None).
+    """
+    controller = configuration.get('controller', {})
+
+    def create():
+        return create_smoother(
+            controller.get('smoothing', 'mean'),
+            controller.get('window_ms', PowerBulbController.BUFFER_TIME_MS))
+
+    if second_source is None:
+        factory = PowerBulbController
+        args = (source, bulb, color_map)
+        kwargs = {}
+    else:
+        factory = CombinedPowerBulbController
+        args = (source, second_source, bulb, color_map)
+        kwargs = {'second_smoother': create()}
+    return factory(
+        *args,
+        scheduler=scheduler,
+        min_delta=controller.get('min_delta', 0.0),
+        keep_alive_ms=controller.get(
+            'keep_alive_ms', PowerBulbController.KEEP_ALIVE_MS),
+        smoother=create(),
+        emit_interval_ms=controller.get(
+            'emit_interval_ms', PowerBulbController.BUFFER_TIME_MS),
+        transition=controller.get('transition', False),
+        metrics=metrics,
+        ride_log=ride_log,
+        **kwargs)
+
+
+def create_recovery(channel, device):
+    """
+    Creates the recovery of a channel from the `recovery` settings of a
+    device (or None if `recovery` is false, in which case the rider stops
+    when its sensor is lost).
+    """
+    recovery = device.get('recovery', {})
+    if recovery is False or recovery is None:
+        return None
+    return ChannelRecovery(
+        channel,
+        backoff_ms=recovery.get('backoff_ms', ChannelRecovery.BACKOFF_MS),
+        max_backoff_ms=recovery.get('max_backoff_ms',
+                                    ChannelRecovery.MAX_BACKOFF_MS),
+        max_attempts=recovery.get('max_attempts'))
+
+
+class RiderPipeline(object):
+    """
+    The running source -> controller -> bulb pipeline of a rider. The parts
+    are set as they are created, so that a partly started pipeline (e.g. if
+    its bulb cannot be found) can be closed.
+    """
+
+    def __init__(self, name, configuration=None):
+        self.name = name
+        self.configuration = configuration
+        self.color_map = None
+        self.channel = None
+        self.source = None
+        self.second_channel = None
+        self.second_source = None
+        self.ride_log = None
+        self.bulb = None
+        self.controller = None
+        self.subscription = None
+
+    @property
+    def channels(self):
+        return [channel for channel in (self.channel, self.second_channel)
+                if channel is not None]
+
+    @property
+    def sources(self):
+        return [source for source in (self.source, self.second_source)
+                if source is not None]
+
+    def close(self):
+        if self.subscription is not None:
+            self.subscription.dispose()
+        for source in self.sources:
+            source.close()
+        if self.controller is not None:
+            self.controller.__exit__(None, None, None)
+        if self.bulb is not None:
+            self.bulb.close()
+        # Closed after the bulb, so that the latency of any pending color is
+        # logged.
+        if self.ride_log is not None:
+            self.ride_log.close()
+        for channel in self.channels:
+            _close_channel(channel)
+
+
+def _close_channel(channel):
+    channel.close()
+    # A channel is only free to be used again (see `getFreeChannel`) once it
+    # has been unassigned.
+    channel.unassign()
+
+
+class Runtime(object):
+    """
+    Runs the pipelines of many riders in a single process. The riders share
+    an ANT node (each using a channel), the bulb socket, color maps and a
+    single scheduler thread for the controllers.
+    """
+
+    def __init__(self, node, network, scheduler=None, values_factory=None,
+                 metrics=None):
+        """
+        :param values_factory: See `AntDataSource`.
+        :param metrics: The `MetricsRegistry` of the riders (or None).
+        """
+        self._network = network
+        self._router = AntChannelRouter(node)
+        self._channel_factory = AntChannelFactory(node)
+        self._source_factory = AntDataSourceFactory(self._router,
+                                                    values_factory)
+        self._scheduler = scheduler or EventLoopScheduler()
+        self._metrics = metrics
+        self._color_maps = {}
+        self._pipelines = {}
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    @property
+    def riders(self):
+        with self._lock:
+            return sorted(self._pipelines)
+
+    def start_rider(self, configuration):
+        name = configuration['name']
+        _LOGGER.info('starting rider=%s', name)
+        with self._lock:
+            if name in self._pipelines:
+                raise ValueError("'{}' is already running".format(name))
+            pipeline = RiderPipeline(name, configuration)
+            try:
+                self._start_pipeline(pipeline, configuration)
+            except Exception:
+                self._close_pipeline(pipeline)
+                raise
+            self._pipelines[name] = pipeline
+            self._stopped.clear()
+
+    def stop_rider(self, name):
+        with self._lock:
+            pipeline = self._pipelines.pop(name, None)
+            if pipeline is None:
+                return
+            _LOGGER.info('stopping rider=%s', name)
+            self._close_pipeline(pipeline)
+            if not self._pipelines:
+                self._stopped.set()
+
+    def update(self, riders):
+        """
+        Starts the riders that are not running and stops the running riders
+        that are not in `riders` (e.g. after the configuration has changed).
+        A running rider is restarted if its configuration or color map file
+        has changed.
+        """
+        with self._lock:
+            names = set(rider['name'] for rider in riders)
+            for name in set(self._pipelines) - names:
+                self.stop_rider(name)
+            for rider in riders:
+                pipeline = self._pipelines.get(rider['name'])
+                if pipeline is not None and self._has_changed(pipeline,
+                                                              rider):
+                    self.stop_rider(rider['name'])
+                if rider['name'] not in self._pipelines:
+                    self.start_rider(rider)
+
+    def stop(self):
+        with self._lock:
+            for name in list(self._pipelines):
+                self.stop_rider(name)
+        self._stopped.set()
+
+    def wait(self, timeout=None):
+        """
+        Waits until every rider has stopped.
+        :return: True if every rider has stopped.
+        """
+        return self._stopped.wait(timeout)
+
+    def _start_pipeline(self, pipeline, configuration):
+        name = pipeline.name
+        metrics = None
+        if self._metrics is not None:
+            metrics = self._metrics.get(name)
+        pipeline.channel, pipeline.source = self._create_source(
+            configuration['device'], metrics)
+        if 'second_device' in configuration:
+            pipeline.second_channel, pipeline.second_source = \
+                self._create_source(configuration['second_device'], metrics)
+        color_map = pipeline.color_map = self._load_color_map(
+            configuration['color_map'])
+        if 'ride_log' in configuration:
+            pipeline.ride_log = RideLogWriter(configuration['ride_log'])
+            pipeline.ride_log.start()
+        pipeline.bulb = self._create_bulb(configuration, metrics,
+                                          pipeline.ride_log)
+        controller = create_controller(
+            pipeline.source, pipeline.bulb, color_map, configuration,
+            self._scheduler, metrics, pipeline.second_source,
+            pipeline.ride_log)
+        controller.__enter__()
+        pipeline.controller = controller
+
+        def on_error(e):
+            _LOGGER.exception(e)
+            self.stop_rider(name)
+
+        # The rider stops when either of its sources completes.
+        pipeline.subscription = CompositeDisposable()
+        for source in pipeline.sources:
+            pipeline.subscription.add(source.values.subscribe(
+                on_error=on_error, on_completed=lambda: self.stop_rider(name)))
+
+    def _close_pipeline(self, pipeline):
+        for channel in pipeline.channels:
+            self._router.unregister(channel)
+        pipeline.close()
+
+    def _create_source(self, device, metrics=None):
+        """
+        :return: The (channel, source) of a device.
+        """
+        channel = self._channel_factory.create(
+            self._network, device['type'], device['number'])
+        try:
+            # The channel is reopened in place (keeping the bulb, color map
+            # and controller) when its sensor is lost.
+            recovery = create_recovery(channel, device)
+            if 'record' in device:
+                channel = RecordingChannel(channel,
+                                           AntRecorder(device['record']))
+            source = self._source_factory.create(
+                device['type'], channel,
+                power_mode=device.get('power_mode',
+                                      POWER_MODE_INSTANTANEOUS),
+                timeout_ms=device.get('timeout_ms'), recovery=recovery)
+        except Exception:
+            _close_channel(channel)
+            raise
+        source.callback.metrics = metrics
+        return channel, source
+
+    def _create_bulb(self, configuration, metrics=None, ride_log=None):
+        return create_bulb(configuration, metrics=metrics, ride_log=ride_log)
+
+    def _has_changed(self, pipeline, configuration):
+        if pipeline.configuration != configuration:
+            return True
+        return self._load_color_map(configuration['color_map']) is not \
+            pipeline.color_map
+
+    def _load_color_map(self, filename):
+        # The maps are shared by the riders, and reloaded once their file
+        # has been modified (e.g. before the configuration is reloaded).
+        modified_at = os.path.getmtime(filename)
+        cached = self._color_maps.get(filename)
+        if cached is not None and cached[0] == modified_at:
+            return cached[1]
+        color_map = ColorMap.load(filename)
+        self._color_maps[filename] = (modified_at, color_map)
+        return color_map
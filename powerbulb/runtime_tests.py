@@ -0,0 +1,167 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock, patch
+from rx.testing import TestScheduler
+
+from powerbulb.colors import ColorMap, create_ftp_color_map
+from powerbulb.runtime import Runtime, create_controller
+from powerbulb.simulator import SimulatedNode
+
+
+class RuntimeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.color_map = os.path.join(self.directory, 'ftp.cmap')
+        create_ftp_color_map(250, kind='continuous').save(self.color_map)
+        self.node = SimulatedNode(channels=8, rate_hz=4, seed=1)
+        self.scheduler = TestScheduler()
+        self.bulbs = []
+        patcher = patch('powerbulb.runtime._create_lifx_bulb',
+                        side_effect=self.create_bulb)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sut = Runtime(self.node, Mock(), scheduler=self.scheduler)
+
+    def tearDown(self):
+        self.sut.stop()
+        shutil.rmtree(self.directory)
+
+    def create_bulb(self, configuration):
+        bulb = Mock()
+        self.bulbs.append(bulb)
+        return bulb
+
+    def create_rider(self, name='rider', **kwargs):
+        rider = {'name': name, 'bulb': {}, 'color_map': self.color_map,
+                 'device': {'type': 'power', 'number': 0}}
+        rider.update(kwargs)
+        return rider
+
+    def get_free_channels(self):
+        return len([channel for channel in self.node.channels
+                    if channel.network is None])
+
+    def test_starts_rider(self):
+        self.sut.update([self.create_rider()])
+        self.node.tick(0.0)
+        self.node.tick(1.0)
+        self.scheduler.advance_by(1000)
+
+        self.assertEqual(['rider'], self.sut.riders)
+        self.assertEqual(7, self.get_free_channels())
+        # Stopping sends the pending color (from the background thread).
+        self.sut.stop()
+        self.assertTrue(self.bulbs[0].set_color.called)
+
+    def test_stops_rider(self):
+        self.sut.update([self.create_rider('first'),
+                         self.create_rider('second')])
+
+        self.sut.update([self.create_rider('second')])
+
+        self.assertEqual(['second'], self.sut.riders)
+        self.assertEqual(7, self.get_free_channels())
+        self.bulbs[0].close.assert_called_once_with()
+        self.assertFalse(self.sut.wait(0))
+
+    def test_keeps_unchanged_rider_on_update(self):
+        self.sut.update([self.create_rider()])
+
+        self.sut.update([self.create_rider()])
+
+        self.assertEqual(1, len(self.bulbs))
+        self.bulbs[0].close.assert_not_called()
+
+    def test_restarts_rider_whose_configuration_changed(self):
+        self.sut.update([self.create_rider()])
+
+        self.sut.update([self.create_rider(
+            device={'type': 'power', 'number': 1})])
+
+        self.assertEqual(['rider'], self.sut.riders)
+        self.assertEqual(2, len(self.bulbs))
+        self.bulbs[0].close.assert_called_once_with()
+        self.assertEqual(7, self.get_free_channels())
+
+    def test_restarts_rider_whose_color_map_changed(self):
+        self.sut.update([self.create_rider()])
+        # As if the map was edited before the configuration was reloaded.
+        create_ftp_color_map(300, kind='continuous').save(self.color_map)
+        modified_at = os.path.getmtime(self.color_map) + 1
+        os.utime(self.color_map, (modified_at, modified_at))
+
+        with patch('powerbulb.runtime.create_controller',
+                   wraps=create_controller) as create:
+            self.sut.update([self.create_rider()])
+
+        self.assertEqual(2, len(self.bulbs))
+        self.assertEqual(ColorMap.load(self.color_map).values,
+                         create.call_args[0][2].values)
+
+    def test_reloads_more_times_than_there_are_channels(self):
+        for _ in range(20):
+            self.sut.update([self.create_rider()])
+            self.sut.update([])
+
+        self.assertEqual([], self.sut.riders)
+        self.assertEqual(8, self.get_free_channels())
+        self.assertTrue(self.sut.wait(0))
+
+    def test_frees_channels_when_bulb_cannot_be_created(self):
+        rider = self.create_rider(
+            second_device={'type': 'hr', 'number': 0},
+            ride_log=os.path.join(self.directory, 'rider.ridelog'))
+        with patch('powerbulb.runtime._create_lifx_bulb',
+                   side_effect=ValueError('no bulb')):
+            self.assertRaises(ValueError, self.sut.start_rider, rider)
+
+        self.assertEqual([], self.sut.riders)
+        self.assertEqual(8, self.get_free_channels())
+        # The channels can be routed again.
+        self.sut.start_rider(self.create_rider())
+
+    def test_frees_channels_when_color_map_cannot_be_loaded(self):
+        rider = self.create_rider(color_map=os.path.join(self.directory,
+                                                         'missing.cmap'))
+
+        self.assertRaises(EnvironmentError, self.sut.start_rider, rider)
+
+        self.assertEqual(8, self.get_free_channels())
+        self.assertEqual([], self.bulbs)
+
+    def test_frees_channels_when_second_device_cannot_be_created(self):
+        rider = self.create_rider(second_device={'type': 'unknown',
+                                                 'number': 0})
+
+        self.assertRaises(ValueError, self.sut.start_rider, rider)
+
+        self.assertEqual(8, self.get_free_channels())
+
+    def test_stops_rider_on_timeout(self):
+        device = {'type': 'power', 'number': 0, 'timeout_ms': 50,
+                  'recovery': False}
+        self.sut.update([self.create_rider(device=device)])
+
+        # The node does not broadcast, so the sensor is never found.
+        self.assertTrue(self.sut.wait(5))
+
+        self.assertEqual([], self.sut.riders)
+        self.assertEqual(8, self.get_free_channels())
+        self.bulbs[0].close.assert_called_once_with()
@@ -0,0 +1,368 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import math
+import random
+import struct
+import threading
+import time
+
+from ant.core.node import Network
+
+from powerbulb.net import AntChannelFactory, create_broadcast_message
+
+_LOGGER = logging.getLogger('powerbulb.simulator')
+
+_POWER_ONLY_PAGE = struct.Struct('<BBBBBHH')
+_HEART_RATE_PAGE = struct.Struct('<BBBBBHBB')
+_CADENCE_PAGE = struct.Struct('<BBBBBHH')
+
+
+class SimulatedSensor(object):
+    """
+    A virtual ANT+ sensor whose value follows a noisy sine wave around
+    `base`, broadcasting the data pages of its device profile.
+    """
+
+    def __init__(self, base, amplitude, period_s=60.0, noise=0.0, rng=None):
+        self.base = base
+        self.amplitude = amplitude
+        self.period_s = period_s
+        self.noise = noise
+        self._rng = rng or random.Random()
+        self._phase = self._rng.uniform(0, 2 * math.pi)
+
+    def get_value(self, now):
+        value = self.base + self.amplitude * math.sin(
+            2 * math.pi * now / self.period_s + self._phase)
+        if self.noise:
+            value += self._rng.gauss(0, self.noise)
+        return max(int(round(value)), 0)
+
+    def create_payload(self, number, now):
+        """
+        :return: The broadcast payload at `now` (in seconds), beginning with
+        the channel number.
+        """
+        raise NotImplementedError()
+
+
+class SimulatedPowerSensor(SimulatedSensor):
+    """
+    Broadcasts the Standard Power-Only page, with a new event per message
+    except for the occasional retransmission of the previous event.
+    """
+
+    def __init__(self, base=200, amplitude=50, retransmit_probability=0.0,
+                 rollover=False, **kwargs):
+        """
+        :param rollover: Whether to start the counters just before they roll
+        over.
+        """
+        SimulatedSensor.__init__(self, base, amplitude, **kwargs)
+        self.retransmit_probability = retransmit_probability
+        self._event_count = 0xFE if rollover else 0
+        self._accumulated_power = 0xFFFF - base if rollover else 0
+        self._power = 0
+
+    def create_payload(self, number, now):
+        if self._rng.random() >= self.retransmit_probability:
+            self._power = self.get_value(now)
+            self._event_count = (self._event_count + 1) & 0xFF
+            self._accumulated_power = \
+                (self._accumulated_power + self._power) & 0xFFFF
+        return bytearray(_POWER_ONLY_PAGE.pack(
+            number, 0x10, self._event_count, 0xFF, 90,
+            self._accumulated_power, self._power))
+
+
+class SimulatedHeartRateSensor(SimulatedSensor):
+    """
+    Broadcasts the default Heart Rate data page.
+    """
+
+    def __init__(self, base=140, amplitude=20, rollover=False, **kwargs):
+        SimulatedSensor.__init__(self, base, amplitude, **kwargs)
+        self._beat_count = 0xFE if rollover else 0
+        self._beat_time = 0xFFFF - 1024 if rollover else 0
+        self._beats = 0.0
+        self._last_now = None
+        self._messages = 0
+
+    def create_payload(self, number, now):
+        heart_rate = min(self.get_value(now), 0xFF)
+        if self._last_now is not None:
+            self._beats += heart_rate * (now - self._last_now) / 60.0
+            while self._beats >= 1:
+                self._beats -= 1
+                self._beat_count = (self._beat_count + 1) & 0xFF
+                self._beat_time = \
+                    (self._beat_time + int(61440 / max(heart_rate, 1))) & 0xFFFF
+        self._last_now = now
+        # The toggle bit of the page number changes every 4 messages.
+        toggle = 0x80 if (self._messages // 4) % 2 else 0x00
+        self._messages += 1
+        return bytearray(_HEART_RATE_PAGE.pack(
+            number, toggle, 0xFF, 0xFF, 0xFF, self._beat_time,
+            self._beat_count, heart_rate))
+
+
+class SimulatedCadenceSensor(SimulatedSensor):
+    """
+    Broadcasts the Bike Cadence page, with a new event per revolution.
+    """
+
+    def __init__(self, base=90, amplitude=10, rollover=False, **kwargs):
+        SimulatedSensor.__init__(self, base, amplitude, **kwargs)
+        self._event_time_offset = 0xFFFF - 1024 if rollover else 0
+        self._event_time = self._event_time_offset
+        self._revolutions = 0xFFFF if rollover else 0
+        self._turns = 0.0
+        self._last_now = None
+
+    def create_payload(self, number, now):
+        cadence = self.get_value(now)
+        if self._last_now is not None and cadence > 0:
+            self._turns += cadence * (now - self._last_now) / 60.0
+            if self._turns >= 1:
+                revolutions = int(self._turns)
+                self._turns -= revolutions
+                # The event time is that of the latest whole revolution.
+                event_s = now - self._turns * 60.0 / cadence
+                self._event_time = (self._event_time_offset + int(
+                    round(event_s * 1024))) & 0xFFFF
+                self._revolutions = \
+                    (self._revolutions + revolutions) & 0xFFFF
+        self._last_now = now
+        return bytearray(_CADENCE_PAGE.pack(
+            number, 0x00, 0xFF, 0xFF, 0xFF, self._event_time,
+            self._revolutions))
+
+
+_SENSORS = {
+    11: SimulatedPowerSensor,
+    120: SimulatedHeartRateSensor,
+    122: SimulatedCadenceSensor
+}
+
+
+class SimulatedChannel(object):
+    """
+    A channel of a `SimulatedNode`, broadcasting the data of a virtual
+    sensor of the device type it is assigned.
+    """
+
+    def __init__(self, node, number):
+        self.node = node
+        self.number = number
+        self.name = None
+        self.network = None
+        self.searchTimeout = None
+        self.period = 8070
+        self.frequency = None
+        self.sensor = None
+        self.is_open = False
+        self._callbacks = []
+        self._due = None
+        self._dropout_until = None
+
+    def assign(self, network, channel_type):
+        self.network = network
+
+    def setID(self, device_type, device_number, transmission_type):
+        self.sensor = self.node.create_sensor(device_type)
+
+    def open(self):
+        self._due = None
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def unassign(self):
+        self.close()
+        self.network = None
+        self.sensor = None
+        self._callbacks = []
+
+    def registerCallback(self, callback):
+        self._callbacks.append(callback)
+
+    def get_interval(self):
+        """
+        :return: The time (in seconds) between broadcasts.
+        """
+        if self.node.rate_hz:
+            return 1.0 / self.node.rate_hz
+        return self.period / 32768.0
+
+    def tick(self, now):
+        """
+        Broadcasts the messages that are due at `now` (in seconds).
+        :return: The time of the next broadcast.
+        """
+        if self._due is None:
+            self._due = now
+        interval = self.get_interval()
+        while self._due <= now:
+            self._broadcast(self._due)
+            self._due += interval
+        return self._due
+
+    def _broadcast(self, now):
+        if not self.is_open or self.sensor is None:
+            return
+        if self._dropout_until is not None:
+            if now < self._dropout_until:
+                return
+            self._dropout_until = None
+        elif self.node.is_dropout():
+            self._dropout_until = now + self.node.dropout_ms / 1000.0
+            return
+        msg = create_broadcast_message(
+            self.sensor.create_payload(self.number, now))
+        self.node.evm.process(msg)
+        for callback in self._callbacks:
+            callback.process(msg, self)
+
+
+class SimulatedEventMachine(object):
+    """
+    The listeners of every message of a `SimulatedNode` (as with the event
+    machine of an ANT node).
+    """
+
+    def __init__(self):
+        self._callbacks = []
+
+    def registerCallback(self, callback):
+        self._callbacks.append(callback)
+
+    def process(self, msg):
+        for callback in self._callbacks:
+            callback.process(msg)
+
+
+class SimulatedNode(object):
+    """
+    A node (with the interface of an ANT node used by `AntChannelFactory`)
+    whose channels broadcast synthetic sensor data, e.g. to load test many
+    riders without any ANT+ hardware.
+    """
+
+    def __init__(self, channels=8, rate_hz=None, dropout_probability=0.0,
+                 dropout_ms=5000, retransmit_probability=0.0, noise=0.0,
+                 rollover=False, seed=None):
+        """
+        :param channels: The number of channels.
+        :param rate_hz: The broadcast rate of each sensor (or None to use
+        the channel period, ~4Hz).
+        :param dropout_probability: The probability that a broadcast starts
+        a dropout (during which the sensor is silent).
+        :param dropout_ms: The duration of a dropout.
+        :param retransmit_probability: The probability that a power sensor
+        retransmits its previous event.
+        :param noise: The standard deviation of the noise of each sensor.
+        :param rollover: Whether sensors start their counters just before
+        they roll over.
+        :param seed: The seed of the random number generator.
+        """
+        self.rate_hz = rate_hz
+        self.dropout_probability = dropout_probability
+        self.dropout_ms = dropout_ms
+        self.retransmit_probability = retransmit_probability
+        self.noise = noise
+        self.rollover = rollover
+        self._rng = random.Random(seed)
+        self.evm = SimulatedEventMachine()
+        self._channels = [SimulatedChannel(self, i) for i in range(channels)]
+        self._running = threading.Event()
+        self._thread = None
+
+    @property
+    def channels(self):
+        return self._channels
+
+    def create_sensor(self, device_type):
+        device_type = AntChannelFactory.get_device_type(device_type)
+        sensor = _SENSORS.get(device_type)
+        if sensor is None:
+            raise ValueError(
+                "'{}' is not a simulated device type".format(device_type))
+        kwargs = dict(noise=self.noise, rollover=self.rollover,
+                      rng=random.Random(self._rng.random()))
+        if sensor is SimulatedPowerSensor:
+            kwargs['retransmit_probability'] = self.retransmit_probability
+        return sensor(**kwargs)
+
+    def is_dropout(self):
+        return self.dropout_probability > 0 and \
+            self._rng.random() < self.dropout_probability
+
+    def getFreeChannel(self):
+        # As with an ANT node, a channel is free until it is assigned.
+        for channel in self._channels:
+            if channel.network is None:
+                return channel
+        raise RuntimeError('no free channels')
+
+    def setNetworkKey(self, number, network=None):
+        pass
+
+    def tick(self, now):
+        """
+        Broadcasts the messages of every open channel that are due at `now`
+        (in seconds).
+        :return: The time of the next broadcast.
+        """
+        due = [channel.tick(now) for channel in self._channels
+               if channel.is_open]
+        return min(due) if due else now + 0.1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name='simulator')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self._running.is_set():
+            try:
+                due = self.tick(time.time())
+            except Exception:
+                _LOGGER.exception('simulator tick failed')
+                due = time.time() + 0.1
+            time.sleep(max(due - time.time(), 0))
+
+
+class SimulatedNodeFactory(object):
+    def create(self, configuration=None):
+        """
+        :param configuration: The keyword arguments of the `SimulatedNode`.
+        """
+        _LOGGER.info('creating simulated node=%s', configuration)
+        node = SimulatedNode(**(configuration or {}))
+        node.start()
+        network = Network(name='N:simulator', key=None)
+        node.setNetworkKey(0, network=network)
+        return node, network
@@ -0,0 +1,113 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from mock import Mock
+from rx.subjects import Subject
+
+from powerbulb.net import (
+    AntCadenceChannelEventCallback,
+    AntChannelFactory,
+    AntHeartRateChannelEventCallback,
+    AntPowerChannelEventCallback,
+    POWER_MODE_AVERAGE
+)
+from powerbulb.simulator import SimulatedNode
+
+
+class SimulatedNodeTestCase(unittest.TestCase):
+    def create_channel(self, node, device_type, callback_type, *args):
+        channel = AntChannelFactory(node).create(Mock(), device_type, 0)
+        source = Mock()
+        source.values = Subject()
+        values = []
+        source.values.subscribe(values.append)
+        channel.registerCallback(callback_type(source, *args))
+        return channel, values
+
+    def test_broadcasts_at_channel_period(self):
+        node = SimulatedNode(seed=1)
+        _, values = self.create_channel(node, 'hr',
+                                        AntHeartRateChannelEventCallback)
+
+        node.tick(0.0)
+        node.tick(10.0)
+
+        self.assertEqual(41, len(values))
+
+    def test_broadcasts_at_rate(self):
+        node = SimulatedNode(rate_hz=8, seed=1)
+        _, values = self.create_channel(node, 'hr',
+                                        AntHeartRateChannelEventCallback)
+
+        node.tick(0.0)
+        node.tick(10.0)
+
+        self.assertEqual(81, len(values))
+
+    def test_can_decode_power_after_rollover(self):
+        node = SimulatedNode(rate_hz=4, rollover=True, seed=1)
+        _, instantaneous = self.create_channel(
+            node, 'power', AntPowerChannelEventCallback)
+        _, average = self.create_channel(
+            node, 'power', AntPowerChannelEventCallback, POWER_MODE_AVERAGE)
+
+        node.tick(0.0)
+        node.tick(5.0)
+
+        self.assertEqual(21, len(instantaneous))
+        self.assertEqual(20, len(average))
+        for value in instantaneous + average:
+            self.assertTrue(150 <= value <= 250, value)
+
+    def test_drops_retransmitted_power(self):
+        node = SimulatedNode(rate_hz=4, retransmit_probability=0.5, seed=1)
+        _, values = self.create_channel(node, 'power',
+                                        AntPowerChannelEventCallback)
+
+        node.tick(0.0)
+        node.tick(25.0)
+
+        self.assertTrue(20 < len(values) < 80, len(values))
+
+    def test_can_decode_cadence_after_rollover(self):
+        node = SimulatedNode(rate_hz=4, rollover=True, seed=1)
+        _, values = self.create_channel(node, 'cadence',
+                                        AntCadenceChannelEventCallback)
+
+        node.tick(0.0)
+        node.tick(30.0)
+
+        self.assertTrue(len(values) > 30)
+        for value in values:
+            self.assertTrue(75 <= value <= 105, value)
+
+    def test_drops_out(self):
+        node = SimulatedNode(rate_hz=4, dropout_probability=0.05,
+                             dropout_ms=2000, seed=1)
+        _, values = self.create_channel(node, 'hr',
+                                        AntHeartRateChannelEventCallback)
+
+        node.tick(0.0)
+        node.tick(60.0)
+
+        self.assertTrue(0 < len(values) < 200, len(values))
+
+    def test_fails_without_free_channel(self):
+        node = SimulatedNode(channels=1)
+        AntChannelFactory(node).create(Mock(), 'hr', 0)
+
+        self.assertRaises(RuntimeError, AntChannelFactory(node).create,
+                          Mock(), 'hr', 0)
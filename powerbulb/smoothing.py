@@ -0,0 +1,193 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+from array import array
+
+# The highest sample rate a window is sized for (ANT+ broadcasts at ~4Hz).
+MAX_SAMPLE_RATE_HZ = 16
+
+
+class RingBuffer(object):
+    """
+    A fixed-capacity FIFO of timestamped samples, preallocated so that adding
+    a sample never allocates.
+    """
+
+    def __init__(self, capacity):
+        assert capacity > 0
+        self._values = array('d', [0.0]) * capacity
+        self._timestamps = array('d', [0.0]) * capacity
+        self._capacity = capacity
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, value, timestamp):
+        """
+        Adds a sample, overwriting the oldest sample if the buffer is full.
+        :return: The overwritten value (or None).
+        """
+        evicted = None
+        if self._count == self._capacity:
+            evicted = self._values[self._head]
+        else:
+            self._count += 1
+        self._values[self._head] = value
+        self._timestamps[self._head] = timestamp
+        self._head = (self._head + 1) % self._capacity
+        return evicted
+
+    def pop_older_than(self, timestamp):
+        """
+        Removes the samples older than `timestamp`.
+        :return: The sum of the removed values.
+        """
+        total = 0.0
+        tail = (self._head - self._count) % self._capacity
+        while self._count > 0 and self._timestamps[tail] < timestamp:
+            total += self._values[tail]
+            tail = (tail + 1) % self._capacity
+            self._count -= 1
+        return total
+
+    def values(self):
+        tail = self._head - self._count
+        if tail >= 0:
+            return self._values[tail:self._head]
+        return self._values[tail:] + self._values[:self._head]
+
+
+class Smoother(object):
+    def __init__(self, window_ms):
+        self.window_ms = window_ms
+
+    def add(self, value, timestamp_ms):
+        """
+        Adds a sample.
+        :return: The smoothed value, including the sample.
+        """
+        raise NotImplementedError()
+
+    def value(self, timestamp_ms):
+        """
+        :return: The smoothed value at `timestamp_ms` (or None if there have
+        been no samples within the window).
+        """
+        raise NotImplementedError()
+
+
+class RollingMeanSmoother(Smoother):
+    """
+    The mean of the samples received within the last `window_ms`.
+    """
+
+    def __init__(self, window_ms, capacity=None):
+        Smoother.__init__(self, window_ms)
+        self._samples = RingBuffer(capacity or _get_capacity(window_ms))
+        self._sum = 0.0
+
+    def add(self, value, timestamp_ms):
+        self._evict(timestamp_ms)
+        evicted = self._samples.push(value, timestamp_ms)
+        self._sum += value - (evicted or 0.0)
+        return self._sum / len(self._samples)
+
+    def value(self, timestamp_ms):
+        self._evict(timestamp_ms)
+        if not self._samples:
+            return None
+        return self._sum / len(self._samples)
+
+    def _evict(self, timestamp_ms):
+        self._sum -= self._samples.pop_older_than(timestamp_ms -
+                                                  self.window_ms)
+        if not self._samples:
+            # Discard any accumulated rounding error.
+            self._sum = 0.0
+
+
+class EwmaSmoother(Smoother):
+    """
+    An exponentially weighted moving average with a time constant of
+    `window_ms` (so irregularly spaced samples are weighted by their age).
+    """
+
+    def __init__(self, window_ms):
+        Smoother.__init__(self, window_ms)
+        self._value = None
+        self._timestamp_ms = None
+
+    def add(self, value, timestamp_ms):
+        if self._value is None:
+            self._value = float(value)
+        else:
+            elapsed = max(timestamp_ms - self._timestamp_ms, 0)
+            alpha = 1.0 - math.exp(-float(elapsed) / self.window_ms)
+            self._value += alpha * (value - self._value)
+        self._timestamp_ms = timestamp_ms
+        return self._value
+
+    def value(self, timestamp_ms):
+        if self._value is None or \
+                timestamp_ms - self._timestamp_ms > self.window_ms:
+            return None
+        return self._value
+
+
+class MedianSmoother(Smoother):
+    """
+    The median of the samples received within the last `window_ms`, which
+    rejects short spikes (e.g. a misread power value).
+    """
+
+    def __init__(self, window_ms, capacity=None):
+        Smoother.__init__(self, window_ms)
+        self._samples = RingBuffer(capacity or _get_capacity(window_ms))
+
+    def add(self, value, timestamp_ms):
+        self._samples.push(value, timestamp_ms)
+        return self.value(timestamp_ms)
+
+    def value(self, timestamp_ms):
+        self._samples.pop_older_than(timestamp_ms - self.window_ms)
+        if not self._samples:
+            return None
+        values = sorted(self._samples.values())
+        middle = len(values) // 2
+        if len(values) % 2 == 1:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _get_capacity(window_ms):
+    return int(math.ceil(window_ms / 1000.0 * MAX_SAMPLE_RATE_HZ)) + 1
+
+
+def create_smoother(kind, window_ms):
+    """
+    Creates a smoother.
+    :param kind: The kind of smoother (either 'mean', 'ewma' or 'median').
+    :param window_ms: The window (or time constant) in milliseconds.
+    """
+    if kind == 'mean':
+        return RollingMeanSmoother(window_ms)
+    elif kind == 'ewma':
+        return EwmaSmoother(window_ms)
+    elif kind == 'median':
+        return MedianSmoother(window_ms)
+    else:
+        raise ValueError('Unknown kind: "{}".'.format(kind))
@@ -0,0 +1,93 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from powerbulb.smoothing import (
+    RingBuffer,
+    RollingMeanSmoother,
+    EwmaSmoother,
+    MedianSmoother,
+    create_smoother
+)
+
+
+class RingBufferTestCase(unittest.TestCase):
+    def test_overwrites_oldest_value_when_full(self):
+        sut = RingBuffer(3)
+        for i in range(3):
+            self.assertIsNone(sut.push(i, i))
+        self.assertEqual(0, sut.push(3, 3))
+        self.assertEqual([1, 2, 3], list(sut.values()))
+
+    def test_pops_values_older_than_timestamp(self):
+        sut = RingBuffer(3)
+        for i in range(5):
+            sut.push(i, i * 100)
+        self.assertEqual(2 + 3, sut.pop_older_than(400))
+        self.assertEqual([4], list(sut.values()))
+        self.assertEqual(4, sut.pop_older_than(1000))
+        self.assertEqual(0, len(sut))
+
+
+class RollingMeanSmootherTestCase(unittest.TestCase):
+    def test_gets_mean_of_values_within_window(self):
+        sut = RollingMeanSmoother(1000)
+        self.assertEqual(100, sut.add(100, 0))
+        self.assertEqual(150, sut.add(200, 250))
+        self.assertEqual(200, sut.add(300, 500))
+        self.assertAlmostEqual(800 / 3.0, sut.add(300, 1100))  # evicts 100
+        self.assertEqual(300, sut.value(1600))
+        self.assertIsNone(sut.value(2200))
+
+    def test_gets_mean_of_most_recent_values_when_full(self):
+        sut = RollingMeanSmoother(1000, capacity=2)
+        sut.add(1, 0)
+        sut.add(2, 1)
+        self.assertEqual(2.5, sut.add(3, 2))
+
+
+class EwmaSmootherTestCase(unittest.TestCase):
+    def test_weights_values_by_age(self):
+        sut = EwmaSmoother(1000)
+        self.assertEqual(100, sut.add(100, 0))
+        self.assertEqual(100, sut.add(200, 0))
+        self.assertAlmostEqual(100 + 100 * 0.6321205588, sut.add(200, 1000))
+        self.assertLess(sut.add(200, 5000), 200)
+        self.assertGreater(sut.value(5000), 199)
+
+    def test_gets_none_when_stale(self):
+        sut = EwmaSmoother(1000)
+        self.assertIsNone(sut.value(0))
+        sut.add(100, 0)
+        self.assertIsNone(sut.value(1001))
+
+
+class MedianSmootherTestCase(unittest.TestCase):
+    def test_rejects_spikes(self):
+        sut = MedianSmoother(1000)
+        sut.add(200, 0)
+        sut.add(210, 250)
+        self.assertEqual(210, sut.add(2000, 500))
+        self.assertEqual(215, sut.add(220, 750))
+        self.assertEqual(220, sut.value(1600))
+
+
+class CreateSmootherTestCase(unittest.TestCase):
+    def test_creates_smoother_of_kind(self):
+        self.assertIsInstance(create_smoother('mean', 1000),
+                              RollingMeanSmoother)
+        self.assertIsInstance(create_smoother('ewma', 1000), EwmaSmoother)
+        self.assertIsInstance(create_smoother('median', 1000), MedianSmoother)
+        self.assertRaises(ValueError, create_smoother, 'mode', 1000)
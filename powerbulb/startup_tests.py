@@ -0,0 +1,143 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from powerbulb.profiling import StartupProfiler
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules that are slow to import (e.g. several seconds on a Pi Zero).
+_HEAVY_MODULES = ('ant', 'jsonpickle', 'lifxlan', 'numpy', 'rx')
+
+# The time allowed to import app.py (generous, to allow for slow machines).
+_IMPORT_BUDGET_S = 0.5
+
+# The time allowed from starting app.py until the riders have started (while
+# the light is dark), including importing the dependencies.
+_START_BUDGET_S = 2.0
+
+# A rider on the simulator (so that no ANT device is needed), whose bulb is
+# never contacted during startup.
+_START_CONFIGURATION = {
+    'path': 'simulator',
+    'device': {'type': 'power', 'number': 0},
+    'bulb': {'ip': '127.0.0.1', 'mac': 'd0:73:d5:00:00:00'},
+    'color_map': 'colors/ftp.cmap'
+}
+
+_IMPORT_SCRIPT = """
+import json, sys
+from timeit import default_timer
+started_at = default_timer()
+import {module}
+elapsed = default_timer() - started_at
+print(json.dumps({{
+    'elapsed': elapsed,
+    'modules': sorted(set(name.split('.')[0] for name in sys.modules))
+}}))
+"""
+
+_START_SCRIPT = """
+import json, sys
+from timeit import default_timer
+started_at = default_timer()
+import app
+from powerbulb.profiling import StartupProfiler
+
+class Profiler(StartupProfiler):
+    def mark(self, name):
+        StartupProfiler.mark(self, name)
+        if name == 'start riders':
+            raise KeyboardInterrupt()  # Stops (as if interrupted) once started.
+
+profiler = Profiler(started_at)
+profiler.mark('import app')
+app.main(json.loads(sys.argv[1]), profiler=profiler)
+print(json.dumps({'elapsed': profiler.total, 'stages': profiler.stages}))
+"""
+
+
+def import_module(module):
+    """
+    Imports `module` in a new interpreter.
+    :return: The time taken and the top-level modules that were imported.
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c', _IMPORT_SCRIPT.format(module=module)],
+        cwd=_ROOT)
+    result = json.loads(output.decode('utf-8'))
+    return result['elapsed'], set(result['modules'])
+
+
+def start_app(configuration):
+    """
+    Runs app.py with `configuration` in a new interpreter until its riders
+    have started.
+    :return: The time taken and the (name, elapsed) stages of startup.
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c', _START_SCRIPT, json.dumps(configuration)],
+        cwd=_ROOT)
+    # The result follows anything logged (to stdout) by the app.
+    result = json.loads(output.decode('utf-8').splitlines()[-1])
+    return result['elapsed'], [tuple(stage) for stage in result['stages']]
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_app_imports_quickly(self):
+        elapsed, modules = import_module('app')
+
+        self.assertEqual(set(), modules.intersection(_HEAVY_MODULES))
+        self.assertLess(elapsed, _IMPORT_BUDGET_S)
+
+    def test_app_starts_riders_quickly(self):
+        elapsed, stages = start_app(_START_CONFIGURATION)
+
+        self.assertEqual('start riders', stages[-1][0])
+        self.assertLess(elapsed, _START_BUDGET_S, stages)
+
+    def test_colors_does_not_import_numpy(self):
+        _, modules = import_module('powerbulb.colors')
+
+        self.assertNotIn('numpy', modules)
+        self.assertNotIn('jsonpickle', modules)
+
+    def test_ride_log_does_not_import_numpy(self):
+        _, modules = import_module('powerbulb.ridelog')
+
+        self.assertNotIn('numpy', modules)
+
+    def test_bulb_does_not_import_lifxlan(self):
+        _, modules = import_module('powerbulb.bulb')
+
+        self.assertNotIn('lifxlan', modules)
+
+
+class StartupProfilerTestCase(unittest.TestCase):
+    def test_measures_stages(self):
+        times = iter([1.0, 1.5, 1.75])
+        sut = StartupProfiler(0.5, clock=lambda: next(times))
+
+        sut.mark('first')
+        sut.mark('second')
+        sut.mark('third')
+
+        self.assertEqual([('first', 0.5), ('second', 0.5), ('third', 0.25)],
+                         sut.stages)
+        self.assertEqual(1.25, sut.total)
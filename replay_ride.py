@@ -0,0 +1,109 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import logging
+import sys
+
+from rx.subjects import Subject
+from rx.testing import TestScheduler
+
+from powerbulb import load_configuration
+from powerbulb.bulb import LightBulb
+from powerbulb.colors import ColorMap
+from powerbulb.net import AntDataSourceFactory, POWER_MODE_INSTANTANEOUS
+from powerbulb.recording import AntReplayChannel
+from powerbulb.runtime import create_bulb, create_controller, get_riders
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+_LOGGER = logging.getLogger('powerbulb')
+
+
+class LoggingLightBulb(LightBulb):
+    def get_power(self):
+        return True
+
+    def turn_on(self):
+        pass
+
+    def turn_off(self):
+        pass
+
+    def set_color(self, color, duration=0):
+        _LOGGER.info('color=%s duration=%d', color, duration)
+
+
+class ReplayValues(Subject):
+    """
+    The values of a replayed source, which never time out (a pause in the
+    recording is not a lost sensor, and the timeout would otherwise be in
+    real rather than replay time).
+    """
+
+    def __init__(self, timeout_ms, on_timeout=None):
+        super(ReplayValues, self).__init__()
+
+    def close(self):
+        pass
+
+
+def get_rider(configuration, name=None):
+    riders = get_riders(configuration)
+    if name is None:
+        return riders[0]
+    for rider in riders:
+        if rider['name'] == name:
+            return rider
+    raise ValueError("'{}' is not a rider".format(name))
+
+
+def main(rider, filename, speed, dry_run):
+    device = rider['device']
+    channel = AntReplayChannel(filename)
+    source = AntDataSourceFactory(values_factory=ReplayValues).create(
+        device['type'], channel,
+        power_mode=device.get('power_mode', POWER_MODE_INSTANTANEOUS))
+    bulb = LoggingLightBulb() if dry_run else create_bulb(rider)
+    # Replaying as fast as possible runs the controller in virtual time.
+    scheduler = None if speed else TestScheduler()
+    controller = create_controller(source, bulb,
+                                   ColorMap.load(rider['color_map']), rider,
+                                   scheduler)
+    try:
+        with controller:
+            count = channel.replay(speed, scheduler)
+        _LOGGER.info('replayed messages=%d', count)
+    finally:
+        source.close()
+        bulb.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Replays a recorded ride through a rider\'s pipeline.')
+    parser.add_argument('--configuration', '-c', type=str, required=True,
+                        help='The configuration file path.')
+    parser.add_argument('--rider', '-r', type=str,
+                        help='The rider (by default the first rider).')
+    parser.add_argument('--speed', '-s', type=float, default=1.0,
+                        help='The multiple of real time at which to replay '
+                             '(0 to replay as fast as possible).')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Log the colors instead of setting the bulb.')
+    parser.add_argument('recording', type=str,
+                        help='The recording file path.')
+    args = parser.parse_args()
+    main(get_rider(load_configuration(args.configuration), args.rider),
+         args.recording, args.speed, args.dry_run)
@@ -0,0 +1,65 @@
+# Copyright 2017 Martin Galpin (galpin@gmail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+
+from powerbulb.ridelog import RideLog
+
+_ZONES = ('Z1', 'Z2', 'Z3', 'Z4', 'Z5', 'Z6')
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{:d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+def format_value(value):
+    # A column is None when every value is missing (NaN).
+    return '-' if value is None else '{:.0f}'.format(value)
+
+
+def main(filename, ftp):
+    import numpy as np
+    ride_log = RideLog(filename)
+    duration = ride_log.get_duration()
+    print('Updates:  {}'.format(len(ride_log)))
+    print('Duration: {}'.format(format_duration(duration)))
+    if not len(ride_log):
+        return
+    print('Average:  {}'.format(format_value(ride_log.get_mean())))
+    print('Maximum:  {}'.format(format_value(ride_log.get_max())))
+    latencies = ride_log['send_ms']
+    latencies = latencies[~np.isnan(latencies)]
+    if len(latencies):
+        print('Send:     p50={:.1f}ms p95={:.1f}ms max={:.1f}ms'.format(
+            np.percentile(latencies, 50), np.percentile(latencies, 95),
+            latencies.max()))
+    if ftp is not None:
+        for zone, seconds in zip(_ZONES, ride_log.get_time_in_ftp_zones(ftp)):
+            print('{}:       {} ({:.0%})'.format(
+                zone, format_duration(seconds),
+                seconds / duration if duration else 0.0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Summarizes a ride log (see the ride_log setting).')
+    parser.add_argument('--ftp', type=int,
+                        help='The FTP value, specified in W (to summarize '
+                             'the time in each zone).')
+    parser.add_argument('ride_log', type=str,
+                        help='The ride log file path.')
+    args = parser.parse_args()
+    main(args.ride_log, args.ftp)
@@ -19,7 +19,7 @@ import time
 
 from powerbulb import load_configuration
 from powerbulb.bulb import LifxLightBulb
-from powerbulb.colors import ColorMap
+from powerbulb.colors import Color, ColorMap
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
@@ -31,10 +31,11 @@ def main(configuration, min, max, step, delay):
                          configuration['bulb']['mac'])
     color_map = ColorMap.load(configuration['color_map'])
 
-    for value in range(min, max + step, step):
+    values = range(min, max + step, step)
+    colors = color_map.get_colors(values)
+    for value, color in zip(values, colors):
         _LOGGER.info('value = %d', value)
-        color = color_map.get_color(value)
-        bulb.set_color(color)
+        bulb.set_color(Color(*color))
         time.sleep(delay)
 
 